@@ -1,18 +1,24 @@
-import threading
-from typing import List, Tuple, Dict, Any
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Any, Optional
 
+from apscheduler.triggers.cron import CronTrigger
+
+from app import schemas
+from app.core.config import settings
 from app.core.event import eventmanager, Event
 from app.plugins import _PluginBase
 from app.schemas import WebhookEventInfo
 from app.schemas.types import EventType
 from .skip_helper import *
+from .episode_queue import NewEpisodeQueue, EpisodeJob
+from .debounce import Debouncer
+from .backfill import IntroSkipBackfill
+from .fingerprint import IntroDetector
+from .store import WriteBehindStore
 from app.log import logger
 from app.core.meta import MetaBase
 
-handle_threading = []
-lock = threading.Lock()
-threading_event = threading.Event()
-
 
 class Ad(_PluginBase):
     # 插件名称
@@ -22,7 +28,7 @@ class Ad(_PluginBase):
     # 插件图标
     plugin_icon = "https://raw.githubusercontent.com/honue/MoviePilot-Plugins/main/icons/chapter.png"
     # 插件版本
-    plugin_version = "1.0.0"
+    plugin_version = "1.1.0"
     # 插件作者
     plugin_author = "nlxingji"
     # 作者主页
@@ -41,69 +47,160 @@ class Ad(_PluginBase):
     _include: str = ''
     _exclude: str = ''
     _spec = ''
+    _workers: int = 4
+    _timeout: int = 30
+    _debounce: int = 15
+    # 媒体服务器，留空为全部Emby服务器
+    _mediaservers: List[str] = []
+    # 播放事件防抖
+    _debouncer: Optional[Debouncer] = None
+    # 新集入库标记队列
+    _queue: Optional[NewEpisodeQueue] = None
+    # 关键词、特别指定时间规则
+    _matcher: Optional[RuleMatcher] = None
+    # 全库补标记
+    _backfill: Optional[IntroSkipBackfill] = None
+    _backfill_cron: str = ''
+    _backfill_batch: int = 50
+    _backfill_interval: int = 2
+    # 音频指纹识别片头片尾
+    _auto_detect: bool = False
+    _detect_episodes: int = 3
+    _path_map: str = ''
+    _detector: Optional[IntroDetector] = None
+    _detect_executor: Optional[ThreadPoolExecutor] = None
+    _detecting: Optional[set] = None
+    # 插件数据写回缓存
+    _store: Optional[WriteBehindStore] = None
+    # 剧集时长缓存、补标记断点存储键
+    _runtime_key = "__runtime_cache__"
+    _backfill_key = "__backfill__"
+    _begin_sec: int = 240
+    _end_sec: int = 360
 
     def init_plugin(self, config: dict = None):
+        self.stop_service()
         if config:
             self._enable = config.get("enable") or False
             self._user = config.get("user") or ""
-            self._begin_min = str(config.get("begin_min")) or '4'
-            self._end_min = str(config.get("end_min")) or '6'
+            self._begin_min = str(config.get("begin_min") or '4')
+            self._end_min = str(config.get("end_min") or '6')
             # 关键词
             self._include = config.get("include") or ''
             self._exclude = config.get("exclude") or ''
             # 特别指定开始 结束时间
             self._spec = config.get("spec") or ''
+            # 批量标记并发数、单个请求超时
+            self._workers = int(config.get("workers") or 4)
+            self._timeout = int(config.get("timeout") or 30)
+            # 防抖窗口期，0为不合并
+            self._debounce = int(config.get("debounce") if config.get("debounce") not in (None, '') else 15)
+            self._mediaservers = config.get("mediaservers") or []
+            # 全库补标记周期、每批集数、每批间隔
+            self._backfill_cron = config.get("backfill_cron") or ''
+            self._backfill_batch = int(config.get("backfill_batch") or 50)
+            # 音频指纹识别
+            self._auto_detect = config.get("auto_detect") or False
+            self._detect_episodes = max(2, int(config.get("detect_episodes") or 3))
+            self._path_map = config.get("path_map") or ''
+            self._backfill_interval = int(config.get("backfill_interval") if config.get("backfill_interval")
+                                          not in (None, '') else 2)
+
+        self._matcher = RuleMatcher(include=self._include, exclude=self._exclude, spec=self._spec)
+        self._begin_sec = self.trans_to_sec(self._begin_min)
+        self._end_sec = self.trans_to_sec(self._end_min)
+        # 正在识别的 (服务器, 剧集, 季)
+        self._detecting = set()
+        if not self._enable:
+            return
+
+        self._store = WriteBehindStore(load_all=self.__load_all_data, load=self.get_data, save=self.save_data)
+        self._store.start()
+        # 重新读取媒体服务器配置
+        emby_registry.refresh()
+        emby_registry.load_runtimes(self._store.get(self._runtime_key))
+
+        self._debouncer = Debouncer(handler=self.__apply_decision, window=self._debounce)
+        self._queue = NewEpisodeQueue(handler=self.__mark_new_episodes)
+        self._queue.start()
+        if self._auto_detect:
+            if IntroDetector.available():
+                self._detector = IntroDetector(cache_dir=self.get_data_path() / "fingerprints",
+                                               head_sec=self._begin_sec, tail_sec=self._end_sec)
+                self._detect_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='introskip-detect')
+            else:
+                logger.error("音频指纹识别需要安装 numpy：pip install numpy")
+        self._backfill = IntroSkipBackfill(load_state=lambda: self._store.get(self._backfill_key),
+                                           save_state=lambda state: self._store.set(self._backfill_key, state),
+                                           batch_size=self._backfill_batch, interval=self._backfill_interval,
+                                           workers=self._workers, timeout=self._timeout)
 
     @eventmanager.register(EventType.WebhookMessage)
     def hook(self, event: Event):
+        if not self._store:
+            return
         event_info: WebhookEventInfo = event.event_data
+        if event_info.event == 'library.new' and event_info.media_type == 'Episode':
+            # 新集已入库，提前处理等待中的标记任务
+            if self._queue:
+                series_name = event_info.item_name.split(' S')[0] if event_info.item_name else None
+                self._queue.wake(series_id=event_info.item_id, series_name=series_name)
+            return
         if event_info.event not in ['playback.unpause', 'playback.stop'] or event_info.media_type != 'Episode':
             # 'playback.pause' 'playback.start'
             return
         logger.info(' ')
+        server = self.__get_server(getattr(event_info, 'server_name', None))
+        if not server:
+            logger.info(f"{getattr(event_info, 'server_name', None)} 不在媒体服务器列表 {self._mediaservers} 里")
+            return
         if self._user and event_info.user_name not in self._user.split(','):
             logger.info(f"{event_info.user_name} 不在用户列表 {self._user} 里")
             return
 
-        include_ret = include_keyword(event_info.item_path, self._include)
-        exclude_ret = exclude_keyword(event_info.item_path, self._exclude)
-        if not include_ret.get('ret') or not exclude_ret.get('ret'):
-            if not include_ret.get('ret'):
-                logger.info(f"{event_info.item_path} 不包含任何关键词 {self._include} 不标记片头片尾")
-            else:
-                logger.info(f"{event_info.item_path} 包含关键词 {exclude_ret.get('msg')} 不标记片头片尾")
+        match_ret = self._matcher.match(event_info.item_path)
+        if match_ret.get('include') is None:
+            logger.info(f"{event_info.item_path} 不包含任何关键词 {self._include} 不标记片头片尾")
+            return
+        if match_ret.get('exclude') is not None:
+            logger.info(f"{event_info.item_path} 包含关键词 {match_ret.get('exclude')} 不标记片头片尾")
             return
 
         logger.debug(event_info)
 
-        begin_time = self._begin_min
-        end_time = self._end_min
+        # 没有片头片尾信息的剧集，后台识别
+        if self._detector and ' S' in event_info.item_name:
+            series_name = event_info.item_name[:event_info.item_name.index(' S')]
+            if not self._store.get(series_name):
+                self.submit_detect(series_id=event_info.item_id, series_name=series_name,
+                                   season_id=event_info.season_id, server=server)
+
+        begin_sec = self._begin_sec
+        end_sec = self._end_sec
 
         # 特别指定时间
         manual = False
-        spec_conf = self._spec.split('\n') if self._spec else []
-        for spec in spec_conf[::-1]:
-            if spec.endswith('*'):
-                manual = True
-                spec = spec[:-1]
-            word, spec_begin, spec_end = spec.split('#')
-            if word in event_info.item_path:
-                begin_time = spec_begin
-                end_time = spec_end
-                if not manual:
-                    logger.info(f"受关键词 {word} 限定，片头最晚结束于{begin_time}，片尾最早开始于末尾{end_time}")
-                else:
-                    logger.info(f"受关键词 {word} 限定，片头结束于{begin_time}，片尾开始于-{end_time}")
-                break
+        if match_ret.get('spec'):
+            word, begin_sec, end_sec, manual = match_ret.get('spec')
+            if not manual:
+                logger.info(f"受关键词 {word} 限定，片头最晚结束于{begin_sec}秒，片尾最早开始于末尾{end_sec}秒")
+            else:
+                logger.info(f"受关键词 {word} 限定，片头结束于{begin_sec}秒，片尾开始于-{end_sec}秒")
 
         # 当前正在播放集的信息
         current_percentage = event_info.percentage
         current_video_item_id = get_current_video_item_id(item_id=event_info.item_id, season_id=event_info.season_id,
-                                                          episode_id=event_info.episode_id)
-        total_sec = get_total_time(current_video_item_id)
+                                                          episode_id=event_info.episode_id, server=server)
+        if current_video_item_id in (None, -1):
+            logger.info(f"{event_info.item_name} 未找到当前集，不标记片头片尾")
+            return
+        total_sec = get_total_time(current_video_item_id, server=server)
+        if not total_sec:
+            logger.info(f"{event_info.item_name} 无法获取总时长，不标记片头片尾")
+            return
         current_sec = int(current_percentage / 100 * total_sec)
 
-        if self.trans_to_sec(begin_time) < current_sec < (total_sec - self.trans_to_sec(end_time)):
+        if begin_sec < current_sec < (total_sec - end_sec):
             logger.info(
                 f"【不在时间段内】{event_info.item_name} {int(current_sec / 60)}分{int(current_sec % 60)}秒，不标记片头片尾")
             return
@@ -111,41 +208,87 @@ class Ad(_PluginBase):
         # 剧集在某集之后的所有剧集的item_id
         next_episode_ids = get_next_episode_ids(item_id=event_info.item_id,
                                                 season_id=event_info.season_id,
-                                                episode_id=event_info.episode_id
-                                                )
+                                                episode_id=event_info.episode_id,
+                                                server=server)
         if next_episode_ids:
-            # 存储最新片头位置，新集入库使用本数据
-            space_idx = event_info.item_name.index(' S')
-            series_name = event_info.item_name[:space_idx]
-            chapter_info = self.get_data(series_name) or {"item_id": event_info.item_id,
-                                                          "intro_end": 0,
-                                                          "credits_start": 0}
+            intro_end = None
+            credits_start = None
             # 当前播放时间（s）在[开始,begin_min]之间，且是暂停播放后，恢复播放的动作，标记片头
-            if (current_sec < self.trans_to_sec(begin_time) and event_info.event == 'playback.unpause') or manual:
-                intro_end = self.trans_to_sec(begin_time) if manual else current_sec
-                # 批量标记之后的所有剧集，不影响已经看过的标记
-                for next_episode_id in next_episode_ids:
-                    update_intro(next_episode_id, intro_end)
-                chapter_info['intro_end'] = intro_end
-                logger.info(
-                    f"【恢复播放】{event_info.item_name} 后续剧集片头设置在 {int(intro_end / 60)}分{int(intro_end % 60)}秒 结束")
+            if (current_sec < begin_sec and event_info.event == 'playback.unpause') or manual:
+                intro_end = begin_sec if manual else current_sec
             # 当前播放时间（s）在[end_min,结束]之间，且是退出播放动作，标记片尾
             if (current_sec > (
-                    total_sec - self.trans_to_sec(end_time)) and event_info.event == 'playback.stop') or manual:
-                credits_start = (total_sec - self.trans_to_sec(end_time)) if manual else current_sec
-                for next_episode_id in next_episode_ids:
-                    update_credits(next_episode_id, credits_start)
-                chapter_info['credits_start'] = credits_start
-                logger.info(
-                    f"【退出播放】{event_info.item_name} 后续剧集片尾设置在 {int(credits_start / 60)}分{int(credits_start % 60)}秒 开始")
+                    total_sec - end_sec) and event_info.event == 'playback.stop') or manual:
+                credits_start = (total_sec - end_sec) if manual else current_sec
+            space_idx = event_info.item_name.index(' S')
+            series_name = event_info.item_name[:space_idx]
+            # 多次拖动进度只按最后一次标记
+            self._debouncer.submit(key=(server, series_name, event_info.user_name), decision={
+                "server": server,
+                "item_name": event_info.item_name,
+                "series_name": series_name,
+                "series_id": event_info.item_id,
+                "next_episode_ids": next_episode_ids,
+                "intro_end": intro_end,
+                "credits_start": credits_start
+            })
+        self.__save_runtimes()
 
-            self.save_data(series_name, chapter_info)
+    def __get_server(self, server_name: Optional[str]) -> Optional[str]:
+        """
+        事件对应的Emby服务器，不在所选服务器中返回None
+        """
+        names = emby_registry.names()
+        if server_name:
+            if server_name not in names or (self._mediaservers and server_name not in self._mediaservers):
+                return None
+            return server_name
+        if self._mediaservers:
+            return self._mediaservers[0]
+        return names[0] if names else None
+
+    def __apply_decision(self, decision: dict):
+        """
+        标记后续剧集，并存储最新片头片尾位置，新集入库使用本数据
+        """
+        server = decision.get("server")
+        item_name = decision.get("item_name")
+        series_name = decision.get("series_name")
+        intro_end = decision.get("intro_end")
+        credits_start = decision.get("credits_start")
+        chapter_info = self._store.get(series_name) or {"item_id": decision.get("series_id"),
+                                                      "intro_end": 0,
+                                                      "credits_start": 0}
+        # 记录剧集所在服务器，新集入库时使用
+        chapter_info['item_id'] = decision.get("series_id")
+        chapter_info['server'] = server
+        # 手动标记后不再使用指纹识别结果
+        chapter_info['detected'] = False
+        # 批量标记之后的所有剧集，不影响已经看过的标记
+        if intro_end is not None or credits_start is not None:
+            result = batch_apply_markers(decision.get("next_episode_ids"), intro_end=intro_end,
+                                         credits_start=credits_start, workers=self._workers, timeout=self._timeout,
+                                         server=server)
+            logger.info(f"{item_name} 后续 {result['total']} 集标记完成，"
+                        f"成功 {result['success']}，失败 {result['failed']}，耗时 {result['elapsed']}秒")
+        if intro_end is not None:
+            chapter_info['intro_end'] = intro_end
+            logger.info(
+                f"【恢复播放】{item_name} 后续剧集片头设置在 {int(intro_end / 60)}分{int(intro_end % 60)}秒 结束")
+        if credits_start is not None:
+            chapter_info['credits_start'] = credits_start
+            logger.info(
+                f"【退出播放】{item_name} 后续剧集片尾设置在 {int(credits_start / 60)}分{int(credits_start % 60)}秒 开始")
+
+        self._store.set(series_name, chapter_info)
 
     @eventmanager.register(EventType.TransferComplete)
     def episodes_hook(self, event: Event):
+        if not self._store:
+            return
         event_info: MetaBase = event.event_data.get("meta")
         series_name = event.event_data.get("mediainfo").title
-        chapter_info: dict = self.get_data(series_name) or {}
+        chapter_info: dict = self._store.get(series_name) or {}
 
         if not series_name:
             return
@@ -153,62 +296,165 @@ class Ad(_PluginBase):
             logger.info(f"【新集入库】{series_name} 没有设置过片头片尾信息，跳过")
             return
 
+        # 新集入库后剧集列表已变化
+        invalidate_episodes(chapter_info.get("item_id"), server=chapter_info.get("server"))
+
         logger.info(' ')
         if event_info.total_episode > 5:
             logger.info(f"【新集入库】本事件只处理追更订阅，跳过...")
             return
+        if not self._queue:
+            return
+
+        # 短时间大量入库合并为一个任务，后台等待媒体入库
+        episodes = event_info.episode_list or [event_info.begin_episode]
+        if self._queue.submit(series_name=series_name, series_id=chapter_info.get("item_id"),
+                              chapter_info=chapter_info, season=event_info.begin_season, episodes=episodes):
+            logger.info(f'【新集入库】{series_name} 加入待处理队列，等待媒体入库...')
+        else:
+            logger.info(f'【新集入库】{series_name} 已在待处理队列中，合并处理')
+
+    def __mark_new_episodes(self, job: EpisodeJob) -> bool:
+        """
+        标记新入库剧集，未全部入库时返回False稍后重试
+        """
+        # 新入库剧集的item_id
+        server = job.chapter_info.get("server")
+        next_episode_ids, missing = find_episode_ids(item_id=job.series_id, episodes=job.episodes, refresh=True,
+                                                     server=server)
+        if next_episode_ids:
+            logger.info(f'【新集入库】{job.series_name} 新入库剧集，item_id:{",".join(map(str, next_episode_ids))}')
+            # 查询到item_id后
+            # 批量标记新入库的剧集
+            intro_end = job.chapter_info.get("intro_end")
+            credits_start = job.chapter_info.get("credits_start")
+            result = batch_apply_markers(next_episode_ids, intro_end=intro_end, credits_start=credits_start,
+                                         workers=self._workers, timeout=self._timeout, server=server)
+            logger.info(f"【新集入库】{job.series_name} {result['total']} 集标记完成，"
+                        f"成功 {result['success']}，失败 {result['failed']}，耗时 {result['elapsed']}秒")
+            logger.info(
+                f"【新集入库】{job.series_name} {job} ，片头设置在 {int(intro_end / 60)}分{int(intro_end % 60)}秒 结束")
+            logger.info(
+                f"【新集入库】{job.series_name} {job} ，片尾设置在 {int(credits_start / 60)}分{int(credits_start % 60)}秒 开始")
+        # 识别得到的片头片尾，加入新集后重新识别
+        if job.chapter_info.get("detected") and self._detector:
+            for season in job.episodes:
+                self.submit_detect(series_id=job.series_id, series_name=job.series_name, season_id=season,
+                                   server=server)
+        self.__save_runtimes()
+        return missing == 0
+
+    def submit_detect(self, series_id: str, series_name: str, season_id: int, server: str = None) -> bool:
+        """
+        提交音频指纹识别任务，同一剧集同时只识别一次
+        """
+        if not self._detector or not self._detect_executor:
+            return False
+        key = (server, series_name, season_id)
+        if key in self._detecting:
+            return False
+        self._detecting.add(key)
+        logger.info(f"【指纹识别】{series_name} 第{season_id}季 加入识别队列")
+        self._detect_executor.submit(self.__detect, series_id, series_name, season_id, server)
+        return True
+
+    def __map_path(self, path: str) -> str:
+        """
+        媒体服务器路径转换为本地路径
+        """
+        for line in self._path_map.split('\n'):
+            if ':' not in line:
+                continue
+            remote, local = line.strip().split(':', 1)
+            if remote and path.startswith(remote):
+                return local + path[len(remote):]
+        return path
 
-        global handle_threading
-        # 短时间大量入库
-        with lock:
-            # 已加入待处理线程
-            if series_name in handle_threading:
-                logger.info(f'【新集入库】{series_name} 已在待处理队列中')
+    def __detect(self, series_id: str, series_name: str, season_id: int, server: str = None):
+        """
+        比较同季最新几集的音频，识别片头片尾并标记整季
+        """
+        try:
+            episodes = get_season_episode_files(series_id, season_id, server=server)
+            episodes = sorted(episodes, key=lambda x: x.get('index') or 0)[-self._detect_episodes:]
+            if len(episodes) < 2:
+                logger.info(f"【指纹识别】{series_name} 第{season_id}季 剧集不足2集，跳过")
                 return
-            # 未加入待处理线程
-            else:
-                handle_threading.append(series_name)
-
-        with lock:
-            handle_threading.remove(series_name)
-
-        cnt = 1
-        while True:
-            logger.info(f'【新集入库】{series_name} 休眠10s，等待媒体入库...')
-            threading_event.wait(10)
-            # 新入库剧集的item_id
-            next_episode_ids = get_next_episode_ids(item_id=chapter_info.get("item_id"),
-                                                    season_id=event_info.begin_season,
-                                                    episode_id=event_info.begin_episode)
-            if next_episode_ids:
-                break
-            cnt += 1
-            if cnt >= 12:
-                logger.error(f'【新集入库】长时间未查询到 {series_name} 最新集 item_id 放弃设定')
+            ret = self._detector.detect([{'key': f"{server}_{episode['item_id']}",
+                                          'path': self.__map_path(episode['path']),
+                                          'runtime': episode['runtime']} for episode in episodes])
+            if ret.get('intro_end') is None and ret.get('credits_start') is None:
+                logger.info(f"【指纹识别】{series_name} 第{season_id}季 未识别到片头片尾")
+                return
+            chapter_info = self._store.get(series_name) or {"intro_end": 0, "credits_start": 0}
+            if chapter_info.get("item_id") and not chapter_info.get("detected"):
+                logger.info(f"【指纹识别】{series_name} 已手动标记片头片尾，不覆盖")
                 return
+            chapter_info.update({"item_id": series_id, "server": server, "detected": True})
+            for key in ('intro_end', 'credits_start'):
+                if ret.get(key) is not None:
+                    chapter_info[key] = ret.get(key)
+            self._store.set(series_name, chapter_info)
+            result = batch_apply_markers([episode['item_id'] for episode in
+                                          get_season_episode_files(series_id, season_id, server=server)],
+                                         intro_end=ret.get('intro_end'), credits_start=ret.get('credits_start'),
+                                         workers=self._workers, timeout=self._timeout, server=server)
+            logger.info(f"【指纹识别】{series_name} 第{season_id}季 片头结束于 {ret.get('intro_end')}秒，"
+                        f"片尾开始于 {ret.get('credits_start')}秒，标记 {result['total']} 集，"
+                        f"成功 {result['success']}，失败 {result['failed']}")
+        except Exception as e:
+            logger.error(f"【指纹识别】{series_name} 识别失败：{str(e)}")
+        finally:
+            self._detecting.discard((server, series_name, season_id))
 
-        logger.info(f'【新集入库】{series_name} 新入库剧集，item_id:{",".join(map(str, next_episode_ids))}')
-
-        # 查询到item_id后
-        # 批量标记新入库的剧集
-        intro_end = chapter_info.get("intro_end")
-        for next_episode_id in next_episode_ids:
-            update_intro(next_episode_id, intro_end)
-        logger.info(
-            f"【新集入库】{series_name} {event_info.season_episode} ，片头设置在 {int(intro_end / 60)}分{int(intro_end % 60)}秒 结束")
-
-        credits_start = chapter_info.get("credits_start")
-        for next_episode_id in next_episode_ids:
-            update_credits(next_episode_id, credits_start)
-        logger.info(
-            f"【新集入库】{series_name} {event_info.season_episode} ，片尾设置在 {int(credits_start / 60)}分{int(intro_end % 60)}秒 开始")
-
-    def trans_to_sec(self, time_str: str):
-        if time_str.count(':'):
-            min, sec = time_str.split(':')
-            return int(min) * 60 + int(sec)
-        else:
-            return int(time_str) * 60
+    def __save_runtimes(self):
+        """
+        保存新增的剧集时长
+        """
+        if not self._store or not emby_registry.runtimes_changed():
+            return
+        # 写入时才复制有变化的服务器时长
+        self._store.set_lazy(self._runtime_key, emby_registry.dump_runtimes)
+
+    def get_series_chapter_info(self) -> Dict[str, dict]:
+        """
+        已保存片头片尾信息的全部剧集
+        """
+        series = {}
+        for key, chapter_info in self._store.items().items():
+            if key in (self._runtime_key, self._backfill_key):
+                continue
+            if isinstance(chapter_info, dict) and chapter_info.get("item_id"):
+                series[key] = chapter_info
+        return series
+
+    def __load_all_data(self) -> Dict[str, Any]:
+        """
+        读取插件全部数据
+        """
+        data = {}
+        for item in self.get_data() or []:
+            value = item.value
+            if isinstance(value, str) and value[:1] in ('{', '['):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            data[item.key] = value
+        return data
+
+    def backfill(self):
+        """
+        全库补标记
+        """
+        if not self._backfill:
+            return
+        if not self._backfill.start(self.get_series_chapter_info()):
+            logger.info("【补标记】已在运行中")
+
+    @staticmethod
+    def trans_to_sec(time_str: str):
+        return time_to_sec(time_str)
 
     def get_form(self) -> Tuple[List[dict], Dict[str, Any]]:
         """
@@ -325,6 +571,192 @@ class Ad(_PluginBase):
                             }
                         ]
                     },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSelect',
+                                        'props': {
+                                            'multiple': True,
+                                            'chips': True,
+                                            'clearable': True,
+                                            'model': 'mediaservers',
+                                            'label': '媒体服务器',
+                                            'hint': '留空为全部Emby服务器',
+                                            'items': [{"title": name, "value": name}
+                                                      for name in emby_registry.names()]
+                                        }
+                                    }
+                                ]
+                            }, {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'workers',
+                                            'label': '批量标记并发数',
+                                            'placeholder': '4',
+                                        }
+                                    }
+                                ]
+                            }, {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'timeout',
+                                            'label': '单个请求超时（秒）',
+                                            'placeholder': '30',
+                                        }
+                                    }
+                                ]
+                            }, {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'debounce',
+                                            'label': '播放事件合并窗口（秒）',
+                                            'placeholder': '15，0为不合并',
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'backfill_cron',
+                                            'label': '全库补标记周期',
+                                            'placeholder': '5位cron表达式，留空关闭',
+                                        }
+                                    }
+                                ]
+                            }, {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'backfill_batch',
+                                            'label': '补标记每批集数',
+                                            'placeholder': '50',
+                                        }
+                                    }
+                                ]
+                            }, {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'backfill_interval',
+                                            'label': '补标记每批间隔（秒）',
+                                            'placeholder': '2',
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'auto_detect',
+                                            'label': '音频指纹识别片头片尾',
+                                            'hint': '可选功能，需要 ffmpeg 和 numpy（pip install numpy）',
+                                            'persistent-hint': True,
+                                        }
+                                    }
+                                ]
+                            }, {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'detect_episodes',
+                                            'label': '识别比较集数',
+                                            'placeholder': '3',
+                                        }
+                                    }
+                                ]
+                            }, {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextarea',
+                                        'props': {
+                                            'model': 'path_map',
+                                            'rows': 1,
+                                            'auto-grow': True,
+                                            'label': '媒体路径映射',
+                                            'placeholder': 'Emby路径:本地路径，一行一个',
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
                     {
                         'component': 'VRow',
                         'content': [
@@ -386,6 +818,13 @@ class Ad(_PluginBase):
                                             'variant': 'tonal',
                                             'text': '目前回报暂停信息的只有emby官方的客户端(包括小秘)、网页端，所以只推荐这几个客户端的用户使用。'
                                         }
+                                    }, {
+                                        'component': 'VAlert',
+                                        'props': {
+                                            'type': 'success',
+                                            'variant': 'tonal',
+                                            'text': '开启音频指纹识别后，没有片头片尾信息的剧集在播放时会用ffmpeg解码同季最新几集的开头、结尾音频自动识别，需要能访问媒体文件并安装ffmpeg。'
+                                        }
                                     }
                                 ]
                             }, {
@@ -415,7 +854,17 @@ class Ad(_PluginBase):
             "include": '',
             "exclude": '',
             "spec": '',
-            "user": ''
+            "user": '',
+            "workers": 4,
+            "timeout": 30,
+            "debounce": 15,
+            "mediaservers": [],
+            "backfill_cron": '',
+            "backfill_batch": 50,
+            "backfill_interval": 2,
+            "auto_detect": False,
+            "detect_episodes": 3,
+            "path_map": ''
         }
 
     def get_state(self) -> bool:
@@ -424,11 +873,115 @@ class Ad(_PluginBase):
     def get_page(self) -> List[dict]:
         pass
 
+    def get_service(self) -> List[Dict[str, Any]]:
+        if self._enable and self._backfill_cron:
+            return [{
+                "id": "AdaptiveIntroSkipBackfill",
+                "name": "IntroSkip全库补标记",
+                "trigger": CronTrigger.from_crontab(self._backfill_cron),
+                "func": self.backfill,
+                "kwargs": {}
+            }]
+        return []
+
     def stop_service(self):
-        pass
+        try:
+            if self._detect_executor:
+                self._detect_executor.shutdown(wait=False, cancel_futures=True)
+                self._detect_executor = None
+                self._detector = None
+            if self._backfill:
+                self._backfill.stop()
+                self._backfill = None
+            if self._debouncer:
+                self._debouncer.flush()
+                self._debouncer = None
+            if self._queue:
+                self._queue.stop()
+                self._queue = None
+            self.__save_runtimes()
+        except Exception as e:
+            logger.error(f"停止插件服务出错：{str(e)}")
+        finally:
+            # 写回缓存中的数据、关闭连接
+            if self._store:
+                self._store.stop()
+                self._store = None
+            emby_registry.close()
 
-    def get_api(self):
-        pass
+    def get_api(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "path": "/emby_stats",
+                "endpoint": self.emby_stats,
+                "methods": ["GET"],
+                "summary": "Emby接口请求统计"
+            },
+            {
+                "path": "/backfill",
+                "endpoint": self.backfill_api,
+                "methods": ["GET"],
+                "summary": "IntroSkip全库补标记"
+            },
+            {
+                "path": "/detect",
+                "endpoint": self.detect_api,
+                "methods": ["GET"],
+                "summary": "音频指纹识别片头片尾"
+            },
+            {
+                "path": "/backfill_progress",
+                "endpoint": self.backfill_progress,
+                "methods": ["GET"],
+                "summary": "IntroSkip全库补标记进度"
+            }
+        ]
+
+    def backfill_api(self, apikey: str):
+        """
+        开始全库补标记，上次未完成时从断点继续
+        """
+        if apikey != settings.API_TOKEN:
+            return schemas.Response(success=False, message="API密钥错误")
+        if not self._backfill:
+            return schemas.Response(success=False, message="插件未启用")
+        if not self._backfill.start(self.get_series_chapter_info()):
+            return schemas.Response(success=False, message="已在运行中")
+        return schemas.Response(success=True, message="已开始")
+
+    def detect_api(self, series_id: str, series_name: str, season: int, apikey: str, server: str = None):
+        """
+        识别指定剧集某季的片头片尾
+        """
+        if apikey != settings.API_TOKEN:
+            return schemas.Response(success=False, message="API密钥错误")
+        if not self._detector:
+            return schemas.Response(success=False, message="未开启音频指纹识别")
+        if not self.submit_detect(series_id=series_id, series_name=series_name, season_id=int(season),
+                                  server=server or self.__get_server(None)):
+            return schemas.Response(success=False, message="已在识别中")
+        return schemas.Response(success=True, message="已加入识别队列")
+
+    def backfill_progress(self, apikey: str):
+        """
+        全库补标记进度
+        """
+        if apikey != settings.API_TOKEN:
+            return schemas.Response(success=False, message="API密钥错误")
+        if not self._backfill:
+            return schemas.Response(success=False, message="插件未启用")
+        return schemas.Response(success=True, data=self._backfill.progress())
+
+    def emby_stats(self, apikey: str):
+        """
+        Emby各接口请求次数、耗时，播放事件合并次数
+        """
+        if apikey != settings.API_TOKEN:
+            return schemas.Response(success=False, message="API密钥错误")
+        return schemas.Response(success=True, data={
+            "emby": emby_registry.stats(),
+            "debounce": self._debouncer.stats() if self._debouncer else {}
+        })
 
     def get_command(self):
         pass
\ No newline at end of file
@@ -0,0 +1,148 @@
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from app.log import logger
+
+from .skip_helper import iter_episode_pages, batch_apply_markers
+
+# 单部剧集连续出错的重试次数上限，超过后跳过该剧
+RETRY_LIMIT = 5
+# 出错重试的最长等待（秒）
+RETRY_MAX_DELAY = 600
+
+
+class IntroSkipBackfill:
+    """
+    全库补标记：按已保存的片头片尾信息，分页遍历每部剧的全部剧集并分批标记，支持断点续跑
+    """
+
+    def __init__(self, load_state: Callable[[], Optional[dict]], save_state: Callable[[dict], None],
+                 batch_size: int = 50, interval: float = 2, workers: int = 4, timeout: int = 30):
+        """
+        :param load_state: 读取断点
+        :param save_state: 保存断点
+        :param batch_size: 每批标记集数（分页大小）
+        :param interval: 每批间隔（秒），限制对Emby的请求速率
+        """
+        self.load_state = load_state
+        self.save_state = save_state
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.workers = workers
+        self.timeout = timeout
+        self._state: dict = self.load_state() or {}
+        self._thread: Optional[threading.Thread] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self, series: Dict[str, dict]) -> bool:
+        """
+        开始补标记，上次未完成时从断点继续
+        :param series: 剧集名称 -> 片头片尾信息
+        """
+        with self._lock:
+            if self.running:
+                return False
+            state = self.load_state() or {}
+            if state.get("pending"):
+                # 断点续跑，只保留仍有片头片尾信息的剧集
+                state["pending"] = [name for name in state["pending"] if name in series]
+                logger.info(f"【补标记】从断点继续，剩余 {len(state['pending'])} 部剧集")
+            else:
+                state = {
+                    "pending": list(series.keys()),
+                    "start_index": 0,
+                    "series_total": len(series),
+                    "series_done": 0,
+                    "episodes": 0,
+                    "success": 0,
+                    "failed": 0,
+                    "retries": 0,
+                    "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                }
+            state["finished_at"] = None
+            self._state = state
+            self._event.clear()
+            self._thread = threading.Thread(target=self.__run, args=(series,), name="introskip-backfill",
+                                            daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._event.set()
+        if self._thread:
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def progress(self) -> dict:
+        state = dict(self._state)
+        total = state.get("series_total") or 0
+        return {
+            "running": self.running,
+            "current": state["pending"][0] if state.get("pending") else None,
+            "series_total": total,
+            "series_done": state.get("series_done", 0),
+            "percentage": round(state.get("series_done", 0) / total * 100, 2) if total else 0,
+            "episodes": state.get("episodes", 0),
+            "success": state.get("success", 0),
+            "failed": state.get("failed", 0),
+            "started_at": state.get("started_at"),
+            "finished_at": state.get("finished_at"),
+        }
+
+    def __run(self, series: Dict[str, dict]):
+        state = self._state
+        logger.info(f"【补标记】开始，共 {state['series_total']} 部剧集")
+        while state["pending"] and not self._event.is_set():
+            series_name = state["pending"][0]
+            chapter_info = series.get(series_name) or {}
+            intro_end = chapter_info.get("intro_end") or None
+            credits_start = chapter_info.get("credits_start") or None
+            try:
+                if intro_end is not None or credits_start is not None:
+                    for next_index, episodes in iter_episode_pages(chapter_info.get("item_id"),
+                                                                   start_index=state.get("start_index") or 0,
+                                                                   limit=self.batch_size,
+                                                                   server=chapter_info.get("server")):
+                        result = batch_apply_markers([episode[2] for episode in episodes],
+                                                     intro_end=intro_end, credits_start=credits_start,
+                                                     workers=self.workers, timeout=self.timeout,
+                                                     server=chapter_info.get("server"))
+                        state["episodes"] += result["total"]
+                        state["success"] += result["success"]
+                        state["failed"] += result["failed"]
+                        state["start_index"] = next_index
+                        state["retries"] = 0
+                        self.save_state(state)
+                        if self._event.wait(self.interval):
+                            logger.info(f"【补标记】已停止，{series_name} 进度 {next_index} 集")
+                            return
+                logger.info(f"【补标记】{series_name} 完成")
+            except Exception as e:
+                # 保留断点，退避后从当前进度重试，连续出错超过上限才跳过
+                retries = (state.get("retries") or 0) + 1
+                if retries < RETRY_LIMIT:
+                    delay = min(RETRY_MAX_DELAY, max(1, self.interval) * 2 ** retries)
+                    logger.error(f"【补标记】{series_name} 处理异常：{str(e)}，{delay} 秒后第 {retries} 次重试")
+                    state["retries"] = retries
+                    self.save_state(state)
+                    if self._event.wait(delay):
+                        logger.info(f"【补标记】已停止，{series_name} 下次从第 {state.get('start_index') or 0} 集继续")
+                        return
+                    continue
+                logger.error(f"【补标记】{series_name} 处理异常：{str(e)}，已重试 {RETRY_LIMIT - 1} 次，跳过")
+            state["pending"].pop(0)
+            state["start_index"] = 0
+            state["retries"] = 0
+            state["series_done"] += 1
+            self.save_state(state)
+        if not state["pending"]:
+            state["finished_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.save_state(state)
+            logger.info(f"【补标记】全部完成，共 {state['episodes']} 集，"
+                        f"成功 {state['success']}，失败 {state['failed']}")
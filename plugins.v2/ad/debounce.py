@@ -0,0 +1,85 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable
+
+from app.log import logger
+
+
+class Debouncer:
+    """
+    播放事件防抖，同一 key 在窗口期内只保留最新的决定，窗口结束后执行一次
+    """
+
+    def __init__(self, handler: Callable[[Dict[str, Any]], None], window: float = 15, max_wait: float = 60):
+        """
+        :param handler: 执行合并后的决定
+        :param window: 窗口期（秒），期间有新事件则重新计时
+        :param max_wait: 最长等待（秒），持续拖动进度时也会按时执行
+        """
+        self.handler = handler
+        self.window = window
+        self.max_wait = max_wait
+        # key -> [决定, 首次提交时间, 定时器]
+        self._pending: Dict[Hashable, list] = {}
+        self._lock = threading.Lock()
+        self._counters = {'submitted': 0, 'collapsed': 0, 'applied': 0}
+
+    def submit(self, key: Hashable, decision: Dict[str, Any]):
+        """
+        提交决定，值为None的字段沿用窗口期内之前的决定
+        """
+        if self.window <= 0:
+            with self._lock:
+                self._counters['submitted'] += 1
+            self.__fire(decision)
+            return
+        with self._lock:
+            self._counters['submitted'] += 1
+            pending = self._pending.get(key)
+            now = time.monotonic()
+            if pending:
+                self._counters['collapsed'] += 1
+                pending[2].cancel()
+                merged = pending[0]
+                merged.update({k: v for k, v in decision.items() if v is not None})
+                first = pending[1]
+            else:
+                merged = dict(decision)
+                first = now
+            delay = max(0.0, min(self.window, first + self.max_wait - now))
+            entry = [merged, first, None]
+            entry[2] = threading.Timer(delay, self.__expire, args=(key, entry))
+            entry[2].daemon = True
+            self._pending[key] = entry
+            entry[2].start()
+
+    def flush(self):
+        """
+        立即执行所有待处理的决定
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for decision, _, timer in pending:
+            timer.cancel()
+            self.__fire(decision)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters, pending=len(self._pending))
+
+    def __expire(self, key: Hashable, entry: list):
+        with self._lock:
+            # 已被新事件替换
+            if self._pending.get(key) is not entry:
+                return
+            self._pending.pop(key)
+        self.__fire(entry[0])
+
+    def __fire(self, decision: Dict[str, Any]):
+        with self._lock:
+            self._counters['applied'] += 1
+        try:
+            self.handler(decision)
+        except Exception as e:
+            logger.error(f"处理播放事件异常：{str(e)}")
@@ -0,0 +1,161 @@
+import threading
+import time
+from typing import Callable, Dict, Optional, Set
+
+from app.log import logger
+
+
+class EpisodeJob:
+    """
+    某部剧待标记的新入库剧集，同一剧集短时间内多次入库合并为一个任务
+    """
+
+    def __init__(self, series_name: str, series_id: str, chapter_info: dict):
+        self.series_name = series_name
+        self.series_id = str(series_id)
+        self.chapter_info = chapter_info
+        # 季 -> 集
+        self.episodes: Dict[int, Set[int]] = {}
+        self.attempts = 0
+        self.due = 0.0
+
+    def add(self, season: int, episodes: list):
+        self.episodes.setdefault(season, set()).update(episodes)
+
+    def __str__(self):
+        return ",".join(f"S{season:02d}E{episode:02d}"
+                        for season in sorted(self.episodes) for episode in sorted(self.episodes[season]))
+
+
+class NewEpisodeQueue:
+    """
+    新集入库标记队列，后台线程按指数退避轮询，剧集入库后应用已保存的片头片尾
+    """
+
+    def __init__(self, handler: Callable[[EpisodeJob], bool],
+                 base_delay: float = 10, max_delay: float = 300, max_attempts: int = 8, wake_delay: float = 3):
+        """
+        :param handler: 处理任务，剧集已全部入库并标记返回True，否则稍后重试
+        :param base_delay: 首次查询延迟（秒），之后每次翻倍
+        :param max_delay: 最长查询间隔（秒）
+        :param max_attempts: 最多查询次数
+        :param wake_delay: 收到媒体库入库通知后的查询延迟（秒）
+        """
+        self.handler = handler
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.wake_delay = wake_delay
+        self._jobs: Dict[str, EpisodeJob] = {}
+        # 正在处理的任务数
+        self._running = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        with self._cond:
+            self._stopped = False
+        self._thread = threading.Thread(target=self.__run, name="introskip-new-episode", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def submit(self, series_name: str, series_id: str, chapter_info: dict, season: int, episodes: list) -> bool:
+        """
+        加入队列，已有同剧集任务时合并
+        :return: 是否为新任务
+        """
+        with self._cond:
+            job = self._jobs.get(series_name)
+            created = job is None
+            if created:
+                job = EpisodeJob(series_name, series_id, chapter_info)
+                job.due = time.monotonic() + self.base_delay
+                self._jobs[series_name] = job
+            job.chapter_info = chapter_info
+            job.add(season, episodes)
+            self._cond.notify_all()
+            return created
+
+    def wake(self, series_id: str = None, series_name: str = None):
+        """
+        媒体服务器通知有新入库，提前查询对应剧集
+        """
+        with self._cond:
+            for job in self._jobs.values():
+                if job.series_id == str(series_id) or job.series_name == series_name:
+                    job.due = min(job.due, time.monotonic() + self.wake_delay)
+                    self._cond.notify_all()
+
+    def pending(self) -> list:
+        with self._cond:
+            return [{"series_name": job.series_name, "episodes": str(job), "attempts": job.attempts}
+                    for job in self._jobs.values()]
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        等待全部任务（包括正在处理的）完成
+        :return: 超时返回False
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._jobs or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(timeout=remaining)
+        return True
+
+    def __run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = time.monotonic()
+                    due_jobs = [job for job in self._jobs.values() if job.due <= now]
+                    if due_jobs:
+                        break
+                    next_due = min((job.due for job in self._jobs.values()), default=None)
+                    self._cond.wait(timeout=None if next_due is None else next_due - now)
+                if self._stopped:
+                    return
+                for job in due_jobs:
+                    self._jobs.pop(job.series_name, None)
+                self._running += len(due_jobs)
+
+            for job in due_jobs:
+                job.attempts += 1
+                try:
+                    done = self.handler(job)
+                except Exception as e:
+                    logger.error(f"【新集入库】{job.series_name} 处理异常：{str(e)}")
+                    done = False
+                if not done:
+                    self.__retry(job)
+                with self._cond:
+                    self._running -= 1
+                    self._cond.notify_all()
+
+    def __retry(self, job: EpisodeJob):
+        if job.attempts >= self.max_attempts:
+            logger.error(f'【新集入库】长时间未查询到 {job.series_name} {job} item_id 放弃设定')
+            return
+        delay = min(self.base_delay * 2 ** job.attempts, self.max_delay)
+        logger.info(f'【新集入库】{job.series_name} {job} 未全部入库，{int(delay)}s 后重试')
+        with self._cond:
+            pending = self._jobs.get(job.series_name)
+            if pending:
+                # 处理期间又有新集入库，合并到新任务
+                for season, episodes in job.episodes.items():
+                    pending.add(season, list(episodes))
+                pending.attempts = max(pending.attempts, job.attempts)
+            else:
+                job.due = time.monotonic() + delay
+                self._jobs[job.series_name] = job
+            self._cond.notify_all()
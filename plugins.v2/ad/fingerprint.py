@@ -0,0 +1,218 @@
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from app.log import logger
+
+# 解码采样率，低采样率足够区分片头片尾音乐
+SAMPLE_RATE = 8000
+# 帧长、帧移（采样点），帧移即时间精度 64ms
+FRAME_SIZE = 1024
+HOP_SIZE = 512
+# 参与色度计算的频率范围
+MIN_FREQ = 80
+MAX_FREQ = 3500
+# 相似度平滑窗口（秒）、判定阈值、最短片段（秒）
+SMOOTH_SEC = 2
+SIMILARITY = 0.5
+MIN_SEGMENT_SEC = 15
+# 局部基线窗口（秒），减去附近帧的中位数，只保留特征的变化
+BASELINE_SEC = 10
+# 逐一验证的互相关候选偏移数，候选之间至少间隔（秒）
+CANDIDATES = 5
+CANDIDATE_GAP_SEC = 2
+
+
+def frames_to_sec(frames: int) -> float:
+    return frames * HOP_SIZE / SAMPLE_RATE
+
+
+def chroma_fingerprint(pcm: 'np.ndarray') -> 'np.ndarray':
+    """
+    PCM 转换为色度特征，每帧 12 维并归一化
+    :param pcm: 单声道 int16 采样
+    :return: (帧数, 12) float32
+    """
+    if len(pcm) < FRAME_SIZE:
+        return np.zeros((0, 12), dtype=np.float32)
+    samples = pcm.astype(np.float32) / 32768
+    count = 1 + (len(samples) - FRAME_SIZE) // HOP_SIZE
+    frames = np.lib.stride_tricks.as_strided(samples, shape=(count, FRAME_SIZE),
+                                             strides=(samples.strides[0] * HOP_SIZE, samples.strides[0]))
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE).astype(np.float32), axis=1))
+    freqs = np.fft.rfftfreq(FRAME_SIZE, 1 / SAMPLE_RATE)
+    valid = (freqs >= MIN_FREQ) & (freqs <= MAX_FREQ)
+    # 频点映射到 12 个半音
+    pitch = np.round(12 * np.log2(freqs[valid] / 440)).astype(int) % 12
+    chroma = np.zeros((count, 12), dtype=np.float32)
+    for idx in range(12):
+        chroma[:, idx] = spectrum[:, valid][:, pitch == idx].sum(axis=1)
+    chroma = np.log1p(chroma * 100)
+    norm = np.linalg.norm(chroma, axis=1, keepdims=True)
+    return chroma / np.maximum(norm, 1e-6)
+
+
+def remove_baseline(features: 'np.ndarray', window: int) -> 'np.ndarray':
+    """
+    减去滑动窗口内的中位数并逐帧归一化，噪声、底噪等稳定的成分不再产生相似度
+    :param window: 窗口帧数
+    """
+    window = max(1, min(window, len(features)))
+    padded = np.pad(features, ((window // 2, window - 1 - window // 2), (0, 0)), mode='edge')
+    baseline = np.median(np.lib.stride_tricks.sliding_window_view(padded, window, axis=0), axis=2)
+    centered = (features - baseline).astype(np.float32)
+    norm = np.linalg.norm(centered, axis=1, keepdims=True)
+    return centered / np.maximum(norm, 1e-6)
+
+
+def longest_run(similarity: 'np.ndarray') -> Tuple[int, int]:
+    """
+    平滑后相似度持续超过阈值的最长区间
+    :return: (开始帧, 结束帧)，没有时为 (0, 0)
+    """
+    smooth = max(1, int(SMOOTH_SEC * SAMPLE_RATE / HOP_SIZE))
+    similarity = np.convolve(similarity, np.ones(smooth) / smooth, mode='same')
+    matched = np.concatenate(([False], similarity >= SIMILARITY, [False]))
+    edges = np.flatnonzero(np.diff(matched.astype(np.int8)))
+    if not len(edges):
+        return 0, 0
+    starts, ends = edges[0::2], edges[1::2]
+    longest = int(np.argmax(ends - starts))
+    return int(starts[longest]), int(ends[longest])
+
+
+def find_shared_segment(a: 'np.ndarray', b: 'np.ndarray',
+                        min_sec: float = MIN_SEGMENT_SEC) -> Optional[Tuple[float, float, float, float]]:
+    """
+    查找两段特征中相同的片段：FFT 互相关按重叠长度归一化，取相关最高的几个偏移，
+    分别计算逐帧相似度，取持续超过阈值最长的区间
+    :return: (a开始, a结束, b开始, b结束) 秒，未找到返回None
+    """
+    min_frames = int(np.ceil(min_sec * SAMPLE_RATE / HOP_SIZE))
+    if len(a) < min_frames or len(b) < min_frames:
+        return None
+    window = int(BASELINE_SEC * SAMPLE_RATE / HOP_SIZE)
+    a_unit = remove_baseline(a, window)
+    b_unit = remove_baseline(b, window)
+    size = 1 << int(np.ceil(np.log2(len(a) + len(b))))
+    corr = np.fft.irfft(np.fft.rfft(a_unit, size, axis=0) *
+                        np.conj(np.fft.rfft(b_unit, size, axis=0)), size, axis=0).sum(axis=1)
+    # 下标 lag 表示 a[i + lag] 对应 b[i]，负值在数组尾部
+    lags = np.concatenate((np.arange(0, len(a)), np.arange(-(len(b) - 1), 0)))
+    corr = np.concatenate((corr[:len(a)], corr[size - len(b) + 1:]))
+    # 按重叠帧数归一化为平均相似度，重叠不足最短片段的偏移不参与
+    overlaps = np.minimum(len(a) - np.maximum(lags, 0), len(b) - np.maximum(-lags, 0))
+    score = np.where(overlaps >= min_frames, corr / np.maximum(overlaps, 1), -np.inf)
+
+    gap = max(1, int(CANDIDATE_GAP_SEC * SAMPLE_RATE / HOP_SIZE))
+    tried = []
+    best = None
+    for idx in np.argsort(score)[::-1]:
+        if len(tried) >= CANDIDATES or not np.isfinite(score[idx]):
+            break
+        lag = int(lags[idx])
+        # 跳过已验证偏移的相邻偏移
+        if any(abs(lag - other) < gap for other in tried):
+            continue
+        tried.append(lag)
+        a_start, b_start = max(lag, 0), max(-lag, 0)
+        overlap = int(overlaps[idx])
+        similarity = np.einsum('ij,ij->i', a_unit[a_start:a_start + overlap], b_unit[b_start:b_start + overlap])
+        start, end = longest_run(similarity)
+        if not best or end - start > best[3] - best[2]:
+            best = (a_start, b_start, start, end)
+    if not best or best[3] - best[2] < min_frames:
+        return None
+    a_start, b_start, start, end = best
+    return (frames_to_sec(a_start + start), frames_to_sec(a_start + end),
+            frames_to_sec(b_start + start), frames_to_sec(b_start + end))
+
+
+class IntroDetector:
+    """
+    音频指纹识别片头片尾：解码同季多集开头、结尾的音频，比较相同片段
+    """
+
+    def __init__(self, cache_dir: Path, head_sec: int, tail_sec: int, ffmpeg: str = None):
+        """
+        :param cache_dir: 指纹缓存目录
+        :param head_sec: 片头查找范围，开头多少秒
+        :param tail_sec: 片尾查找范围，结尾多少秒
+        """
+        self.cache_dir = cache_dir
+        self.head_sec = head_sec
+        self.tail_sec = tail_sec
+        self.ffmpeg = ffmpeg or shutil.which('ffmpeg') or 'ffmpeg'
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available() -> bool:
+        return np is not None
+
+    def decode(self, path: str, duration: int, from_end: bool = False) -> 'np.ndarray':
+        """
+        ffmpeg 解码为低采样率单声道 PCM
+        """
+        seek = ['-sseof', f'-{duration}'] if from_end else ['-ss', '0']
+        cmd = [self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin', *seek, '-i', path,
+               '-t', str(duration), '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-']
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=duration + 300)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.decode('utf-8', errors='ignore').strip()
+                               or f'ffmpeg 退出码 {result.returncode}')
+        return np.frombuffer(result.stdout, dtype=np.int16)
+
+    def fingerprint(self, key: str, path: str, part: str) -> 'np.ndarray':
+        """
+        获取指纹，优先读取磁盘缓存
+        :param key: 缓存键，如 服务器_item_id
+        :param part: head 开头 / tail 结尾
+        """
+        duration = self.head_sec if part == 'head' else self.tail_sec
+        cache_file = self.cache_dir / f'{key}_{part}_{duration}.npy'
+        if cache_file.exists():
+            try:
+                return np.load(cache_file).astype(np.float32)
+            except Exception as e:
+                logger.warn(f'指纹缓存 {cache_file} 读取失败：{str(e)}')
+        fingerprint = chroma_fingerprint(self.decode(path, duration, from_end=(part == 'tail')))
+        with self._lock:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            np.save(cache_file, fingerprint.astype(np.float16))
+        return fingerprint
+
+    def detect(self, episodes: List[dict]) -> dict:
+        """
+        比较相邻剧集，取多组结果的中位数
+        :param episodes: [{'key': 缓存键, 'path': 文件路径, 'runtime': 时长秒}]，至少两集
+        :return: {'intro_end': 秒或None, 'credits_start': 秒或None}
+        """
+        heads, tails = [], []
+        for episode in episodes:
+            try:
+                head = self.fingerprint(episode['key'], episode['path'], 'head')
+                tail = self.fingerprint(episode['key'], episode['path'], 'tail')
+                heads.append(head)
+                tails.append((tail, max(0.0, (episode.get('runtime') or 0) - self.tail_sec)))
+            except Exception as e:
+                logger.error(f"{episode['path']} 音频解码失败：{str(e)}")
+
+        intro_ends, credits_starts = [], []
+        for idx in range(1, len(heads)):
+            segment = find_shared_segment(heads[idx - 1], heads[idx])
+            if segment:
+                intro_ends += [segment[1], segment[3]]
+        for idx in range(1, len(tails)):
+            (prev, prev_offset), (cur, cur_offset) = tails[idx - 1], tails[idx]
+            segment = find_shared_segment(prev, cur)
+            if segment:
+                credits_starts += [prev_offset + segment[0], cur_offset + segment[2]]
+        return {'intro_end': int(np.median(intro_ends)) if intro_ends else None,
+                'credits_start': int(np.median(credits_starts)) if credits_starts else None}
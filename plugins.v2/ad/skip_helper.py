@@ -1,25 +1,340 @@
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-from app.helper.mediaserver import MediaServerHelper
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from app.helper.service import ServiceBaseHelper
 from app.schemas import MediaServerConf
 from app.schemas.types import SystemConfigKey, ModuleType
 from app.log import logger
 from datetime import datetime
 
-ServiceBase_Helper = ServiceBaseHelper(SystemConfigKey.MediaServers,MediaServerConf,ModuleType.MediaServer)
-media_server_config = ServiceBase_Helper.get_configs()
-emby_config = media_server_config['Emby'].config
-base_url = emby_config['host']
+# 连接池大小，一次播放事件会并发/连续请求几十次
+POOL_SIZE = 16
+# 连接超时、读取超时（秒）
+TIMEOUT = (5, 30)
+# 批量标记默认并发数
+WORKERS = 4
+# 剧集列表缓存有效期（秒）
+EPISODE_TTL = 600
+# 媒体服务器配置缓存有效期（秒）
+CONFIG_TTL = 60
+
+
+class RuntimeCache:
+    """
+    剧集时长缓存 item_id -> 秒，入库后时长不变，随插件数据持久化
+    """
+
+    def __init__(self):
+        self._runtimes = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def get(self, item_id):
+        with self._lock:
+            return self._runtimes.get(str(item_id))
+
+    def update(self, runtimes: dict):
+        with self._lock:
+            for item_id, runtime in runtimes.items():
+                if runtime and self._runtimes.get(str(item_id)) != runtime:
+                    self._runtimes[str(item_id)] = runtime
+                    self._dirty = True
+
+    def load(self, runtimes: dict):
+        with self._lock:
+            self._runtimes = dict(runtimes or {})
+            self._dirty = False
+
+    @property
+    def changed(self) -> bool:
+        with self._lock:
+            return self._dirty
+
+    def dump(self) -> dict:
+        """
+        有变化时返回全部数据并清除变化标记，无变化返回None
+        """
+        with self._lock:
+            if not self._dirty:
+                return None
+            self._dirty = False
+            return dict(self._runtimes)
+
+
+class EpisodeCache:
+    """
+    剧集列表缓存，按剧集 item_id 存储精简索引 [(季, 集, item_id, 时长秒)]
+    """
+
+    def __init__(self, client: 'EmbyClient', ttl: int = EPISODE_TTL):
+        self.client = client
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+        # 同一剧集并发请求时只拉取一次
+        self._series_locks = {}
+
+    def __series_lock(self, series_id: str) -> threading.Lock:
+        with self._lock:
+            return self._series_locks.setdefault(series_id, threading.Lock())
+
+    def get(self, series_id, refresh: bool = False) -> list:
+        series_id = str(series_id)
+        with self.__series_lock(series_id):
+            cached = self._cache.get(series_id)
+            if cached and not refresh and cached[0] > time.monotonic():
+                return cached[1]
+            episodes_info = self.client.get_json(f'Shows/{series_id}/Episodes')
+            episodes = []
+            for episode in episodes_info.get('Items') or []:
+                if episode.get('IndexNumber') is None or episode.get('ParentIndexNumber') is None:
+                    continue
+                runtime = (episode.get('RunTimeTicks') or 0) / 10000000
+                episodes.append((episode['ParentIndexNumber'], episode['IndexNumber'], episode['Id'], runtime))
+            episodes.sort(key=lambda x: (x[0], x[1]))
+            # 顺便缓存时长，避免再请求 PlaybackInfo
+            self.client.runtimes.update({episode[2]: episode[3] for episode in episodes})
+            with self._lock:
+                self._cache[series_id] = (time.monotonic() + self.ttl, episodes)
+            return episodes
+
+    def invalidate(self, series_id):
+        with self._lock:
+            self._cache.pop(str(series_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class EmbyClient:
+    """
+    Emby 请求客户端，复用连接池并统计各接口耗时
+    """
+
+    def __init__(self, host: str, apikey: str, pool_size: int = POOL_SIZE, timeout: tuple = TIMEOUT):
+        self.base_url = host
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'X-Emby-Token': apikey, 'Connection': 'keep-alive'})
+        retry = Retry(total=2, connect=2, read=0, backoff_factor=0.3, allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=retry, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self.runtimes = RuntimeCache()
+        self.episodes = EpisodeCache(self)
+
+    @staticmethod
+    def endpoint_name(path: str) -> str:
+        """
+        接口名称，去掉查询参数并将 item_id 归一，便于聚合统计
+        """
+        return re.sub(r'/\d+(?=/|$)', '/{id}', path.split('?')[0])
+
+    def get(self, path: str, params: dict = None, timeout=None) -> requests.Response:
+        endpoint = self.endpoint_name(path)
+        start = time.perf_counter()
+        error = False
+        try:
+            return self.session.get(f'{self.base_url}{path}', params=params, timeout=timeout or self.timeout)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.__record(endpoint, (time.perf_counter() - start) * 1000, error)
+
+    def get_json(self, path: str, params: dict = None, timeout=None):
+        response = self.get(path, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def __record(self, endpoint: str, cost_ms: float, error: bool):
+        with self._stats_lock:
+            stat = self._stats.setdefault(endpoint, {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stat['count'] += 1
+            stat['total_ms'] += cost_ms
+            stat['max_ms'] = max(stat['max_ms'], cost_ms)
+            if error:
+                stat['errors'] += 1
+
+    def stats(self) -> dict:
+        """
+        各接口请求次数、失败次数、平均/最大耗时（毫秒）
+        """
+        with self._stats_lock:
+            return {endpoint: {'count': stat['count'],
+                               'errors': stat['errors'],
+                               'avg_ms': round(stat['total_ms'] / stat['count'], 2) if stat['count'] else 0,
+                               'max_ms': round(stat['max_ms'], 2)}
+                    for endpoint, stat in self._stats.items()}
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats.clear()
+
+    def close(self):
+        self.session.close()
+
+
+class EmbyRegistry:
+    """
+    Emby 连接注册表，按媒体服务器名称懒加载客户端，配置变化时重建
+    """
+
+    def __init__(self):
+        self._clients = {}
+        # 服务器名称 -> (host, apikey)
+        self._fingerprints = {}
+        # 服务器名称 -> 持久化的剧集时长
+        self._runtimes = {}
+        # 重建、关闭连接时保留的时长尚未保存
+        self._runtimes_changed = False
+        # 手动注册、不读取系统配置的客户端，如压测用的模拟服务器
+        self._pinned = {}
+        self._lock = threading.Lock()
+        # 缓存的服务器配置及读取时间，避免每次请求都读取系统配置
+        self._configs = None
+        self._configs_time = 0.0
+
+    def configs(self) -> dict:
+        """
+        已启用的 Emby 服务器配置，缓存 CONFIG_TTL 秒，修改媒体服务器配置后最迟 CONFIG_TTL 秒生效
+        """
+        now = time.monotonic()
+        configs = self._configs
+        if configs is not None and now - self._configs_time < CONFIG_TTL:
+            return configs
+        configs = ServiceBaseHelper(SystemConfigKey.MediaServers, MediaServerConf,
+                                    ModuleType.MediaServer).get_configs() or {}
+        configs = {name: conf for name, conf in configs.items()
+                   if conf.type == 'emby' and conf.config and conf.config.get('host')}
+        self._configs, self._configs_time = configs, now
+        return configs
+
+    def refresh(self):
+        """
+        丢弃缓存的服务器配置，下次获取客户端时重新读取
+        """
+        self._configs = None
+
+    def names(self) -> list:
+        return list(self._pinned.keys()) + [name for name in self.configs().keys() if name not in self._pinned]
+
+    def register(self, name: str, client: EmbyClient):
+        """
+        注册客户端，优先于系统配置
+        """
+        with self._lock:
+            self._pinned[name] = client
+
+    def unregister(self, name: str):
+        with self._lock:
+            client = self._pinned.pop(name, None)
+        if client:
+            client.close()
+
+    @staticmethod
+    def format_host(host: str) -> str:
+        if not host.endswith("/"):
+            host += "/"
+        if not host.startswith("http"):
+            host = "http://" + host
+        return host
+
+    def get(self, name: str = None) -> EmbyClient:
+        """
+        获取客户端，未指定名称时使用第一个 Emby 服务器
+        """
+        pinned = self._pinned.get(name) if name else next(iter(self._pinned.values()), None)
+        if pinned:
+            return pinned
+        configs = self.configs()
+        if not name:
+            name = next(iter(configs), None)
+        conf = configs.get(name) if name else None
+        if not conf:
+            raise ValueError(f'请配置EMBY服务器 {name or ""}')
+        fingerprint = (self.format_host(conf.config.get('host')), conf.config.get('apikey'))
+        with self._lock:
+            client = self._clients.get(name)
+            if client and self._fingerprints.get(name) == fingerprint:
+                return client
+            if client:
+                logger.info(f'Emby服务器 {name} 配置已变化，重建连接')
+                self.__keep_runtimes(name, client)
+                client.close()
+            client = EmbyClient(*fingerprint)
+            client.runtimes.load(self._runtimes.get(name))
+            self._clients[name] = client
+            self._fingerprints[name] = fingerprint
+            return client
+
+    def clients(self) -> dict:
+        with self._lock:
+            return dict(self._clients)
+
+    def __keep_runtimes(self, name: str, client: EmbyClient):
+        runtimes = client.runtimes.dump()
+        if runtimes is not None:
+            self._runtimes[name] = runtimes
+            self._runtimes_changed = True
+
+    def load_runtimes(self, runtimes: dict):
+        """
+        加载持久化的剧集时长 {服务器名称: {item_id: 秒}}
+        """
+        with self._lock:
+            self._runtimes = dict(runtimes or {})
+            self._runtimes_changed = False
+            for name, client in self._clients.items():
+                client.runtimes.load(self._runtimes.get(name))
+
+    def runtimes_changed(self) -> bool:
+        """
+        是否有新增的剧集时长，不复制数据
+        """
+        with self._lock:
+            return self._runtimes_changed or any(client.runtimes.changed for client in self._clients.values())
 
-if base_url is None:
-    logger.error('请配置EMBY服务器')
+    def dump_runtimes(self):
+        """
+        有变化时返回全部服务器的剧集时长，无变化返回None，只复制有变化的服务器
+        """
+        with self._lock:
+            for name, client in self._clients.items():
+                self.__keep_runtimes(name, client)
+            if not self._runtimes_changed:
+                return None
+            self._runtimes_changed = False
+            return dict(self._runtimes)
 
-if not base_url.endswith("/"):
-    base_url += "/"
-if not base_url.startswith("http"):
-    base_url = "http://" + base_url
-api_key = emby_config['apikey']
-headers = {'X-Emby-Token': api_key}
+    def stats(self) -> dict:
+        clients = {**self.clients(), **self._pinned}
+        return {name: client.stats() for name, client in clients.items()}
+
+    def close(self):
+        with self._lock:
+            for name, client in self._clients.items():
+                self.__keep_runtimes(name, client)
+                client.close()
+            self._clients.clear()
+            self._fingerprints.clear()
+
+
+emby_registry = EmbyRegistry()
+
+
+def get_client(server: str = None) -> EmbyClient:
+    return emby_registry.get(server)
 
 
 def format_time(seconds):
@@ -30,90 +345,225 @@ def format_time(seconds):
     return formatted_time
 
 
-def get_next_episode_ids(item_id, season_id, episode_id) -> list:
+def get_next_episode_ids(item_id, season_id, episode_id, refresh: bool = False, server: str = None) -> list:
     try:
         ids = []
-        response = requests.get(f'{base_url}Shows/{item_id}/Episodes', headers=headers)
-        episodes_info = response.json()
         # 查找下一集的 ID
-        for idx, episode in enumerate(episodes_info['Items']):
-            if episode['IndexNumber'] >= episode_id and season_id == episode['ParentIndexNumber']:
-                next_episode_item_id = episode['Id']
-                logger.debug(f'第{episode_id + idx}集的 item_ID 为: {next_episode_item_id}')
+        for season, index, next_episode_item_id, _ in get_client(server).episodes.get(item_id, refresh=refresh):
+            if index >= episode_id and season_id == season:
+                logger.debug(f'第{index}集的 item_ID 为: {next_episode_item_id}')
                 ids.append(next_episode_item_id)
         return ids
     except Exception as e:
         logger.error("异常错误：%s" % str(e))
 
 
-def get_current_video_item_id(item_id, season_id, episode_id):
+def find_episode_ids(item_id, episodes: dict, refresh: bool = False, server: str = None) -> tuple:
+    """
+    查询指定季集的 item_id
+    :param episodes: {季: {集}}
+    :return: 已入库的 item_id 列表, 未入库的集数
+    """
+    ids = []
+    found = set()
+    for season, index, episode_item_id, _ in get_client(server).episodes.get(item_id, refresh=refresh):
+        if index in episodes.get(season, ()):
+            ids.append(episode_item_id)
+            found.add((season, index))
+    missing = sum(len(indexes) for indexes in episodes.values()) - len(found)
+    return ids, missing
+
+
+def iter_episode_pages(item_id, start_index: int = 0, limit: int = 100, server: str = None):
+    """
+    分页读取剧集，避免一次拉取完整列表
+    :return: 生成器 (下一页起始位置, [(季, 集, item_id, 时长秒)])
+    """
+    emby = get_client(server)
+    while True:
+        page = emby.get_json('Items', params={'ParentId': item_id,
+                                              'Recursive': 'true',
+                                              'IncludeItemTypes': 'Episode',
+                                              'Fields': 'RunTimeTicks',
+                                              'SortBy': 'ParentIndexNumber,IndexNumber',
+                                              'SortOrder': 'Ascending',
+                                              'StartIndex': start_index,
+                                              'Limit': limit})
+        items = page.get('Items') or []
+        episodes = [(item.get('ParentIndexNumber'), item.get('IndexNumber'), item['Id'],
+                     (item.get('RunTimeTicks') or 0) / 10000000) for item in items]
+        emby.runtimes.update({episode[2]: episode[3] for episode in episodes})
+        start_index += len(items)
+        yield start_index, episodes
+        if not items or start_index >= (page.get('TotalRecordCount') or 0):
+            return
+
+
+def get_season_episode_files(item_id, season_id, server: str = None) -> list:
+    """
+    某季全部剧集的文件路径、时长
+    :return: [{'item_id', 'index', 'path', 'runtime'}]
+    """
+    episodes_info = get_client(server).get_json(f'Shows/{item_id}/Episodes',
+                                                params={'Season': season_id, 'Fields': 'Path,RunTimeTicks'})
+    return [{'item_id': episode['Id'],
+             'index': episode.get('IndexNumber'),
+             'path': episode.get('Path'),
+             'runtime': (episode.get('RunTimeTicks') or 0) / 10000000}
+            for episode in episodes_info.get('Items') or []
+            if episode.get('Path') and episode.get('ParentIndexNumber') == season_id]
+
+
+def invalidate_episodes(item_id, server: str = None):
+    """
+    剧集列表已变化，清除缓存
+    """
     try:
-        response = requests.get(f'{base_url}Shows/{item_id}/Episodes', headers=headers)
-        episodes_info = response.json()
-        # 查找当前集的 ID
-        for episode in episodes_info['Items']:
-            if episode['IndexNumber'] == episode_id and episode['ParentIndexNumber'] == season_id:
-                item_id = episode['Id']
-                logger.debug(f'第{episode_id}集的 item_ID 为: {item_id}')
-                return item_id
-        return -1
+        get_client(server).episodes.invalidate(item_id)
     except Exception as e:
         logger.error("异常错误：%s" % str(e))
 
 
-def update_intro(item_id, intro_end):
+def get_current_video_item_id(item_id, season_id, episode_id, server: str = None):
     try:
-        # 每次先移除旧的introskip
-        chapter_info = requests.get(f"{base_url}emby/chapter_api/get_chapters?id={item_id}",
-                                    headers=headers).json()
-        old_tags = [chapter['Index'] for chapter in chapter_info['chapters'] if
-                    chapter['MarkerType'].startswith('Intro')]
-        # 删除旧的
-        requests.get(
-            f"{base_url}emby/chapter_api/update_chapters?id={item_id}&index_list={','.join(map(str, old_tags))}&action=remove",
-            headers=headers)
-        # 添加新的片头开始
-        requests.get(
-            f"{base_url}emby/chapter_api/update_chapters?id={item_id}&action=add&name=%E7%89%87%E5%A4%B4&type=intro_start&time=00:00:00.000",
-            headers=headers)
-        # 新的片头结束
-        requests.get(
-            f"{base_url}emby/chapter_api/update_chapters?id={item_id}&action=add&name=%E7%89%87%E5%A4%B4%E7%BB%93%E6%9D%9F&type=intro_end&time={format_time(intro_end)}",
-            headers=headers)
-        return intro_end
+        emby = get_client(server)
+        # 查找当前集的 ID，缓存中没有时刷新一次剧集列表（可能是新入库的剧集）
+        for refresh in (False, True):
+            for season, index, current_item_id, _ in emby.episodes.get(item_id, refresh=refresh):
+                if index == episode_id and season == season_id:
+                    logger.debug(f'第{episode_id}集的 item_ID 为: {current_item_id}')
+                    return current_item_id
+        return -1
     except Exception as e:
         logger.error("异常错误：%s" % str(e))
 
 
-def update_credits(item_id, credits_start):
+# 片头片尾标记：(类型前缀, [(MarkerType, 名称, update_chapters type)])
+INTRO_MARKERS = [('IntroStart', '%E7%89%87%E5%A4%B4', 'intro_start'),
+                 ('IntroEnd', '%E7%89%87%E5%A4%B4%E7%BB%93%E6%9D%9F', 'intro_end')]
+CREDITS_MARKERS = [('CreditsStart', '%E7%89%87%E5%B0%BE', 'credits_start')]
+
+
+def normalize_time(time_str):
+    """
+    时:分:秒.毫秒 统一为 format_time 的格式，如 00:00:00.000 -> 0:00:00.000
+    """
     try:
-        chapter_info = requests.get(f"{base_url}emby/chapter_api/get_chapters?id={item_id}",
-                                    headers=headers).json()
-        old_tags = [chapter['Index'] for chapter in chapter_info['chapters'] if
-                    chapter['MarkerType'].startswith('Credits')]
+        hours, minutes, seconds = str(time_str).split(':')
+        return format_time(int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+    except ValueError:
+        return time_str
+
+
+def chapter_time(chapter: dict):
+    """
+    章节时间点，统一为 时:分:秒.毫秒
+    """
+    if chapter.get('StartPositionTicks') is not None:
+        return format_time(chapter['StartPositionTicks'] / 10000000)
+    return normalize_time(chapter.get('Time') or chapter.get('StartTime'))
+
+
+def diff_markers(chapters: list, prefix: str, markers: list, times: list) -> tuple:
+    """
+    比较现有标记与目标标记
+    :return: 需删除的章节 Index 列表, 需新增的 (名称, 类型, 时间) 列表
+    """
+    old = [chapter for chapter in chapters if chapter['MarkerType'].startswith(prefix)]
+    target = [(marker_type, name, type_, time_str) for (marker_type, name, type_), time_str in zip(markers, times)]
+    if sorted((chapter['MarkerType'], chapter_time(chapter)) for chapter in old) == \
+            sorted((marker_type, normalize_time(time_str)) for marker_type, _, _, time_str in target):
+        return [], []
+    return [chapter['Index'] for chapter in old], [(name, type_, time_str) for _, name, type_, time_str in target]
+
+
+def apply_markers(item_id, intro_end=None, credits_start=None, timeout=None, server: str = None) -> bool:
+    """
+    一次读取章节，只写入有变化的片头/片尾标记
+    """
+    if intro_end is None and credits_start is None:
+        return True
+    try:
+        emby = get_client(server)
+        chapters = emby.get_json(f"emby/chapter_api/get_chapters?id={item_id}",
+                                 timeout=timeout).get('chapters') or []
+        remove_tags, add_markers = [], []
+        if intro_end is not None:
+            tags, markers = diff_markers(chapters, 'Intro', INTRO_MARKERS,
+                                         [format_time(0), format_time(intro_end)])
+            remove_tags += tags
+            add_markers += markers
+        if credits_start is not None:
+            tags, markers = diff_markers(chapters, 'Credits', CREDITS_MARKERS, [format_time(credits_start)])
+            remove_tags += tags
+            add_markers += markers
+        if not remove_tags and not add_markers:
+            logger.debug(f'{item_id} 片头片尾标记无变化')
+            return True
         # 删除旧的
-        requests.get(
-            f"{base_url}emby/chapter_api/update_chapters?id={item_id}&index_list={','.join(map(str, old_tags))}&action=remove",
-            headers=headers)
-
-        # 添加新的片尾开始
-        requests.get(
-            f"{base_url}emby/chapter_api/update_chapters?id={item_id}&action=add&name=%E7%89%87%E5%B0%BE&type=credits_start&time={format_time(credits_start)}",
-            headers=headers)
-        return credits_start
+        if remove_tags:
+            emby.get(
+                f"emby/chapter_api/update_chapters?id={item_id}&index_list={','.join(map(str, remove_tags))}&action=remove",
+                timeout=timeout).raise_for_status()
+        # 添加新的
+        for name, type_, time_str in add_markers:
+            emby.get(
+                f"emby/chapter_api/update_chapters?id={item_id}&action=add&name={name}&type={type_}&time={time_str}",
+                timeout=timeout).raise_for_status()
+        return True
     except Exception as e:
         logger.error("异常错误：%s" % str(e))
+        return False
+
+
+def batch_apply_markers(item_ids: list, intro_end=None, credits_start=None,
+                        workers: int = WORKERS, timeout=None, server: str = None) -> dict:
+    """
+    并发标记多集
+    :param workers: 最大并发数，不超过连接池大小
+    :param timeout: 单个请求超时（秒）
+    :return: 总数、成功数、失败数、耗时（秒）
+    """
+    start = time.perf_counter()
+    item_ids = list(item_ids or [])
+    success = 0
+    if item_ids:
+        workers = max(1, min(int(workers or 1), POOL_SIZE, len(item_ids)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='introskip') as executor:
+            results = executor.map(lambda item_id: apply_markers(item_id, intro_end=intro_end,
+                                                                 credits_start=credits_start, timeout=timeout,
+                                                                 server=server),
+                                   item_ids)
+            success = sum(1 for ret in results if ret)
+    return {'total': len(item_ids),
+            'success': success,
+            'failed': len(item_ids) - success,
+            'elapsed': round(time.perf_counter() - start, 2)}
+
+
+def update_intro(item_id, intro_end, server: str = None):
+    if apply_markers(item_id, intro_end=intro_end, server=server):
+        return intro_end
+
+
+def update_credits(item_id, credits_start, server: str = None):
+    if apply_markers(item_id, credits_start=credits_start, server=server):
+        return credits_start
 
 
-def get_total_time(item_id):
+def get_total_time(item_id, server: str = None):
     try:
-        response = requests.get(f'{base_url}emby/Items/{item_id}/PlaybackInfo?api_key={api_key}')
-        video_info = response.json()
+        emby = get_client(server)
+        runtime = emby.runtimes.get(item_id)
+        if runtime:
+            return runtime
+        video_info = emby.get_json(f'emby/Items/{item_id}/PlaybackInfo')
         if video_info['MediaSources']:
             video_info = video_info['MediaSources'][0]
             total_time_ticks = video_info['RunTimeTicks']
             total_time_seconds = total_time_ticks / 10000000  # 将 ticks 转换为秒
             # logger.info(f"{video_info['Name']} 总时长为{total_time_seconds}秒")
+            emby.runtimes.update({item_id: total_time_seconds})
             return total_time_seconds
         else:
             logger.error("无法获取视频总时长")
@@ -123,30 +573,122 @@ def get_total_time(item_id):
         return 0
 
 
-def include_keyword(path: str, keywords: str) -> dict:
-    keyword_list: list = keywords.split(',')
-    flag = False
-    msg = ""
-    for keyword in keyword_list:
-        if keyword in path:
-            flag = True
-            msg = keyword
-            break
-    if flag:
-        return {'ret': True, 'msg': msg}
+def time_to_sec(time_str: str) -> int:
+    """
+    分:秒 或 分 转换为秒
+    """
+    time_str = str(time_str).strip()
+    if time_str.count(':'):
+        minute, sec = time_str.split(':')
+        return int(minute) * 60 + int(sec)
     else:
-        return {'ret': False, 'msg': ''}
+        return int(time_str) * 60
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick 多关键词匹配，一次扫描得到路径命中的全部关键词
+    """
+
+    def __init__(self, keywords: list):
+        # 节点：子节点、失败指针、命中的关键词序号
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for idx, keyword in enumerate(keywords):
+            # 空关键词会命中任意文本
+            if keyword:
+                self.__add(keyword, idx)
+        self.__build()
 
+    def __add(self, keyword: str, idx: int):
+        node = 0
+        for char in keyword:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+        self._output[node].append(idx)
 
-def exclude_keyword(path: str, keywords: str) -> dict:
-    keyword_list: list = keywords.split(',') if keywords else []
-    for keyword in keyword_list:
-        if keyword in path:
-            return {'ret': False, 'msg': keyword}
-    return {'ret': True, 'msg': ''}
+    def __build(self):
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for char, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
 
+    def search(self, text: str) -> set:
+        """
+        :return: 命中的关键词序号
+        """
+        matched = set()
+        node = 0
+        for char in text:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            if self._output[node]:
+                matched.update(self._output[node])
+        return matched
 
-if __name__ == '__main__':
-    # pause_time('7')
-    print(*get_next_episode_ids(5842, 2, 2))
-    # get_total_time(1847)
+
+class RuleMatcher:
+    """
+    包含/排除关键词与特别指定时间规则，配置变更时编译一次
+    """
+
+    def __init__(self, include: str = '', exclude: str = '', spec: str = ''):
+        self.include = self.split_keywords(include)
+        self.exclude = self.split_keywords(exclude)
+        # (关键词, 片头秒数, 片尾秒数, 是否指定时间点)
+        self.spec = []
+        for line in spec.split('\n') if spec else []:
+            line = line.strip()
+            if not line:
+                continue
+            manual = line.endswith('*')
+            try:
+                word, spec_begin, spec_end = (line[:-1] if manual else line).split('#')
+                word = word.strip()
+                if not word:
+                    raise ValueError(line)
+                self.spec.append((word, time_to_sec(spec_begin), time_to_sec(spec_end), manual))
+            except ValueError:
+                logger.error(f"特别指定时间格式错误：{line}")
+        # 全部关键词合并为一个自动机，记录 (类型, 序号)
+        self._rules = [('include', idx) for idx in range(len(self.include))] \
+            + [('exclude', idx) for idx in range(len(self.exclude))] \
+            + [('spec', idx) for idx in range(len(self.spec))]
+        self._automaton = KeywordAutomaton(self.include + self.exclude + [spec[0] for spec in self.spec])
+
+    @staticmethod
+    def split_keywords(keywords: str) -> list:
+        """
+        逗号分隔的关键词，忽略空白关键词（空关键词会命中所有路径）
+        """
+        return [keyword.strip() for keyword in (keywords or '').split(',') if keyword.strip()]
+
+    def match(self, path: str) -> dict:
+        """
+        :return: include 命中的包含关键词（未配置时为空字符串，未命中为None）
+                 exclude 命中的排除关键词，spec 命中的特别指定规则（多条命中时取最后一条）
+        """
+        hits = {'include': [], 'exclude': [], 'spec': []}
+        for rule in self._automaton.search(path or ''):
+            kind, idx = self._rules[rule]
+            hits[kind].append(idx)
+        if not self.include:
+            include = ''
+        else:
+            include = self.include[min(hits['include'])] if hits['include'] else None
+        return {'include': include,
+                'exclude': self.exclude[min(hits['exclude'])] if hits['exclude'] else None,
+                'spec': self.spec[max(hits['spec'])] if hits['spec'] else None}
@@ -0,0 +1,129 @@
+import copy
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from app.log import logger
+
+# 缓存未命中的占位
+_MISSING = object()
+
+
+class WriteBehindStore:
+    """
+    插件数据写回缓存：启动时一次性加载，读写都在内存，定时批量写入有变化的键
+    """
+
+    def __init__(self, load_all: Callable[[], Dict[str, Any]], load: Callable[[str], Any],
+                 save: Callable[[str, Any], None], interval: float = 30):
+        """
+        :param load_all: 读取全部数据
+        :param load: 读取单个键，内存中没有时使用
+        :param save: 写入单个键
+        :param interval: 写入间隔（秒）
+        """
+        self._load = load
+        self._save = save
+        self.interval = interval
+        self._data: Dict[str, Any] = {}
+        self._dirty = set()
+        # 写入时才生成值的键 -> 生成函数
+        self._lazy: Dict[str, Callable[[], Any]] = {}
+        self._lock = threading.RLock()
+        self._event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        try:
+            self._data = dict(load_all() or {})
+        except Exception as e:
+            logger.error(f"加载插件数据失败：{str(e)}")
+
+    def start(self):
+        self._event.clear()
+        self._thread = threading.Thread(target=self.__run, name="introskip-store", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def get(self, key: str) -> Any:
+        self.__resolve(key)
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._load(key)
+            with self._lock:
+                value = self._data.setdefault(key, value)
+        # 返回副本，修改后需 set 才会写入
+        return copy.deepcopy(value)
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._lazy.pop(key, None)
+            self._data[key] = copy.deepcopy(value)
+            self._dirty.add(key)
+
+    def set_lazy(self, key: str, producer: Callable[[], Any]):
+        """
+        标记键有变化，写入时才调用 producer 生成值，适合频繁变化的大数据
+        :param producer: 返回新值，无变化时返回None
+        """
+        with self._lock:
+            self._lazy[key] = producer
+            self._dirty.add(key)
+
+    def __resolve(self, key: str) -> bool:
+        """
+        生成延迟写入的值
+        :return: 有新值
+        """
+        with self._lock:
+            producer = self._lazy.pop(key, None)
+        if not producer:
+            return True
+        value = producer()
+        if value is None:
+            return False
+        with self._lock:
+            self._data[key] = value
+        return True
+
+    def items(self) -> Dict[str, Any]:
+        with self._lock:
+            return {key: copy.deepcopy(value) for key, value in self._data.items() if value is not None}
+
+    def flush(self):
+        """
+        写入有变化的键
+        """
+        with self._lock:
+            keys = list(self._dirty)
+            self._dirty.clear()
+        dirty = {}
+        for key in keys:
+            try:
+                if not self.__resolve(key):
+                    continue
+            except Exception as e:
+                logger.error(f"生成插件数据 {key} 失败：{str(e)}")
+                continue
+            with self._lock:
+                dirty[key] = self._data.get(key)
+        failed = []
+        for key, value in dirty.items():
+            try:
+                self._save(key, value)
+            except Exception as e:
+                logger.error(f"保存插件数据 {key} 失败：{str(e)}")
+                failed.append(key)
+        if failed:
+            with self._lock:
+                self._dirty.update(failed)
+        elif dirty:
+            logger.debug(f"已保存 {len(dirty)} 条插件数据")
+
+    def __run(self):
+        while not self._event.wait(self.interval):
+            self.flush()
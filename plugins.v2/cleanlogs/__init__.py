@@ -1,3 +1,6 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
 import pytz
@@ -7,6 +10,7 @@ from apscheduler.triggers.cron import CronTrigger
 from pathlib import Path
 from typing import List, Tuple, Dict, Any, Optional
 
+from app import schemas
 from app.utils.string import StringUtils
 from app.helper.plugin import PluginHelper
 from app.core.config import settings
@@ -16,6 +20,14 @@ from app.log import logger
 from app.plugins import _PluginBase
 from app.schemas.types import SystemConfigKey
 
+from .log_helper import truncate_head, count_lines, TokenBucket, MODE_COPY, MODE_COLLAPSE
+from .watcher import LogWatcher
+from .archive import LogArchive
+
+# 插件市场列表缓存时间（秒）
+MARKET_CACHE_TTL = 600
+MARKET_RETRY_TTL = 60
+
 
 class CleanLogs(_PluginBase):
     # 插件名称
@@ -25,7 +37,7 @@ class CleanLogs(_PluginBase):
     # 插件图标
     plugin_icon = "clean.png"
     # 插件版本
-    plugin_version = "1.2.3"
+    plugin_version = "1.3.0"
     # 插件作者
     plugin_author = "honue"
     # 作者主页
@@ -42,9 +54,29 @@ class CleanLogs(_PluginBase):
     _cron = '30 3 * * *'
     _selected_ids: List[str] = []
     _rows = 300
+    _mode = MODE_COPY
+    # 日志增长超过多少KB才检查
+    _threshold = 0
+    # 并发数、读写限速（MB/s，0为不限）
+    _workers = 2
+    _bandwidth = 0
+    # 实时监控：日志超过多少MB清理、同一日志最短清理间隔（秒）
+    _watch = False
+    _max_size = 10
+    _min_interval = 300
+    # 清理前归档被删除的日志
+    _archive = False
 
     # 定时器
     _scheduler: Optional[BackgroundScheduler] = None
+    _watcher: Optional[LogWatcher] = None
+    _archiver: Optional[LogArchive] = None
+    # 定时清理与实时清理共用文件记录
+    _lock = threading.Lock()
+    # 插件市场缓存：(市场, 获取时间, 过期时间, 插件列表)、已安装插件缓存：(缓存键, 已安装插件)
+    _market_lock = threading.Lock()
+    _market_cache: Optional[tuple] = None
+    _local_cache: Optional[tuple] = None
 
     def init_plugin(self, config: dict = None):
         # 停止现有任务
@@ -56,6 +88,16 @@ class CleanLogs(_PluginBase):
             self._rows = int(config.get('rows', 300))
             self._onlyonce = config.get('onlyonce', False)
             self._cron = config.get('cron', '30 3 * * *')
+            self._mode = config.get('mode') or MODE_COPY
+            self._threshold = int(config.get('threshold') or 0)
+            self._workers = int(config.get('workers') or 2)
+            self._bandwidth = float(config.get('bandwidth') or 0)
+            self._watch = config.get('watch', False)
+            self._max_size = float(config.get('max_size') or 10)
+            self._min_interval = int(config.get('min_interval') or 300)
+            self._archive = config.get('archive', False)
+
+        self._archiver = LogArchive(self.get_data_path() / "archive") if self._archive else None
 
         # 定时服务
         self._scheduler = BackgroundScheduler(timezone=settings.TZ)
@@ -68,6 +110,14 @@ class CleanLogs(_PluginBase):
                 "enable": self._enable,
                 "selected_ids": self._selected_ids,
                 "cron": self._cron,
+                "mode": self._mode,
+                "threshold": self._threshold,
+                "workers": self._workers,
+                "bandwidth": self._bandwidth,
+                "watch": self._watch,
+                "max_size": self._max_size,
+                "min_interval": self._min_interval,
+                "archive": self._archive,
             })
             self._scheduler.add_job(func=self._task, trigger='date',
                                     run_date=datetime.now(tz=pytz.timezone(settings.TZ)) + timedelta(seconds=2),
@@ -85,6 +135,51 @@ class CleanLogs(_PluginBase):
             self._scheduler.print_jobs()
             self._scheduler.start()
 
+        # 实时监控日志大小，定时任务作为兜底
+        if self._enable and self._watch:
+            self._watcher = LogWatcher(path=self.__log_dir(),
+                                       callback=self.__clean_path,
+                                       max_size=int(self._max_size * 1024 * 1024),
+                                       min_interval=self._min_interval,
+                                       accept=self.__accept)
+            try:
+                self._watcher.start()
+                logger.info(f"插件日志实时监控已启动，超过 {self._max_size}MB 时清理")
+            except Exception as e:
+                logger.error(f"插件日志实时监控启动失败：{str(e)}")
+                self._watcher.stop()
+                self._watcher = None
+
+    @staticmethod
+    def __log_dir() -> Path:
+        return settings.LOG_PATH / Path("plugins")
+
+    def __accept(self, log_path: Path) -> bool:
+        """
+        实时监控只处理选中的插件日志，未选择时处理全部
+        """
+        if not self._selected_ids:
+            return True
+        return log_path.stem in {plugin_id.lower() for plugin_id in self._selected_ids}
+
+    def __limiter(self) -> Optional[TokenBucket]:
+        return TokenBucket(self._bandwidth * 1024 * 1024) if self._bandwidth > 0 else None
+
+    def __clean_path(self, log_path: Path):
+        """
+        实时监控触发的单个日志清理
+        """
+        with self._lock:
+            records: Dict[str, dict] = self.get_data("files") or {}
+            record, removed, elapsed = self.__clean_file(log_path, records.get(log_path.stem), self.__limiter())
+            if record is None:
+                return
+            records[log_path.stem] = record
+            self.save_data("files", records)
+        if removed > 0:
+            logger.info(f"{log_path.name} 超过 {self._max_size}MB，已清理 {StringUtils.str_filesize(removed)}，"
+                        f"耗时 {elapsed:.2f} 秒")
+
     def _task(self):
         clean_plugin = self._selected_ids[:]
 
@@ -93,25 +188,86 @@ class CleanLogs(_PluginBase):
             for plugin in local_plugins:
                 clean_plugin.append(plugin.id)
 
+        tasks = {}
         for plugin_id in clean_plugin:
-            log_path = settings.LOG_PATH / Path("plugins") / f"{plugin_id.lower()}.log"
+            log_path = self.__log_dir() / f"{plugin_id.lower()}.log"
             if not log_path.exists():
                 logger.debug(f"{plugin_id} 日志文件不存在")
                 continue
+            tasks[plugin_id] = log_path
 
-            with open(log_path, 'r', encoding='utf-8') as file:
-                lines = file.readlines()
+        limiter = self.__limiter()
+        start = time.perf_counter()
+        skipped = 0
+        # plugin_id -> (删除字节数, 耗时)
+        summary: Dict[str, Tuple[int, float]] = {}
+        with self._lock:
+            # 上次清理时各日志文件的状态，以日志文件名为键
+            records: Dict[str, dict] = self.get_data("files") or {}
+            records = {name: record for name, record in records.items()
+                       if (self.__log_dir() / f"{name}.log").exists()}
+            with ThreadPoolExecutor(max_workers=max(1, self._workers), thread_name_prefix="cleanlogs") as executor:
+                futures = {executor.submit(self.__clean_file, log_path, records.get(log_path.stem), limiter):
+                           plugin_id for plugin_id, log_path in tasks.items()}
+                for future in as_completed(futures):
+                    plugin_id = futures[future]
+                    try:
+                        record, removed, elapsed = future.result()
+                    except Exception as e:
+                        logger.error(f"清理 {plugin_id} 日志失败：{str(e)}")
+                        continue
+                    if record is None:
+                        skipped += 1
+                        continue
+                    records[tasks[plugin_id].stem] = record
+                    if removed > 0:
+                        summary[plugin_id] = (removed, elapsed)
+            self.save_data("files", records)
 
-            if self._rows == 0:
-                top_lines = []
-            else:
-                top_lines = lines[-min(self._rows, len(lines)):]
+        for plugin_id, (removed, elapsed) in sorted(summary.items(), key=lambda item: -item[1][0]):
+            logger.info(f"已清理 {plugin_id} {StringUtils.str_filesize(removed)} 日志，耗时 {elapsed:.2f} 秒")
+        logger.info(f"插件日志清理完成，共 {len(tasks)} 个日志文件，清理 {len(summary)} 个，跳过 {skipped} 个，"
+                    f"释放 {StringUtils.str_filesize(sum(item[0] for item in summary.values()))}，"
+                    f"耗时 {time.perf_counter() - start:.2f} 秒")
+
+    def __clean_file(self, log_path: Path, record: Optional[dict],
+                     limiter: Optional[TokenBucket] = None) -> Tuple[Optional[dict], int, float]:
+        """
+        清理单个日志文件，与上次记录的 inode、大小、行数比较，只统计新追加部分的行数
+        :return: 新的文件记录（未变化跳过时为None）, 删除的字节数, 耗时
+        """
+        start = time.perf_counter()
+        stat = log_path.stat()
+        lines = None
+        if record and record.get("inode") == stat.st_ino and record.get("rows") == self._rows \
+                and stat.st_size >= record.get("size", 0):
+            growth = stat.st_size - record.get("size", 0)
+            if growth == 0 and stat.st_mtime == record.get("mtime"):
+                return None, 0, 0
+            if growth <= self._threshold * 1024:
+                return None, 0, 0
+            lines = record.get("lines", 0) + count_lines(log_path, record.get("size", 0), stat.st_size,
+                                                         limiter=limiter)
 
-            with open(log_path, 'w', encoding='utf-8') as file:
-                file.writelines(top_lines)
+        removed = 0
+        if lines is None or lines > self._rows:
+            archive = None
+            if self._archiver:
+                def archive(fd: int, begin: int, end: int):
+                    self._archiver.append(log_path.stem, fd, begin, end, limiter)
+            removed, kept = truncate_head(log_path, self._rows, self._mode, limiter=limiter, archive=archive)
+            stat = log_path.stat()
+            if removed > 0 or lines is None:
+                # 按清理后的实际内容计算行数（包括清理期间新追加的行），只需统计保留部分
+                lines = count_lines(log_path, 0, stat.st_size, limiter=limiter)
 
-            if (len(lines) - self._rows) > 0:
-                logger.info(f"已清理 {plugin_id} {len(lines) - self._rows} 行日志")
+        return {
+            "inode": stat.st_ino,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "lines": lines,
+            "rows": self._rows,
+        }, removed, time.perf_counter() - start
 
     def get_form(self) -> Tuple[List[dict], Dict[str, Any]]:
         # 已安装插件
@@ -168,7 +324,7 @@ class CleanLogs(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 6
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -180,6 +336,23 @@ class CleanLogs(_PluginBase):
                                         }
                                     }
                                 ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'threshold',
+                                            'label': '增长阈值(KB)',
+                                            'placeholder': '日志增长超过该值才检查，0为有变化即检查'
+                                        }
+                                    }
+                                ]
                             }
                         ]
                     },
@@ -190,7 +363,7 @@ class CleanLogs(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 6
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -203,6 +376,28 @@ class CleanLogs(_PluginBase):
                                     }
                                 ]
                             },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSelect',
+                                        'props': {
+                                            'model': 'mode',
+                                            'label': '清理方式',
+                                            'hint': '原地删除按块删除，可能多保留不足一块的行',
+                                            'persistent-hint': True,
+                                            'items': [
+                                                {'title': '复制保留部分', 'value': MODE_COPY},
+                                                {'title': '原地删除头部(ext4/XFS)', 'value': MODE_COLLAPSE}
+                                            ]
+                                        }
+                                    }
+                                ]
+                            },
                             {
                                 'component': 'VCol',
                                 'props': {
@@ -223,6 +418,114 @@ class CleanLogs(_PluginBase):
                                 ]
                             }
                         ]
+                    }, {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'workers',
+                                            'label': '并发数',
+                                            'placeholder': '2'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'bandwidth',
+                                            'label': '读写限速(MB/s)',
+                                            'placeholder': '0为不限速'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'archive',
+                                            'label': '清理前压缩归档',
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    }, {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'watch',
+                                            'label': '实时监控日志大小',
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'max_size',
+                                            'label': '日志超过(MB)时清理',
+                                            'placeholder': '10'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'min_interval',
+                                            'label': '同一日志最短清理间隔(秒)',
+                                            'placeholder': '300'
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
                     }, {
                         'component': 'VRow',
                         'content': [
@@ -251,24 +554,41 @@ class CleanLogs(_PluginBase):
             "onlyonce": self._onlyonce,
             "rows": self._rows,
             "cron": self._cron,
+            "mode": self._mode,
+            "threshold": self._threshold,
+            "workers": self._workers,
+            "bandwidth": self._bandwidth,
+            "watch": self._watch,
+            "max_size": self._max_size,
+            "min_interval": self._min_interval,
+            "archive": self._archive,
             "selected_ids": [],
         }
 
-    @staticmethod
-    def get_local_plugins():
+    @classmethod
+    def get_local_plugins(cls):
         """
         获取本地插件
         """
         # 已安装插件
         install_plugins = SystemConfigOper().get(SystemConfigKey.UserInstalledPlugins) or []
+        # 线上插件列表
+        markets = tuple(settings.PLUGIN_MARKET.split(","))
+        fetched, online = cls.__get_online_plugins(markets)
 
+        with cls._market_lock:
+            # 市场列表刷新或已安装插件变化时重新生成
+            key = (markets, fetched, tuple(sorted(install_plugins)))
+            cached = cls._local_cache
+            if cached and cached[0] == key:
+                return dict(cached[1])
+
+        installed = set(install_plugins)
         local_plugins = {}
-        # 线上插件列表
-        markets = settings.PLUGIN_MARKET.split(",")
         for market in markets:
-            online_plugins = PluginHelper().get_plugins(market) or {}
+            online_plugins = online.get(market) or {}
             for pid, plugin in online_plugins.items():
-                if pid in install_plugins:
+                if pid in installed:
                     local_plugin = local_plugins.get(pid)
                     if local_plugin:
                         if StringUtils.compare_version(local_plugin.get("plugin_version"), "==",plugin.get("version")) < 0:
@@ -286,7 +606,35 @@ class CleanLogs(_PluginBase):
                             "plugin_version": plugin.get("version")
                         }
 
-        return local_plugins
+        with cls._market_lock:
+            cls._local_cache = (key, local_plugins)
+        return dict(local_plugins)
+
+    @classmethod
+    def __get_online_plugins(cls, markets: Tuple[str, ...]) -> Tuple[float, Dict[str, dict]]:
+        """
+        并发获取各插件市场的插件列表，缓存 MARKET_CACHE_TTL 秒，有市场获取失败时缩短为 MARKET_RETRY_TTL 秒
+        :return: 获取时间, 市场地址 -> 插件列表
+        """
+        with cls._market_lock:
+            cached = cls._market_cache
+            if cached and cached[0] == markets and cached[2] > time.monotonic():
+                return cached[1], cached[3]
+
+        def fetch(market: str) -> dict:
+            try:
+                return PluginHelper().get_plugins(market) or {}
+            except Exception as e:
+                logger.error(f"获取插件市场 {market} 失败：{str(e)}")
+                return {}
+
+        with ThreadPoolExecutor(max_workers=max(1, len(markets)), thread_name_prefix="cleanlogs-market") as executor:
+            online = dict(zip(markets, executor.map(fetch, markets)))
+        fetched = time.monotonic()
+        ttl = MARKET_CACHE_TTL if all(online.values()) else MARKET_RETRY_TTL
+        with cls._market_lock:
+            cls._market_cache = (markets, fetched, fetched + ttl, online)
+        return fetched, online
 
     def get_state(self) -> bool:
         return self._enable
@@ -296,10 +644,56 @@ class CleanLogs(_PluginBase):
         pass
 
     def get_api(self) -> List[Dict[str, Any]]:
-        pass
+        return [
+            {
+                "path": "/archives",
+                "endpoint": self.archives,
+                "methods": ["GET"],
+                "summary": "已归档的插件日志"
+            },
+            {
+                "path": "/archive_log",
+                "endpoint": self.archive_log,
+                "methods": ["GET"],
+                "summary": "按时间读取归档的插件日志"
+            }
+        ]
+
+    def archives(self, apikey: str):
+        """
+        各插件日志归档的块数、行数、大小、时间范围
+        """
+        if apikey != settings.API_TOKEN:
+            return schemas.Response(success=False, message="API密钥错误")
+        return schemas.Response(success=True, data=LogArchive(self.get_data_path() / "archive").names())
+
+    def archive_log(self, apikey: str, plugin_id: str, start: str = None, end: str = None, limit: int = 1000):
+        """
+        读取归档的插件日志
+        :param start: 开始时间，如 2024-01-01 或 2024-01-01 12:00:00
+        :param end: 结束时间
+        :param limit: 最多返回行数
+        """
+        if apikey != settings.API_TOKEN:
+            return schemas.Response(success=False, message="API密钥错误")
+        try:
+            lines = LogArchive(self.get_data_path() / "archive").read(plugin_id.lower(), start, end, int(limit))
+        except Exception as e:
+            return schemas.Response(success=False, message=str(e))
+        return schemas.Response(success=True, data=lines)
 
     def get_page(self) -> List[dict]:
         pass
 
     def stop_service(self):
-        pass
+        """
+        退出插件
+        """
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher = None
+        if self._scheduler:
+            self._scheduler.remove_all_jobs()
+            if self._scheduler.running:
+                self._scheduler.shutdown()
+            self._scheduler = None
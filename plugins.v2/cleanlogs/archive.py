@@ -0,0 +1,188 @@
+import gzip
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .log_helper import TokenBucket, BLOCK_SIZE
+
+# 每块压缩前大小
+CHUNK_SIZE = 1024 * 1024
+# 日志行中的时间
+TIME_PATTERN = re.compile(rb'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+LINE_TIME_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+
+
+def _first_time(data: bytes) -> Optional[str]:
+    match = TIME_PATTERN.search(data)
+    return match.group().decode() if match else None
+
+
+def _last_time(data: bytes) -> Optional[str]:
+    # 从最后一行往前找
+    end = len(data)
+    while end > 0:
+        start = data.rfind(b'\n', 0, end - 1) + 1
+        match = TIME_PATTERN.search(data, start, end)
+        if match:
+            return match.group().decode()
+        end = start
+    return None
+
+
+class LogArchive:
+    """
+    清理掉的日志按块独立压缩追加到归档文件，索引记录每块的时间范围与偏移，按时间读取时只解压相关的块
+
+    归档目录下每个日志对应：
+    名称.log.gz / 名称.log.zst  压缩块依次拼接
+    名称.idx  每行一个 JSON：{"file", "offset", "length", "codec", "start", "end", "lines"}
+    """
+
+    def __init__(self, root: Path, chunk_size: int = CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.codec = 'zst' if zstandard else 'gz'
+        self._lock = threading.Lock()
+
+    def __index_path(self, name: str) -> Path:
+        return self.root / f"{name}.idx"
+
+    def __compress(self, data: bytes) -> bytes:
+        if self.codec == 'zst':
+            return zstandard.ZstdCompressor(level=10).compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    @staticmethod
+    def __decompress(codec: str, data: bytes) -> bytes:
+        if codec == 'zst':
+            if not zstandard:
+                raise RuntimeError("未安装 zstandard，无法读取 zstd 归档")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def append(self, name: str, fd: int, start: int, end: int, limiter: Optional[TokenBucket] = None) -> int:
+        """
+        归档日志文件 start 到 end 的内容
+        :param name: 日志名称
+        :param fd: 日志文件描述符
+        :return: 写入的块数
+        """
+        if end <= start:
+            return 0
+        self.root.mkdir(parents=True, exist_ok=True)
+        archive_name = f"{name}.log.{self.codec}"
+        chunks = 0
+        with self._lock, open(self.root / archive_name, 'ab') as archive, \
+                open(self.__index_path(name), 'a', encoding='utf-8') as index:
+
+            def write_chunk(data: bytes):
+                nonlocal chunks
+                compressed = self.__compress(data)
+                offset = archive.tell()
+                archive.write(compressed)
+                index.write(json.dumps({
+                    "file": archive_name,
+                    "offset": offset,
+                    "length": len(compressed),
+                    "codec": self.codec,
+                    "start": _first_time(data),
+                    "end": _last_time(data),
+                    "lines": data.count(b'\n'),
+                }) + "\n")
+                chunks += 1
+
+            buffer = bytearray()
+            pos = start
+            while pos < end:
+                size = min(BLOCK_SIZE, end - pos)
+                if limiter:
+                    limiter.consume(size)
+                block = os.pread(fd, size, pos)
+                if not block:
+                    break
+                pos += size
+                buffer += block
+                # 按整行切块
+                while len(buffer) >= self.chunk_size:
+                    cut = buffer.rfind(b'\n', 0, self.chunk_size) + 1 or self.chunk_size
+                    write_chunk(bytes(buffer[:cut]))
+                    del buffer[:cut]
+            if buffer:
+                write_chunk(bytes(buffer))
+            archive.flush()
+            os.fsync(archive.fileno())
+        return chunks
+
+    def index(self, name: str) -> List[dict]:
+        path = self.__index_path(name)
+        if not path.exists():
+            return []
+        entries = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # 写入中断的最后一行
+                    continue
+        return entries
+
+    def names(self) -> List[dict]:
+        """
+        所有归档的块数、行数、大小、时间范围
+        """
+        result = []
+        if not self.root.exists():
+            return result
+        for path in sorted(self.root.glob("*.idx")):
+            entries = self.index(path.stem)
+            if not entries:
+                continue
+            result.append({
+                "name": path.stem,
+                "chunks": len(entries),
+                "lines": sum(entry.get("lines") or 0 for entry in entries),
+                "size": sum(entry.get("length") or 0 for entry in entries),
+                "start": next((entry["start"] for entry in entries if entry.get("start")), None),
+                "end": next((entry["end"] for entry in reversed(entries) if entry.get("end")), None),
+            })
+        return result
+
+    def read(self, name: str, start: str = None, end: str = None, limit: int = 1000) -> List[str]:
+        """
+        读取时间范围内的日志行，只解压时间范围有交集的块
+        :param start: 开始时间 YYYY-MM-DD HH:MM:SS，可只写前缀
+        :param end: 结束时间，同上
+        :param limit: 最多返回行数，超出时保留最新的
+        """
+        # 前缀比较：结束时间补齐到该前缀的最后时刻
+        end_key = end + '\uffff' if end else None
+        lines: List[str] = []
+        for entry in self.index(name):
+            if start and entry.get("end") and entry["end"] < start:
+                continue
+            if end_key and entry.get("start") and entry["start"] > end_key:
+                continue
+            with open(self.root / entry["file"], 'rb') as f:
+                f.seek(entry["offset"])
+                data = self.__decompress(entry["codec"], f.read(entry["length"]))
+            # 没有时间的行（如异常堆栈）跟随上一行
+            current = entry.get("start")
+            for raw in data.decode('utf-8', errors='replace').splitlines():
+                match = LINE_TIME_PATTERN.search(raw, 0, 64)
+                if match:
+                    current = match.group()
+                if current and ((start and current < start) or (end_key and current > end_key)):
+                    continue
+                lines.append(raw)
+            if len(lines) > limit * 2:
+                lines = lines[-limit:]
+        return lines[-limit:]
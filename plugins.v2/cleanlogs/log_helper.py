@@ -0,0 +1,291 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from app.log import logger
+
+# 读写块大小
+BLOCK_SIZE = 64 * 1024
+# 限速时每次复制的大小
+CHUNK_SIZE = 1024 * 1024
+# linux/falloc.h
+FALLOC_FL_COLLAPSE_RANGE = 0x08
+
+# 清理方式：复制保留部分后替换 / 原地删除文件头部的块
+MODE_COPY = 'copy'
+MODE_COLLAPSE = 'collapse'
+
+_libc = None
+
+# 归档回调：(文件描述符, 开始位置, 结束位置)
+Archiver = Callable[[int, int, int], None]
+
+
+class TokenBucket:
+    """
+    多线程共享的读写限速，rate 为每秒字节数，允许1秒的突发
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, size: int):
+        """
+        取得 size 字节的额度，不足时等待
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= size
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def _consume(limiter: Optional[TokenBucket], size: int):
+    if limiter:
+        limiter.consume(size)
+
+
+def tail_offset(fd: int, rows: int, size: int, block_size: int = BLOCK_SIZE,
+                limiter: Optional[TokenBucket] = None) -> int:
+    """
+    从文件末尾按块向前查找，返回最后 rows 行的起始位置
+    :param fd: 文件描述符
+    :param rows: 保留行数
+    :param size: 文件大小
+    :param limiter: 限速
+    """
+    if rows <= 0:
+        return size
+    pos = size
+    # 末尾换行不算一行
+    if size and os.pread(fd, 1, size - 1) == b'\n':
+        pos -= 1
+    found = 0
+    while pos > 0:
+        read_size = min(block_size, pos)
+        pos -= read_size
+        _consume(limiter, read_size)
+        block = os.pread(fd, read_size, pos)
+        idx = len(block)
+        while True:
+            idx = block.rfind(b'\n', 0, idx)
+            if idx == -1:
+                break
+            found += 1
+            if found == rows:
+                return pos + idx + 1
+    return 0
+
+
+def count_lines(log_path: Path, start: int, end: int, block_size: int = BLOCK_SIZE,
+                limiter: Optional[TokenBucket] = None) -> int:
+    """
+    统计文件区间内的换行数，用于只统计新追加的部分
+    """
+    count = 0
+    with open(log_path, 'rb') as file:
+        fd = file.fileno()
+        pos = start
+        while pos < end:
+            _consume(limiter, min(block_size, end - pos))
+            block = os.pread(fd, min(block_size, end - pos), pos)
+            if not block:
+                break
+            count += block.count(b'\n')
+            pos += len(block)
+    return count
+
+
+def copy_range(src_fd: int, dst_fd: int, offset: int, count: int, block_size: int = BLOCK_SIZE,
+               limiter: Optional[TokenBucket] = None) -> int:
+    """
+    内核态复制文件区间，依次尝试 copy_file_range、sendfile，都不支持时按块读写
+    :return: 复制的字节数
+    """
+    # 限速时分段复制
+    chunk = CHUNK_SIZE if limiter else count
+    copied = 0
+    for method in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, method):
+            continue
+        try:
+            while copied < count:
+                size = min(chunk, count - copied)
+                _consume(limiter, size)
+                if method == 'copy_file_range':
+                    sent = os.copy_file_range(src_fd, dst_fd, size, offset + copied)
+                else:
+                    sent = os.sendfile(dst_fd, src_fd, offset + copied, size)
+                if sent == 0:
+                    return copied
+                copied += sent
+            return copied
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF):
+                raise
+            # 已复制部分保留，从断点继续
+    while copied < count:
+        _consume(limiter, min(block_size, count - copied))
+        block = os.pread(src_fd, min(block_size, count - copied), offset + copied)
+        if not block:
+            break
+        os.write(dst_fd, block)
+        copied += len(block)
+    return copied
+
+
+def file_handlers(log_path: Path) -> List[logging.FileHandler]:
+    """
+    查找正在写入该文件的日志处理器
+    """
+    filename = os.path.abspath(log_path)
+    loggers = [logging.getLogger()] + [item for item in logging.Logger.manager.loggerDict.values()
+                                       if isinstance(item, logging.Logger)]
+    handlers = []
+    for item in loggers:
+        for handler in item.handlers:
+            if isinstance(handler, logging.FileHandler) and handler.baseFilename == filename \
+                    and handler not in handlers:
+                handlers.append(handler)
+    return handlers
+
+
+@contextmanager
+def hold_handlers(log_path: Path):
+    """
+    替换期间阻塞对该文件的日志写入，结束后重新打开，避免继续写入已被替换的旧文件
+    """
+    handlers = file_handlers(log_path)
+    for handler in handlers:
+        handler.acquire()
+    try:
+        yield
+    finally:
+        for handler in handlers:
+            try:
+                if handler.stream:
+                    handler.stream.close()
+                    handler.stream = handler._open()
+            except Exception as e:
+                logger.error(f"重新打开日志文件 {log_path} 失败：{str(e)}")
+            finally:
+                handler.release()
+
+
+def fallocate(fd: int, mode: int, offset: int, length: int):
+    """
+    调用 libc fallocate，不支持时抛出 OSError
+    """
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+        _libc.fallocate.restype = ctypes.c_int
+    if _libc.fallocate(fd, mode, offset, length) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def collapse_head(log_path: Path, rows: int, archive: Archiver = None) -> Optional[Tuple[int, int]]:
+    """
+    原地删除文件头部：折叠掉切点之前的整块，不复制保留部分；
+    折叠只能按文件系统块删除，切点所在块不足一块的部分保留，实际保留行数不少于 rows
+    :return: 删除的字节数, 保留的字节数；文件系统不支持时返回None
+    """
+    with open(log_path, 'r+b') as file:
+        fd = file.fileno()
+        stat = os.fstat(fd)
+        size = stat.st_size
+        cut = tail_offset(fd, rows, size)
+        block = stat.st_blksize or 4096
+        # 折叠范围不能到达文件末尾
+        cut = min(cut - cut % block, (size - 1) // block * block)
+        if cut <= 0:
+            return 0, size
+        if archive:
+            archive(fd, 0, cut)
+        try:
+            fallocate(fd, FALLOC_FL_COLLAPSE_RANGE, 0, cut)
+        except (OSError, AttributeError) as e:
+            # 文件系统或系统不支持时改用复制，其他错误照常抛出
+            if isinstance(e, OSError) and e.errno not in (errno.EOPNOTSUPP, errno.ENOSYS):
+                raise
+            return None
+        os.fsync(fd)
+    return cut, size - cut
+
+
+def truncate_head(log_path: Path, rows: int, mode: str = MODE_COPY,
+                  limiter: Optional[TokenBucket] = None, archive: Archiver = None) -> Tuple[int, int]:
+    """
+    只保留最后 rows 行：保留部分复制到同目录临时文件后原子替换，内存占用与文件大小无关；
+    collapse 方式优先原地按块删除头部（保留行数不少于 rows），文件系统不支持时改用复制
+    :param archive: 删除前归档被删除的部分
+    :return: 删除的字节数, 保留的字节数
+    """
+    archived = 0
+
+    def archive_head(fd: int, start: int, end: int):
+        # 原地删除失败改用复制时，不重复归档
+        nonlocal archived
+        if archive and end > archived:
+            archive(fd, max(start, archived), end)
+            archived = end
+
+    if mode == MODE_COLLAPSE:
+        # 原地删除不改变 inode，日志追加写入不受影响
+        result = collapse_head(log_path, rows, archive_head)
+        if result:
+            return result
+        logger.debug(f"{log_path} 无法原地删除，改为复制保留部分")
+    return copy_tail(log_path, rows, limiter, archive_head)
+
+
+def copy_tail(log_path: Path, rows: int, limiter: Optional[TokenBucket] = None,
+              archive: Archiver = None) -> Tuple[int, int]:
+    """
+    先复制保留部分（可限速），再在阻塞日志写入期间补齐复制期间新追加的内容并替换
+    :return: 删除的字节数, 保留的字节数
+    """
+    with open(log_path, 'rb') as src:
+        fd = src.fileno()
+        size = os.fstat(fd).st_size
+        cut = tail_offset(fd, rows, size, limiter=limiter)
+        if cut == 0:
+            return 0, size
+        if archive:
+            archive(fd, 0, cut)
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=str(log_path.parent), prefix=f'.{log_path.name}.')
+        try:
+            kept = copy_range(fd, tmp_fd, cut, size - cut, limiter=limiter)
+            with hold_handlers(log_path):
+                appended = os.fstat(fd).st_size - size
+                if appended > 0:
+                    kept += copy_range(fd, tmp_fd, size, appended)
+                os.fsync(tmp_fd)
+                os.close(tmp_fd)
+                tmp_fd = None
+                shutil.copymode(log_path, tmp_path)
+                os.replace(tmp_path, log_path)
+        except Exception:
+            if tmp_fd is not None:
+                os.close(tmp_fd)
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    return cut, kept
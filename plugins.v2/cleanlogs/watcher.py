@@ -0,0 +1,146 @@
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+
+from app.log import logger
+
+
+class LogWatcher(FileSystemEventHandler):
+    """
+    监控插件日志目录，日志超过大小阈值时触发清理，同一文件两次清理之间至少间隔 min_interval 秒
+    """
+
+    def __init__(self, path: Path, callback: Callable[[Path], None], max_size: int, min_interval: float,
+                 accept: Callable[[Path], bool] = None):
+        """
+        :param path: 日志目录
+        :param callback: 清理单个文件
+        :param max_size: 文件大小阈值（字节）
+        :param min_interval: 同一文件最短清理间隔（秒）
+        :param accept: 是否处理该文件
+        """
+        super().__init__()
+        self.path = path
+        self.callback = callback
+        self.max_size = max_size
+        self.min_interval = min_interval
+        self.accept = accept
+        self._observer: Optional[Observer] = None
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        # 文件 -> 上次看到的大小、上次清理时间
+        self._sizes: Dict[str, int] = {}
+        self._trimmed: Dict[str, float] = {}
+        # 已排队或等待间隔的文件
+        self._pending = set()
+        self._timers: Dict[str, threading.Timer] = {}
+        self._appended = 0
+        self._trims = 0
+        self._worker: Optional[threading.Thread] = None
+
+    def start(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        try:
+            self._observer = Observer(timeout=10)
+            self._observer.schedule(self, str(self.path), recursive=False)
+            self._observer.start()
+        except OSError as e:
+            # inotify 数量达到上限等情况，改用轮询
+            logger.warn(f"日志目录 {self.path} 无法使用 inotify 监控：{str(e)}，改为轮询")
+            self._observer = PollingObserver(timeout=10)
+            self._observer.schedule(self, str(self.path), recursive=False)
+            self._observer.start()
+        self._worker = threading.Thread(target=self.__run, name="cleanlogs-watcher", daemon=True)
+        self._worker.start()
+        # 已超过阈值的文件
+        for file in self.path.glob("*.log"):
+            self.__check(str(file))
+
+    def stop(self):
+        if self._observer:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+        if self._worker:
+            self._queue.put(None)
+            self._worker.join(timeout=30)
+            self._worker = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "files": len(self._sizes),
+                "appended": self._appended,
+                "pending": len(self._pending),
+                "trims": self._trims,
+            }
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.__check(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.__check(event.src_path)
+
+    def __check(self, path: str):
+        name = os.path.basename(path)
+        # 跳过清理时的临时文件
+        if not name.endswith(".log") or name.startswith("."):
+            return
+        if self.accept and not self.accept(Path(path)):
+            return
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return
+        with self._lock:
+            last_size = self._sizes.get(path)
+            self._sizes[path] = size
+            if last_size is not None and size > last_size:
+                self._appended += size - last_size
+            if size < self.max_size or path in self._pending:
+                return
+            self._pending.add(path)
+            wait = self._trimmed[path] + self.min_interval - time.monotonic() if path in self._trimmed else 0
+            if wait > 0:
+                timer = threading.Timer(wait, self.__enqueue, args=(path,))
+                timer.daemon = True
+                self._timers[path] = timer
+                timer.start()
+                return
+        self._queue.put(path)
+
+    def __enqueue(self, path: str):
+        with self._lock:
+            self._timers.pop(path, None)
+        self._queue.put(path)
+
+    def __run(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                break
+            try:
+                self.callback(Path(path))
+            except Exception as e:
+                logger.error(f"清理日志 {path} 失败：{str(e)}")
+            with self._lock:
+                self._trimmed[path] = time.monotonic()
+                self._trims += 1
+                self._pending.discard(path)
+                try:
+                    self._sizes[path] = os.stat(path).st_size
+                except OSError:
+                    self._sizes.pop(path, None)
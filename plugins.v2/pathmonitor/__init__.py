@@ -2,25 +2,32 @@ import datetime
 import random
 import re
 import threading
-import traceback
 from pathlib import Path
 from typing import List, Tuple, Dict, Any, Optional
 import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from app import schemas
+from app.chain.media import MediaChain
+from app.chain.storage import StorageChain
 from app.chain.transfer import TransferChain
 from app.core.config import settings
 from app.core.event import eventmanager, Event
+from app.core.metainfo import MetaInfoPath
 from app.db.transferhistory_oper import TransferHistoryOper
 from app.log import logger
 from app.plugins import _PluginBase
 from app.schemas import FileItem
-from app.schemas.types import EventType, SystemConfigKey
+from app.schemas.types import EventType, MediaType, SystemConfigKey
 from app.utils.system import SystemUtils
 
-lock = threading.Lock()
+from .watcher import FileMonitorHandler, is_remote_mount, start_observer
+from .history_index import TransferHistoryIndex
+from .scan_state import ScanState
+from .pipeline import TransferJob, TransferPipeline
 
+# 季目录名称
+SEASON_DIR_RE = re.compile(r"^(Season\s*\d+|S\d+|Specials|第.+季)$", re.IGNORECASE)
 
 
 class PathMonitor(_PluginBase):
@@ -31,7 +38,7 @@ class PathMonitor(_PluginBase):
     # 插件图标
     plugin_icon = "Linkease_A.png"
     # 插件版本
-    plugin_version = "3.0.1"
+    plugin_version = "3.1.0"
     # 插件作者
     plugin_author = "nlxingji"
     # 作者主页
@@ -46,10 +53,23 @@ class PathMonitor(_PluginBase):
     # 私有属性
     _scheduler = None
     transferhis = None
+    # 最近整理过的源文件
+    _history_index: Optional[TransferHistoryIndex] = None
+    # 目录扫描状态
+    _scan_state: Optional[ScanState] = None
     downloadhis = None
     transferchian = None
+    mediachain = None
+    storagechain = None
+    # 整理流水线
+    _pipeline: Optional[TransferPipeline] = None
+    # 流水线各阶段工作线程数
+    _stage_workers = {"filter": 1, "dedupe": 1, "recognize": 4, "transfer": 2, "scrape": 2}
     tmdbchain = None
     _observer = []
+    _handlers: List[FileMonitorHandler] = []
+    # 已启动实时监控的目录
+    _watched: set = set()
     _enabled = False
     _notify = False
     _onlyonce = False
@@ -71,6 +91,10 @@ class PathMonitor(_PluginBase):
     _dirconf: Dict[str, Optional[Path]] = {}
     # 存储源目录转移方式
     _transferconf: Dict[str, Optional[str]] = {}
+    # 存储源目录遍历并发数
+    _workersconf: Dict[str, int] = {}
+    # 默认遍历并发数
+    _scan_workers: int = 4
     _medias = {}
     # 退出事件
     _event = threading.Event()
@@ -79,10 +103,14 @@ class PathMonitor(_PluginBase):
     def init_plugin(self, config: dict = None):
         self.transferhis = TransferHistoryOper()
         self.transferchian = TransferChain()
+        self.mediachain = MediaChain()
+        self.storagechain = StorageChain()
+        self._history_index = TransferHistoryIndex(self.transferhis)
         # 清空配置
         self._dirconf = {}
         self._transferconf = {}
         self._categoryconf = {}
+        self._workersconf = {}
 
 
         # 读取配置
@@ -103,11 +131,23 @@ class PathMonitor(_PluginBase):
             self._size = config.get("size") or 0
             self._auto_category = config.get("auto_category")
             self._softlink = config.get("softlink")
+            self._scan_workers = int(config.get("scan_workers") or 4)
 
         # 停止现有任务
         self.stop_service()
 
         if self._enabled or self._onlyonce:
+            # 目录扫描状态、整理流水线
+            self._scan_state = ScanState(self.get_data_path() / "scanstate.db")
+            self._pipeline = TransferPipeline([
+                ("filter", self.__filter, self._stage_workers["filter"]),
+                ("dedupe", self.__dedupe, self._stage_workers["dedupe"]),
+                ("recognize", self.__recognize, self._stage_workers["recognize"]),
+                ("transfer", self.__transfer, self._stage_workers["transfer"]),
+                ("scrape", self.__scrape, self._stage_workers["scrape"]),
+            ])
+            self._pipeline.start()
+
             # 定时服务管理器
             self._scheduler = BackgroundScheduler(timezone=settings.TZ)
 
@@ -120,6 +160,13 @@ class PathMonitor(_PluginBase):
                 if not mon_path:
                     continue
 
+                # 遍历并发数
+                _workers = self._scan_workers
+                workers_match = re.search(r"@(\d+)\s*$", mon_path)
+                if workers_match:
+                    _workers = max(1, int(workers_match.group(1)))
+                    mon_path = mon_path[:workers_match.start()]
+
                 # 是否二级目录 默认False
                 _categroy = self._category
                 if mon_path.count("$") == 1:
@@ -154,10 +201,11 @@ class PathMonitor(_PluginBase):
                 # 转移方式
                 self._transferconf[mon_path] = _transfer_type
                 self._categoryconf[mon_path] = _categroy
+                self._workersconf[mon_path] = _workers
 
                 # 启用目录监控
                 if self._enabled:
-                    logger.info("实时监控服务启动")
+                    self.__start_monitor(mon_path)
 
             # 运行一次定时服务
             if self._onlyonce:
@@ -177,6 +225,39 @@ class PathMonitor(_PluginBase):
                 self._scheduler.print_jobs()
                 self._scheduler.start()
 
+    def __start_monitor(self, mon_path: str):
+        """
+        本地目录性能模式下启动 inotify 实时监控；兼容模式、网络挂载（inotify 收不到远端变化）
+        及启动失败的目录使用定时扫描（目录未变化时使用扫描缓存）
+        """
+        if not Path(mon_path).is_dir():
+            logger.warn(f"{mon_path} 目录不存在，不启动实时监控")
+            return
+        if self._mode == "compatibility":
+            logger.info(f"{mon_path} 兼容模式，使用定时检测")
+            return
+        if is_remote_mount(mon_path):
+            logger.info(f"{mon_path} 是网络挂载目录，使用定时检测")
+            return
+        handler = FileMonitorHandler(mon_path, self.event_handler)
+        try:
+            observer = start_observer(mon_path, handler)
+        except Exception as e:
+            handler.stop()
+            logger.error(f"{mon_path} 启动实时监控失败：{str(e)}，使用定时检测")
+            return
+        self._observer.append(observer)
+        self._handlers.append(handler)
+        self._watched.add(mon_path)
+        logger.info(f"{mon_path} 的实时监控服务启动")
+
+    def event_handler(self, event_path: str, mon_path: str):
+        """
+        处理实时监控发现的文件
+        """
+        logger.debug(f"实时监控 {mon_path} 发现文件 {event_path}")
+        self.__handle_file(event_path=event_path)
+
     def __update_config(self):
         """
         更新配置
@@ -196,7 +277,8 @@ class PathMonitor(_PluginBase):
             "scrape": self._scrape,
             "size": self._size,
             "refresh": self._refresh,
-            "auto_category": self._auto_category
+            "auto_category": self._auto_category,
+            "scan_workers": self._scan_workers
         })
 
     @eventmanager.register(EventType.PluginAction)
@@ -220,113 +302,198 @@ class PathMonitor(_PluginBase):
         """
         立即运行一次，全量同步目录中所有文件
         """
+        scan_state = self._scan_state
+        if not scan_state:
+            logger.warn("云盘实时监控未启用，不同步")
+            return
         logger.info("开始全量同步云盘实时监控目录 ...")
         # 遍历所有监控目录
         for mon_path in self._dirconf.keys():
             logger.info(f"开始处理监控目录 {mon_path} ...")
-            list_files = SystemUtils.list_files(Path(mon_path), settings.RMT_MEDIAEXT)
-            logger.info(f"监控目录 {mon_path} 共发现 {len(list_files)} 个文件")
+            count = 0
             # 遍历目录下所有文件
-            for file_path in list_files:
-                logger.info(f"开始处理文件 {file_path.name} ...")
-                self.__handle_file(event_path=str(file_path))
-        logger.info("全量同步云盘实时监控目录完成！")
-
+            for entry in scan_state.walk(Path(mon_path), settings.RMT_MEDIAEXT,
+                                         workers=self._workersconf.get(mon_path, self._scan_workers)):
+                count += 1
+                logger.info(f"开始处理文件 {Path(entry.path).name} ...")
+                self.__handle_file(event_path=entry.path, size=entry.size)
+            logger.info(f"监控目录 {mon_path} 共发现 {count} 个文件")
+        logger.info("全量同步云盘实时监控目录完成，文件已加入整理队列")
 
     def sync_all_files(self):
+        scan_state = self._scan_state
+        if not scan_state:
+            return
         logger.info("开始检测目录 ...")
-        # 遍历所有监控目录82
+        # 同步最近整理过的文件
+        self._history_index.reconcile()
+        now = datetime.datetime.now()
+        recent_time = (now - datetime.timedelta(days=3)).timestamp()
+        settled_time = (now - datetime.timedelta(minutes=1)).timestamp()
+        # 遍历所有监控目录，已启动实时监控的目录不再定时检测
         for mon_path in self._dirconf.keys():
+            if mon_path in self._watched:
+                continue
             logger.debug(f"开始处理监控目录 {mon_path} ...")
-            list_files = SystemUtils.list_files(Path(mon_path), settings.RMT_MEDIAEXT)
-            recent_file = [f for f in list_files if f.stat().st_mtime > (datetime.datetime.now() - datetime.timedelta(days=3)).timestamp()]
-            start = (datetime.datetime.now() - datetime.timedelta(days=4)).strftime("%Y-%m-%d %H:%M:%S")
-            transfer_history = self.transferhis.list_by_date(start)
-            transfer_history_list = [Path(item.src) for item in transfer_history]
-            new_file = [f for f in recent_file if f not in transfer_history_list]
-            # 遍历目录下所有文件
-            for file_path in new_file:
-                logger.info(f"发现新文件 {file_path.name} ...")
-                if file_path.stat().st_mtime < (datetime.datetime.now() - datetime.timedelta(minutes=1)).timestamp():
-                    logger.info(f"发现处理文件 {file_path.name} ...")
-                    self.__handle_file(event_path=str(file_path.resolve()))
+            # 遍历目录下所有文件，使用扫描时获取的修改时间、大小
+            for entry in scan_state.walk(Path(mon_path), settings.RMT_MEDIAEXT,
+                                         workers=self._workersconf.get(mon_path, self._scan_workers)):
+                if entry.mtime <= recent_time or entry.path in self._history_index:
+                    continue
+                file_name = Path(entry.path).name
+                logger.info(f"发现新文件 {file_name} ...")
+                if entry.mtime < settled_time:
+                    logger.info(f"发现处理文件 {file_name} ...")
+                    self.__handle_file(event_path=entry.path, size=entry.size)
         logger.info("定时监控目录完成！")
 
+    @eventmanager.register(EventType.TransferComplete)
+    def transfer_complete(self, event: Event):
+        """
+        整理完成后加入已整理索引
+        """
+        if not self._enabled or not self._history_index or not event or not event.event_data:
+            return
+        fileitem = event.event_data.get("fileitem")
+        if fileitem and fileitem.path:
+            self._history_index.add(fileitem.path)
 
-    def __handle_file(self, event_path: str):
+    def __handle_file(self, event_path: str, size: int = None):
         """
-        同步一个文件
+        同步一个文件，交给整理流水线处理
         :param event_path: 事件文件路径
+        :param size: 扫描时已获取的文件大小，不再重复获取文件状态
         """
-        file_path = Path(event_path)
-        try:
-            if not file_path.exists():
-                return
-            # 全程加锁
-            with lock:
-                transfer_history = self.transferhis.get_by_src(event_path)
-                if transfer_history:
-                    logger.info("文件已处理过：%s" % file_path.name)
-                    return
-
-                # 回收站及隐藏的文件不处理
-                if event_path.find('/@Recycle/') != -1 \
-                        or event_path.find('/#recycle/') != -1 \
-                        or event_path.find('/.') != -1 \
-                        or event_path.find('/@eaDir') != -1:
-                    logger.debug(f"{event_path} 是回收站或隐藏的文件")
-                    return
-
-                # 命中过滤关键字不处理
-                if self._exclude_keywords:
-                    for keyword in self._exclude_keywords.split("\n"):
-                        if keyword and re.findall(keyword, event_path):
-                            logger.info(f"{event_path} 命中过滤关键字 {keyword}，不处理")
-                            return
-
-                # 整理屏蔽词不处理
-                transfer_exclude_words = self.systemconfig.get(SystemConfigKey.TransferExcludeWords)
-                if transfer_exclude_words:
-                    for keyword in transfer_exclude_words:
-                        if not keyword:
-                            continue
-                        if keyword and re.search(r"%s" % keyword, event_path, re.IGNORECASE):
-                            logger.info(f"{event_path} 命中整理屏蔽词 {keyword}，不处理")
-                            return
-
-                # 不是媒体文件不处理
-                if file_path.suffix not in settings.RMT_MEDIAEXT:
-                    logger.debug(f"{event_path} 不是媒体文件")
-                    return
-
-                # 判断是不是蓝光目录
-                if re.search(r"BDMV[/\\]STREAM", event_path, re.IGNORECASE):
-                    # 截取BDMV前面的路径
-                    blurray_dir = event_path[:event_path.find("BDMV")]
-                    file_path = Path(blurray_dir)
-                    logger.info(f"{event_path} 是蓝光目录，更正文件路径为：{str(file_path)}")
-                    # 查询历史记录，已转移的不处理
-                    if self.transferhis.get_by_src(str(file_path)):
-                        logger.info(f"{file_path} 已整理过")
-                        return
-                logger.info(f'开始转移{file_path.name}  ...')
-                self.transferchian.do_transfer(
-                    fileitem=FileItem(
-                        storage="local",
-                        path=str(event_path).replace("\\", "/"),
-                        type="file",
-                        name=file_path.name,
-                        basename=file_path.stem,
-                        extension=file_path.suffix[1:],
-                        size=file_path.stat().st_size
-                    ),
-                    scrape=True
-                )
-
-        except Exception as e:
-            logger.error("目录监控发生错误：%s - %s" % (str(e), traceback.format_exc()))
+        if not self._pipeline:
+            return
+        self._pipeline.submit(TransferJob(event_path, size=size))
 
+    def __filter(self, job: TransferJob) -> Optional[TransferJob]:
+        """
+        过滤：回收站、隐藏文件、过滤关键字、整理屏蔽词及非媒体文件
+        """
+        event_path = job.event_path
+        # 回收站及隐藏的文件不处理
+        if event_path.find('/@Recycle/') != -1 \
+                or event_path.find('/#recycle/') != -1 \
+                or event_path.find('/.') != -1 \
+                or event_path.find('/@eaDir') != -1:
+            logger.debug(f"{event_path} 是回收站或隐藏的文件")
+            return None
+
+        # 命中过滤关键字不处理
+        if self._exclude_keywords:
+            for keyword in self._exclude_keywords.split("\n"):
+                if keyword and re.findall(keyword, event_path):
+                    logger.info(f"{event_path} 命中过滤关键字 {keyword}，不处理")
+                    return None
+
+        # 整理屏蔽词不处理
+        transfer_exclude_words = self.systemconfig.get(SystemConfigKey.TransferExcludeWords)
+        if transfer_exclude_words:
+            for keyword in transfer_exclude_words:
+                if not keyword:
+                    continue
+                if keyword and re.search(r"%s" % keyword, event_path, re.IGNORECASE):
+                    logger.info(f"{event_path} 命中整理屏蔽词 {keyword}，不处理")
+                    return None
+
+        # 不是媒体文件不处理
+        if job.file_path.suffix not in settings.RMT_MEDIAEXT:
+            logger.debug(f"{event_path} 不是媒体文件")
+            return None
+
+        if job.size is None:
+            try:
+                job.size = job.file_path.stat().st_size
+            except OSError:
+                return None
+        return job
+
+    def __dedupe(self, job: TransferJob) -> Optional[TransferJob]:
+        """
+        去重：同一源文件（蓝光原盘为同一BDMV目录）只保留一个处理中的任务，已整理过的不处理
+        """
+        event_path = job.event_path
+        key = event_path
+        # 判断是不是蓝光目录
+        if re.search(r"BDMV[/\\]STREAM", event_path, re.IGNORECASE):
+            # 截取BDMV前面的路径
+            key = event_path[:event_path.find("BDMV")]
+            job.file_path = Path(key)
+            logger.info(f"{event_path} 是蓝光目录，更正文件路径为：{str(job.file_path)}")
+        if not self._pipeline.claim(job, key):
+            logger.debug(f"{job.file_path} 正在处理中")
+            return None
+        if self.transferhis.get_by_src(event_path) \
+                or (key != event_path and self.transferhis.get_by_src(str(job.file_path))):
+            logger.info("文件已处理过：%s" % job.file_path.name)
+            return None
+        return job
+
+    def __recognize(self, job: TransferJob) -> Optional[TransferJob]:
+        """
+        识别媒体信息，识别失败时仍交给整理，由整理流程记录失败历史
+        """
+        job.meta = MetaInfoPath(job.file_path)
+        job.mediainfo = self.mediachain.recognize_by_meta(job.meta)
+        if not job.mediainfo:
+            logger.warn(f"{job.file_path.name} 未识别到媒体信息")
+        return job
 
+    def __transfer(self, job: TransferJob) -> Optional[TransferJob]:
+        """
+        整理文件，刮削由下一阶段处理；同步整理，完成后才有整理历史，去重键保持占用到整理结束
+        """
+        file_path = job.file_path
+        logger.info(f'开始转移{file_path.name}  ...')
+        state, errmsg = self.transferchian.do_transfer(
+            fileitem=FileItem(
+                storage="local",
+                path=str(job.event_path).replace("\\", "/"),
+                type="file",
+                name=file_path.name,
+                basename=file_path.stem,
+                extension=file_path.suffix[1:],
+                size=job.size
+            ),
+            meta=job.meta,
+            mediainfo=job.mediainfo,
+            scrape=False,
+            background=False
+        )
+        if not state:
+            logger.warn(f"{file_path.name} 转移失败：{errmsg}")
+            return None
+        return job if job.mediainfo else None
+
+    def __scrape(self, job: TransferJob) -> Optional[TransferJob]:
+        """
+        刮削整理后的媒体目录，与原先整理时 scrape=True 一致，整理成功后总是刮削
+        """
+        history = self.transferhis.get_by_src(job.event_path) \
+            or self.transferhis.get_by_src(str(job.file_path))
+        if not history or not history.status or not history.dest_fileitem:
+            return None
+        target = self.storagechain.get_parent_item(FileItem(**history.dest_fileitem))
+        # 电视剧刮削剧集目录
+        if target and job.mediainfo.type == MediaType.TV and SEASON_DIR_RE.match(target.name or ""):
+            target = self.storagechain.get_parent_item(target) or target
+        if not target:
+            return None
+        logger.info(f"开始刮削 {target.path} ...")
+        self.mediachain.scrape_metadata(fileitem=target, meta=job.meta, mediainfo=job.mediainfo)
+        return job
+
+    def pipeline_stats(self, apikey: str) -> schemas.Response:
+        """
+        API调用查询整理流水线各阶段队列长度及吞吐量
+        """
+        if apikey != settings.API_TOKEN:
+            return schemas.Response(success=False, message="API密钥错误")
+        if not self._pipeline:
+            return schemas.Response(success=False, message="整理流水线未启动")
+        return schemas.Response(success=True, data=self._pipeline.stats())
 
     def get_state(self) -> bool:
         return self._enabled
@@ -354,6 +521,12 @@ class PathMonitor(_PluginBase):
             "methods": ["GET"],
             "summary": "云盘实时监控同步",
             "description": "云盘实时监控同步",
+        }, {
+            "path": "/pipeline_stats",
+            "endpoint": self.pipeline_stats,
+            "methods": ["GET"],
+            "summary": "整理流水线状态",
+            "description": "查询整理流水线各阶段队列长度及吞吐量",
         }]
 
     def get_service(self) -> List[Dict[str, Any]]:
@@ -368,21 +541,23 @@ class PathMonitor(_PluginBase):
         }]
         """
         if self._enabled and self._cron:
-            return [{
+            services = [{
                 "id": "path_monitor_1",
                 "name": "实时监控全量同步服务",
                 "trigger": CronTrigger.from_crontab(self._cron),
                 "func": self.sync_all,
                 "kwargs": {}
-            },
-                {
+            }]
+            # 有目录未能启动实时监控时定时检测
+            if any(mon_path not in self._watched for mon_path in self._dirconf.keys()):
+                services.append({
                     "id": "path_monitor_2",
                     "name": "定时监控文件同步服务",
                     "trigger": CronTrigger.from_crontab("*/5 * * * *"),
                     "func": self.sync_all_files,
                     "kwargs": {}
-                }
-            ]
+                })
+            return services
         return []
 
 
@@ -575,7 +750,7 @@ class PathMonitor(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -595,7 +770,7 @@ class PathMonitor(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -619,7 +794,7 @@ class PathMonitor(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -631,6 +806,23 @@ class PathMonitor(_PluginBase):
                                         }
                                     }
                                 ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'scan_workers',
+                                            'label': '遍历并发数',
+                                            'placeholder': '4'
+                                        }
+                                    }
+                                ]
                             }
                         ]
                     },
@@ -652,6 +844,7 @@ class PathMonitor(_PluginBase):
                                             'placeholder': '每一行一个目录，支持以下几种配置方式，转移方式支持 move、copy、link、softlink、rclone_copy、rclone_move：\n'
                                                            '监控目录:转移目的目录\n'
                                                            '监控目录:转移目的目录#转移方式\n'
+                                                           '监控目录:转移目的目录#转移方式@遍历并发数\n'
                                         }
                                     }
                                 ]
@@ -761,7 +954,8 @@ class PathMonitor(_PluginBase):
             "exclude_keywords": "",
             "interval": 10,
             "cron": "1 1 * * *",
-            "size": 0
+            "size": 0,
+            "scan_workers": 4
         }
 
     def get_page(self) -> List[dict]:
@@ -771,6 +965,23 @@ class PathMonitor(_PluginBase):
         """
         退出插件
         """
+        for observer in self._observer:
+            try:
+                observer.stop()
+                observer.join()
+            except Exception as e:
+                logger.error(f"停止目录监控失败：{str(e)}")
+        self._observer = []
+        for handler in self._handlers:
+            handler.stop()
+        self._handlers = []
+        self._watched = set()
+        if self._pipeline:
+            self._pipeline.stop()
+            self._pipeline = None
+        if self._scan_state:
+            self._scan_state.close()
+            self._scan_state = None
         if self._scheduler:
             self._scheduler.remove_all_jobs()
             if self._scheduler.running:
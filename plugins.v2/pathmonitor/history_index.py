@@ -0,0 +1,96 @@
+import datetime
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.db.transferhistory_oper import TransferHistoryOper
+from app.log import logger
+
+# 时间格式，与整理历史一致
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class TransferHistoryIndex:
+    """
+    最近整理过的源文件路径索引：首次全量加载时间窗口内的历史，之后只按水位查询新增记录，
+    整理完成事件实时加入；定期全量重建以同步被删除的历史记录
+    """
+
+    def __init__(self, oper: TransferHistoryOper, window_days: int = 4,
+                 overlap_seconds: int = 60, rebuild_seconds: int = 3600):
+        """
+        :param window_days: 保留多少天的记录
+        :param overlap_seconds: 增量查询时水位向前重叠的秒数，避免同一秒写入的记录遗漏
+        :param rebuild_seconds: 全量重建间隔
+        """
+        self._oper = oper
+        self.window_days = window_days
+        self.overlap_seconds = overlap_seconds
+        self.rebuild_seconds = rebuild_seconds
+        # 源文件路径 -> 整理时间
+        self._paths: Dict[str, str] = {}
+        self._watermark: Optional[str] = None
+        self._built = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(path) -> str:
+        return str(Path(str(path)))
+
+    def __window_start(self) -> str:
+        return (datetime.datetime.now() - datetime.timedelta(days=self.window_days)).strftime(DATE_FORMAT)
+
+    def __load(self, start: str) -> int:
+        histories = self._oper.list_by_date(start) or []
+        with self._lock:
+            for item in histories:
+                if not item.src:
+                    continue
+                date = item.date or start
+                self._paths[self.normalize(item.src)] = date
+                if not self._watermark or date > self._watermark:
+                    self._watermark = date
+        return len(histories)
+
+    def reconcile(self):
+        """
+        按水位同步新增的整理记录，超过重建间隔时全量重建
+        """
+        if not self._watermark or time.monotonic() - self._built > self.rebuild_seconds:
+            self.rebuild()
+            return
+        watermark = datetime.datetime.strptime(self._watermark, DATE_FORMAT) \
+            - datetime.timedelta(seconds=self.overlap_seconds)
+        count = self.__load(watermark.strftime(DATE_FORMAT))
+        # 移出时间窗口的记录
+        window_start = self.__window_start()
+        with self._lock:
+            expired = [path for path, date in self._paths.items() if date < window_start]
+            for path in expired:
+                self._paths.pop(path, None)
+        logger.debug(f"整理历史索引增量同步 {count} 条，移除过期 {len(expired)} 条，共 {len(self._paths)} 条")
+
+    def rebuild(self):
+        start = self.__window_start()
+        with self._lock:
+            self._paths = {}
+            self._watermark = None
+        count = self.__load(start)
+        self._built = time.monotonic()
+        logger.debug(f"整理历史索引重建，共 {count} 条")
+
+    def add(self, path, date: str = None):
+        """
+        整理完成事件中的源文件
+        """
+        with self._lock:
+            self._paths[self.normalize(path)] = date or datetime.datetime.now().strftime(DATE_FORMAT)
+
+    def __contains__(self, path) -> bool:
+        with self._lock:
+            return self.normalize(path) in self._paths
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._paths)
@@ -0,0 +1,195 @@
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from app.log import logger
+
+# 各阶段队列长度上限，队列满时上一阶段等待
+QUEUE_SIZE = 200
+# 吞吐量统计窗口（秒）
+RATE_WINDOW = 60
+
+
+class TransferJob:
+    """
+    待整理的文件，依次经过各阶段处理
+    """
+
+    def __init__(self, event_path: str, size: Optional[int] = None):
+        self.event_path = event_path
+        self.file_path = Path(event_path)
+        self.size = size
+        # 去重键：源文件路径，蓝光原盘为BDMV所在目录
+        self.key: Optional[str] = None
+        self.meta = None
+        self.mediainfo = None
+
+    def __str__(self):
+        return self.event_path
+
+
+class Stage:
+    """
+    流水线的一个阶段：独立的有界队列和工作线程
+    """
+
+    def __init__(self, name: str, handler: Callable[[TransferJob], Optional[TransferJob]], workers: int):
+        """
+        :param handler: 处理任务，返回任务交给下一阶段，返回None表示到此结束
+        :param workers: 工作线程数
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.threads: List[threading.Thread] = []
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.seconds = 0.0
+        # 最近完成时间，统计吞吐量
+        self.finished = deque(maxlen=10000)
+
+    def record(self, elapsed: float, passed: Optional[bool]):
+        """
+        :param passed: 交给下一阶段True，到此结束False，出错None
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.busy -= 1
+            self.processed += 1
+            self.seconds += elapsed
+            self.finished.append(now)
+            if passed is None:
+                self.failed += 1
+            elif not passed:
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            recent = sum(1 for finished in self.finished if now - finished <= RATE_WINDOW)
+            return {
+                "workers": self.workers,
+                "queued": self.queue.qsize(),
+                "busy": self.busy,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "avg_ms": round(self.seconds / self.processed * 1000, 1) if self.processed else 0,
+                "per_minute": round(recent * 60 / RATE_WINDOW, 1)
+            }
+
+
+class TransferPipeline:
+    """
+    整理流水线：过滤 → 去重 → 识别 → 整理 → 刮削，各阶段使用独立的线程池并发处理，
+    同一源文件（蓝光原盘为同一BDMV目录）同一时间只有一个任务在流水线中
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable[[TransferJob], Optional[TransferJob]], int]]):
+        """
+        :param stages: [(阶段名称, 处理函数, 工作线程数)]
+        """
+        self._stages = [Stage(name, handler, workers) for name, handler, workers in stages]
+        self._stopped = threading.Event()
+        # 流水线中的去重键
+        self._keys: Set[str] = set()
+        self._keys_lock = threading.Lock()
+
+    def start(self):
+        self._stopped.clear()
+        for idx, stage in enumerate(self._stages):
+            for num in range(stage.workers):
+                thread = threading.Thread(target=self.__run, args=(idx,),
+                                          name=f"pathmonitor-{stage.name}-{num}", daemon=True)
+                stage.threads.append(thread)
+                thread.start()
+
+    def stop(self, timeout: float = 5):
+        """
+        停止全部阶段，最多等待 timeout 秒，正在处理的任务完成后线程自行退出
+        """
+        self._stopped.set()
+        deadline = time.monotonic() + timeout
+        for stage in self._stages:
+            for thread in stage.threads:
+                thread.join(timeout=max(0.0, deadline - time.monotonic()))
+            stage.threads = []
+            # 丢弃未处理的任务
+            while True:
+                try:
+                    job = stage.queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.release(job)
+
+    def submit(self, job: TransferJob) -> bool:
+        """
+        加入流水线，队列满时等待
+        """
+        return self.__put(0, job)
+
+    def claim(self, job: TransferJob, key: str) -> bool:
+        """
+        占用去重键，已有相同键的任务在流水线中时返回False
+        """
+        with self._keys_lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+        job.key = key
+        return True
+
+    def release(self, job: TransferJob):
+        if job.key:
+            with self._keys_lock:
+                self._keys.discard(job.key)
+            job.key = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._keys_lock:
+            inflight = len(self._keys)
+        return {
+            "running": not self._stopped.is_set(),
+            "inflight": inflight,
+            "stages": {stage.name: stage.stats() for stage in self._stages}
+        }
+
+    def __put(self, idx: int, job: TransferJob) -> bool:
+        stage = self._stages[idx]
+        while not self._stopped.is_set():
+            try:
+                stage.queue.put(job, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __run(self, idx: int):
+        stage = self._stages[idx]
+        last = idx == len(self._stages) - 1
+        while not self._stopped.is_set():
+            try:
+                job = stage.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with stage.lock:
+                stage.busy += 1
+            start = time.monotonic()
+            try:
+                result = stage.handler(job)
+            except Exception as e:
+                logger.error(f"{job} {stage.name} 阶段出错：{str(e)} - {traceback.format_exc()}")
+                stage.record(time.monotonic() - start, None)
+                self.release(job)
+                continue
+            stage.record(time.monotonic() - start, result is not None)
+            if result is None or last or not self.__put(idx + 1, result):
+                self.release(job)
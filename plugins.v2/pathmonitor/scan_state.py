@@ -0,0 +1,233 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Tuple
+
+from app.log import logger
+
+from .walker import ParallelWalker
+
+# 最后一次扫描时仍在变化的文件（可能正在写入），下次扫描时重新获取大小
+RECENT_SECONDS = 600
+# 每处理多少个目录提交一次
+COMMIT_DIRS = 200
+
+
+class ScanEntry(NamedTuple):
+    path: str
+    size: int
+    # 秒
+    mtime: float
+    # 新文件或大小、修改时间有变化
+    changed: bool
+
+
+class ScanState:
+    """
+    目录扫描状态缓存：记录文件的 inode、大小、修改时间及目录的修改时间，
+    目录修改时间未变化时不再列出目录内容，直接使用缓存，每个文件每次扫描最多获取一次状态
+    """
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                parent TEXT NOT NULL,
+                inode INTEGER,
+                size INTEGER,
+                mtime INTEGER,
+                last_seen INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_parent ON files(parent);
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                parent TEXT NOT NULL,
+                mtime INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_dirs_parent ON dirs(parent);
+        """)
+        self._conn.commit()
+        # 数据库访问锁、同一时间只进行一次遍历
+        self._lock = threading.RLock()
+        self._walk_lock = threading.Lock()
+        # 关闭时中止正在进行的遍历
+        self._closing = threading.Event()
+        self._stats = {"listed": 0, "cached": 0, "stat": 0}
+        self._dirs = 0
+
+    def close(self):
+        """
+        中止正在进行的遍历，不等待遍历结束；遍历中时由遍历结束后关闭数据库
+        """
+        self._closing.set()
+        if not self._walk_lock.acquire(blocking=False):
+            return
+        try:
+            self.__close_conn()
+        finally:
+            self._walk_lock.release()
+
+    def __close_conn(self):
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def walk(self, root: Path, extensions: Iterable[str], workers: int = 1) -> Iterator[ScanEntry]:
+        """
+        遍历目录下的媒体文件
+        :param root: 监控目录
+        :param extensions: 文件扩展名
+        :param workers: 并发列目录的线程数
+        """
+        exts = {ext.lower() for ext in extensions}
+        # 不解析软链接，与监控事件、整理历史中的路径保持一致
+        root = str(root)
+        with self._walk_lock:
+            if self._closing.is_set():
+                return
+            with self._lock:
+                before = dict(self._stats)
+            try:
+                for entry in ParallelWalker(lambda directory: self.__visit(directory, exts), workers).walk(root):
+                    if self._closing.is_set():
+                        logger.info(f"{root} 扫描已中止")
+                        break
+                    yield entry
+            finally:
+                with self._lock:
+                    if self._conn:
+                        self._conn.commit()
+                    stats = {key: value - before[key] for key, value in self._stats.items()}
+                logger.debug(f"{root} 扫描完成：列出 {stats['listed']} 个目录，"
+                             f"使用缓存 {stats['cached']} 个目录，获取文件状态 {stats['stat']} 次")
+                if self._closing.is_set():
+                    self.__close_conn()
+
+    def __count(self, key: str, value: int = 1):
+        with self._lock:
+            self._stats[key] += value
+
+    def __visit(self, directory: str, exts: set) -> Tuple[List[str], List[ScanEntry]]:
+        """
+        处理单个目录，文件系统操作不加锁，可多线程同时进行
+        :return: 子目录, 媒体文件
+        """
+        if self._closing.is_set():
+            return [], []
+        try:
+            dir_mtime = os.stat(directory).st_mtime_ns
+            self.__count("stat")
+        except OSError:
+            with self._lock:
+                self.__forget_dir(directory)
+            return [], []
+        with self._lock:
+            row = self._conn.execute("SELECT mtime FROM dirs WHERE path = ?", (directory,)).fetchone()
+            cached = bool(row) and row[0] == dir_mtime
+            if cached:
+                subdirs = [path for path, in self._conn.execute(
+                    "SELECT path FROM dirs WHERE parent = ?", (directory,)).fetchall()]
+                rows = self._conn.execute("SELECT path, size, mtime, last_seen FROM files WHERE parent = ?",
+                                          (directory,)).fetchall()
+        if cached:
+            # 目录内容未变化
+            self.__count("cached")
+            entries = self.__cached_files(rows)
+        else:
+            self.__count("listed")
+            subdirs, entries = self.__list_dir(directory, dir_mtime, exts)
+        with self._lock:
+            self._dirs += 1
+            if self._dirs % COMMIT_DIRS == 0:
+                self._conn.commit()
+        return subdirs, entries
+
+    def __cached_files(self, rows: list) -> List[ScanEntry]:
+        now = time.time_ns()
+        entries, updates, removed = [], [], []
+        for path, size, mtime, last_seen in rows:
+            changed = False
+            # 上次扫描时刚修改过，可能还在写入
+            if (last_seen or 0) - (mtime or 0) < RECENT_SECONDS * 1e9:
+                try:
+                    stat = os.stat(path)
+                    self.__count("stat")
+                except OSError:
+                    removed.append((path,))
+                    continue
+                changed = (stat.st_size, stat.st_mtime_ns) != (size, mtime)
+                size, mtime = stat.st_size, stat.st_mtime_ns
+                updates.append((stat.st_ino, size, mtime, now, path))
+            entries.append(ScanEntry(path, size, mtime / 1e9, changed))
+        if updates or removed:
+            with self._lock:
+                self._conn.executemany("DELETE FROM files WHERE path = ?", removed)
+                self._conn.executemany("UPDATE files SET inode = ?, size = ?, mtime = ?, last_seen = ? "
+                                       "WHERE path = ?", updates)
+        return entries
+
+    def __list_dir(self, directory: str, dir_mtime: int, exts: set) -> Tuple[List[str], List[ScanEntry]]:
+        now = time.time_ns()
+        subdirs, files = [], []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            subdirs.append(entry.path)
+                        elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in exts:
+                            stat = entry.stat()
+                            files.append((entry.path, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warn(f"无法列出目录 {directory}：{str(e)}")
+            return [], []
+        self.__count("stat", len(files))
+
+        conn = self._conn
+        with self._lock:
+            old_files = {path: (size, mtime) for path, size, mtime in conn.execute(
+                "SELECT path, size, mtime FROM files WHERE parent = ?", (directory,)).fetchall()}
+            old_dirs = {path for path, in conn.execute(
+                "SELECT path FROM dirs WHERE parent = ?", (directory,)).fetchall()}
+            # 已删除的文件、目录
+            current_files = {path for path, *_ in files}
+            conn.executemany("DELETE FROM files WHERE path = ?",
+                             [(path,) for path in old_files if path not in current_files])
+            for path in old_dirs - set(subdirs):
+                self.__forget_dir(path)
+            conn.executemany("INSERT OR IGNORE INTO dirs (path, parent, mtime) VALUES (?, ?, NULL)",
+                             [(path, directory) for path in subdirs])
+            conn.executemany("INSERT OR REPLACE INTO files (path, parent, inode, size, mtime, last_seen) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             [(path, directory, inode, size, mtime, now) for path, inode, size, mtime in files])
+            # 先获取目录时间再列出内容，期间的变化下次扫描时会重新列出
+            conn.execute("INSERT INTO dirs (path, parent, mtime) VALUES (?, ?, ?) "
+                         "ON CONFLICT(path) DO UPDATE SET mtime = excluded.mtime",
+                         (directory, os.path.dirname(directory), dir_mtime))
+
+        entries = [ScanEntry(path, size, mtime / 1e9, old_files.get(path) != (size, mtime))
+                   for path, _, size, mtime in files]
+        return subdirs, entries
+
+    def __forget_dir(self, directory: str):
+        """
+        删除目录及其下所有记录
+        """
+        prefix = directory.rstrip(os.sep) + os.sep
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        self._conn.execute("DELETE FROM files WHERE parent = ? OR parent LIKE ? ESCAPE '\\'",
+                           (directory, pattern))
+        self._conn.execute("DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (directory, pattern))
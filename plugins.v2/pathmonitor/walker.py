@@ -0,0 +1,120 @@
+import queue
+import threading
+from collections import deque
+from typing import Callable, Iterator, List, Tuple, TypeVar
+
+from app.log import logger
+
+T = TypeVar("T")
+
+# 结果队列结束标记
+_DONE = object()
+
+
+class ParallelWalker:
+    """
+    多线程遍历目录树：每个线程优先处理自己发现的子目录（深度优先），空闲时从其他线程的队列头部窃取，
+    适合列目录延迟高的网络挂载，结果按目录依次产出
+    """
+
+    def __init__(self, visit: Callable[[str], Tuple[List[str], List[T]]], workers: int = 4):
+        """
+        :param visit: 处理单个目录，返回 (子目录列表, 结果列表)
+        :param workers: 并发数
+        """
+        self.visit = visit
+        self.workers = max(1, workers)
+
+    def walk(self, root: str) -> Iterator[T]:
+        if self.workers == 1:
+            # 单线程直接遍历
+            stack = [root]
+            while stack:
+                subdirs, items = self.__visit(stack.pop())
+                stack.extend(subdirs)
+                yield from items
+            return
+
+        deques = [deque() for _ in range(self.workers)]
+        deques[0].append(root)
+        results: queue.Queue = queue.Queue(maxsize=self.workers * 4)
+        cond = threading.Condition()
+        stop = threading.Event()
+        # 未完成的目录数
+        outstanding = [1]
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def take(idx: int):
+            try:
+                return deques[idx].pop()
+            except IndexError:
+                pass
+            for offset in range(1, self.workers):
+                try:
+                    return deques[(idx + offset) % self.workers].popleft()
+                except IndexError:
+                    continue
+            return None
+
+        def worker(idx: int):
+            while not stop.is_set():
+                directory = take(idx)
+                if directory is None:
+                    with cond:
+                        if outstanding[0] == 0:
+                            return
+                        cond.wait(timeout=0.1)
+                    continue
+                subdirs, items = self.__visit(directory)
+                if subdirs:
+                    with cond:
+                        outstanding[0] += len(subdirs)
+                    deques[idx].extend(subdirs)
+                    with cond:
+                        cond.notify_all()
+                if items:
+                    put(items)
+                with cond:
+                    outstanding[0] -= 1
+                    finished = outstanding[0] == 0
+                    if finished:
+                        cond.notify_all()
+                if finished:
+                    put(_DONE)
+
+        threads = [threading.Thread(target=worker, args=(idx,), name=f"pathmonitor-walker-{idx}", daemon=True)
+                   for idx in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                items = results.get()
+                if items is _DONE:
+                    break
+                yield from items
+        finally:
+            stop.set()
+            with cond:
+                cond.notify_all()
+            # 释放阻塞在结果队列上的线程
+            while True:
+                try:
+                    results.get_nowait()
+                except queue.Empty:
+                    break
+            for thread in threads:
+                thread.join(timeout=5)
+
+    def __visit(self, directory: str) -> Tuple[List[str], List[T]]:
+        try:
+            return self.visit(directory)
+        except Exception as e:
+            logger.error(f"遍历目录 {directory} 出错：{str(e)}")
+            return [], []
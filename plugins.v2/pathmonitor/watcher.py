@@ -0,0 +1,158 @@
+import errno
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from app.log import logger
+
+# 只有创建事件的文件（如硬链接），大小多久不变视为写入完成（秒）
+SETTLE_SECONDS = 5
+
+INOTIFY_LIMIT_HELP = """请在宿主机上（不是docker容器内）执行以下命令并重启：
+echo fs.inotify.max_user_watches=524288 | sudo tee -a /etc/sysctl.conf
+echo fs.inotify.max_user_instances=524288 | sudo tee -a /etc/sysctl.conf
+sudo sysctl -p"""
+
+
+def mount_fstype(path: str) -> Optional[str]:
+    """
+    查询路径所在挂载点的文件系统类型
+    """
+    try:
+        path = os.path.realpath(path)
+        best, fstype = "", None
+        with open("/proc/mounts", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount_point = parts[1].replace("\\040", " ")
+                if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) \
+                        and len(mount_point) >= len(best):
+                    best, fstype = mount_point, parts[2]
+        return fstype
+    except OSError:
+        return None
+
+
+def is_remote_mount(path: str) -> bool:
+    """
+    rclone、CloudDrive 等 FUSE 挂载及网络文件系统上 inotify 收不到远端变化
+    """
+    fstype = mount_fstype(path) or ""
+    return fstype.startswith("fuse") or fstype in ("nfs", "nfs4", "cifs", "smb3", "9p")
+
+
+class FileMonitorHandler(FileSystemEventHandler):
+    """
+    目录监控响应类：写入完成、移入的文件立即处理，只有创建事件的文件等待大小稳定后处理
+    """
+
+    def __init__(self, mon_path: str, callback: Callable[[str, str], None], settle: float = SETTLE_SECONDS):
+        """
+        :param mon_path: 监控目录
+        :param callback: 处理文件 (文件路径, 监控目录)
+        """
+        super().__init__()
+        self._watch_path = mon_path
+        self._callback = callback
+        self._settle = settle
+        # 文件 -> (大小, 最后变化时间)
+        self._pending: Dict[str, Tuple[int, float]] = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self.__settle_loop, name="pathmonitor-settle", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._pending.clear()
+            self._cond.notify_all()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.__watch(event.src_path)
+
+    def on_modified(self, event):
+        # 等待大小稳定的文件，修改时重新计时
+        if not event.is_directory:
+            with self._cond:
+                if event.src_path in self._pending:
+                    self._pending[event.src_path] = (-1, time.monotonic())
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.__handle(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            with self._cond:
+                self._pending.pop(event.src_path, None)
+            self.__handle(event.dest_path)
+
+    def __watch(self, path: str):
+        with self._cond:
+            self._pending[path] = (-1, time.monotonic())
+            self._cond.notify()
+
+    def __handle(self, path: str):
+        with self._cond:
+            self._pending.pop(path, None)
+        try:
+            self._callback(path, self._watch_path)
+        except Exception as e:
+            logger.error(f"处理文件 {path} 出错：{str(e)}")
+
+    def __settle_loop(self):
+        while True:
+            ready = []
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                self._cond.wait(timeout=1)
+                now = time.monotonic()
+                for path, (size, changed) in list(self._pending.items()):
+                    try:
+                        current = os.stat(path).st_size
+                    except OSError:
+                        self._pending.pop(path, None)
+                        continue
+                    if current != size:
+                        self._pending[path] = (current, now)
+                    elif now - changed >= self._settle:
+                        self._pending.pop(path, None)
+                        ready.append(path)
+            for path in ready:
+                self.__handle(path)
+
+
+def start_observer(mon_path: str, handler: FileMonitorHandler) -> Observer:
+    """
+    启动 inotify 目录监控，失败时抛出异常，由定时扫描兜底
+    """
+    observer = Observer(timeout=10)
+    try:
+        observer.schedule(handler, path=mon_path, recursive=True)
+        observer.daemon = True
+        observer.start()
+        return observer
+    except OSError as e:
+        err_msg = str(e)
+        if e.errno in (errno.ENOSPC, errno.EMFILE) or ("inotify" in err_msg and "reached" in err_msg):
+            logger.warn(f"{mon_path} inotify 监控数量达到上限。{INOTIFY_LIMIT_HELP}")
+        try:
+            observer.stop()
+        except Exception:
+            pass
+        raise
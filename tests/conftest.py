@@ -0,0 +1,77 @@
+"""
+MoviePilot 主程序不可用时，为插件模块提供用到的少量 app.* 名称，插件内部逻辑可以脱离主程序测试
+"""
+import importlib.util
+import logging
+import sys
+import types
+
+
+class _Logger:
+    """
+    与 app.log.logger 接口一致
+    """
+
+    def __init__(self):
+        self._logger = logging.getLogger("moviepilot")
+
+    def debug(self, msg, *args, **kwargs):
+        self._logger.debug(msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self._logger.info(msg, *args, **kwargs)
+
+    def warn(self, msg, *args, **kwargs):
+        self._logger.warning(msg, *args, **kwargs)
+
+    warning = warn
+
+    def error(self, msg, *args, **kwargs):
+        self._logger.error(msg, *args, **kwargs)
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    if "." in name:
+        parent, _, child = name.rpartition(".")
+        setattr(sys.modules[parent], child, module)
+    sys.modules[name] = module
+    return module
+
+
+def _stub_app():
+    if importlib.util.find_spec("app") is not None:
+        return
+
+    class ServiceBaseHelper:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        @staticmethod
+        def get_configs():
+            return {}
+
+    class MediaServerConf:
+        pass
+
+    class SystemConfigKey:
+        MediaServers = "MediaServers"
+
+    class ModuleType:
+        MediaServer = "mediaserver"
+
+    class TransferHistoryOper:
+        pass
+
+    _module("app", __path__=[])
+    _module("app.log", logger=_Logger())
+    _module("app.helper", __path__=[])
+    _module("app.helper.service", ServiceBaseHelper=ServiceBaseHelper)
+    _module("app.schemas", __path__=[], MediaServerConf=MediaServerConf)
+    _module("app.schemas.types", SystemConfigKey=SystemConfigKey, ModuleType=ModuleType)
+    _module("app.db", __path__=[])
+    _module("app.db.transferhistory_oper", TransferHistoryOper=TransferHistoryOper)
+
+
+_stub_app()
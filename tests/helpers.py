@@ -0,0 +1,20 @@
+import importlib
+import sys
+import types
+from pathlib import Path
+
+PLUGINS_DIR = Path(__file__).resolve().parents[1] / "plugins.v2"
+
+
+def load_plugin_module(plugin: str, module: str):
+    """
+    导入插件的子模块，不执行插件 __init__（依赖完整的 MoviePilot 主程序），支持模块内的相对导入
+    :param plugin: 插件目录名，如 ad
+    :param module: 模块名，如 skip_helper
+    """
+    package = f"_plugins_v2_{plugin}"
+    if package not in sys.modules:
+        pkg = types.ModuleType(package)
+        pkg.__path__ = [str(PLUGINS_DIR / plugin)]
+        sys.modules[package] = pkg
+    return importlib.import_module(f"{package}.{module}")
@@ -0,0 +1,62 @@
+from helpers import load_plugin_module
+
+backfill = load_plugin_module("ad", "backfill")
+
+
+def run_backfill(monkeypatch, pages, series):
+    """
+    运行一次补标记直至结束，pages(series_id, start_index) 返回分页或抛出异常
+    """
+    marked = []
+    saved = {}
+
+    def iter_episode_pages(series_id, start_index=0, limit=50, server=None):
+        yield from pages(series_id, start_index)
+
+    def batch_apply_markers(item_ids, **kwargs):
+        marked.extend(item_ids)
+        return {"total": len(item_ids), "success": len(item_ids), "failed": 0}
+
+    monkeypatch.setattr(backfill, "iter_episode_pages", iter_episode_pages)
+    monkeypatch.setattr(backfill, "batch_apply_markers", batch_apply_markers)
+    monkeypatch.setattr(backfill, "RETRY_MAX_DELAY", 0)
+    runner = backfill.IntroSkipBackfill(load_state=lambda: None, save_state=lambda state: saved.update(state),
+                                        batch_size=2, interval=0)
+    assert runner.start(series)
+    runner._thread.join(5)
+    return runner, marked, saved
+
+
+def test_backfill_resumes_from_checkpoint_after_error(monkeypatch):
+    failures = []
+
+    def pages(series_id, start_index):
+        for index in range(start_index, 6, 2):
+            if index == 2 and not failures:
+                failures.append(start_index)
+                raise ConnectionError("emby down")
+            yield index + 2, [(None, None, f"{series_id}-{index}"), (None, None, f"{series_id}-{index + 1}")]
+
+    runner, marked, saved = run_backfill(monkeypatch, pages, {"Show": {"item_id": "s", "intro_end": 90}})
+    # 出错时已完成第一页，重试从断点继续，不重复标记也不跳过
+    assert failures == [0]
+    assert marked == [f"s-{index}" for index in range(6)]
+    assert saved["pending"] == []
+    assert saved["series_done"] == 1
+    assert runner.progress()["finished_at"]
+
+
+def test_backfill_skips_series_after_retry_limit(monkeypatch):
+    attempts = []
+
+    def pages(series_id, start_index):
+        if series_id == "bad":
+            attempts.append(start_index)
+            raise ConnectionError("gone")
+        yield 2, [(None, None, "good-0")]
+
+    _, marked, saved = run_backfill(monkeypatch, pages, {"Bad": {"item_id": "bad", "intro_end": 90},
+                                                         "Good": {"item_id": "good", "intro_end": 90}})
+    assert len(attempts) == backfill.RETRY_LIMIT
+    assert marked == ["good-0"]
+    assert saved["series_done"] == 2
@@ -0,0 +1,60 @@
+import pytest
+
+from helpers import load_plugin_module
+
+np = pytest.importorskip("numpy")
+fingerprint = load_plugin_module("ad", "fingerprint")
+
+SAMPLE_RATE = fingerprint.SAMPLE_RATE
+HEAD_SEC = 120
+THEME_SEC = 40
+
+
+def melody(seed: int, seconds: float) -> np.ndarray:
+    """
+    随机音高的音符序列，每个音符 0.5 秒
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(SAMPLE_RATE * 0.5)) / SAMPLE_RATE
+    notes = [0.5 * np.sin(2 * np.pi * 220 * 2 ** (rng.integers(0, 24) / 12) * t) for _ in range(int(seconds * 2))]
+    return np.concatenate(notes) if notes else np.zeros(0)
+
+
+def noise(seed: int, seconds: float) -> np.ndarray:
+    return np.random.default_rng(seed).normal(0, 0.2, int(SAMPLE_RATE * seconds))
+
+
+def features(samples: np.ndarray) -> np.ndarray:
+    return fingerprint.chroma_fingerprint((np.clip(samples, -1, 1) * 32767).astype(np.int16))
+
+
+def episode(offset: float, seed: int, filler=noise) -> np.ndarray:
+    """
+    开头 HEAD_SEC 秒，片头曲从 offset 秒开始，其余为每集不同的内容
+    """
+    theme = melody(1, THEME_SEC)
+    return features(np.concatenate((filler(seed, offset), theme,
+                                    filler(seed + 100, HEAD_SEC - offset - THEME_SEC))))
+
+
+@pytest.mark.parametrize("filler", [noise, melody])
+@pytest.mark.parametrize("offset_a,offset_b", [(30, 30), (30, 75), (1, 60)])
+def test_find_shared_segment_locates_theme(filler, offset_a, offset_b):
+    segment = fingerprint.find_shared_segment(episode(offset_a, 5, filler), episode(offset_b, 9, filler))
+    assert segment is not None
+    a_start, a_end, b_start, b_end = segment
+    assert a_start == pytest.approx(offset_a, abs=1.5)
+    assert a_end == pytest.approx(offset_a + THEME_SEC, abs=1.5)
+    assert b_start == pytest.approx(offset_b, abs=1.5)
+    assert b_end == pytest.approx(offset_b + THEME_SEC, abs=1.5)
+
+
+@pytest.mark.parametrize("filler", [noise, melody])
+def test_find_shared_segment_without_shared_audio(filler):
+    a = features(filler(3, 195))
+    b = features(filler(4, 195))
+    assert fingerprint.find_shared_segment(a, b) is None
+
+
+def test_find_shared_segment_short_input():
+    assert fingerprint.find_shared_segment(features(noise(1, 5)), features(noise(2, 120))) is None
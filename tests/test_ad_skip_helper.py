@@ -0,0 +1,115 @@
+from helpers import load_plugin_module
+
+skip_helper = load_plugin_module("ad", "skip_helper")
+
+
+def test_diff_markers_unchanged_intro():
+    chapters = [
+        {'Index': 0, 'MarkerType': 'IntroStart', 'StartPositionTicks': 0},
+        {'Index': 1, 'MarkerType': 'IntroEnd', 'StartPositionTicks': 95 * 10000000},
+        {'Index': 2, 'MarkerType': 'Chapter', 'StartPositionTicks': 600 * 10000000},
+    ]
+    remove, add = skip_helper.diff_markers(chapters, 'Intro', skip_helper.INTRO_MARKERS,
+                                           [skip_helper.format_time(0), skip_helper.format_time(95)])
+    assert remove == []
+    assert add == []
+
+
+def test_diff_markers_unchanged_time_string():
+    chapters = [
+        {'Index': 0, 'MarkerType': 'IntroStart', 'Time': '00:00:00.000'},
+        {'Index': 1, 'MarkerType': 'IntroEnd', 'Time': '00:01:35.000'},
+    ]
+    remove, add = skip_helper.diff_markers(chapters, 'Intro', skip_helper.INTRO_MARKERS,
+                                           [skip_helper.format_time(0), skip_helper.format_time(95)])
+    assert (remove, add) == ([], [])
+
+
+def test_diff_markers_changed_intro():
+    chapters = [
+        {'Index': 0, 'MarkerType': 'IntroStart', 'StartPositionTicks': 0},
+        {'Index': 1, 'MarkerType': 'IntroEnd', 'StartPositionTicks': 90 * 10000000},
+    ]
+    remove, add = skip_helper.diff_markers(chapters, 'Intro', skip_helper.INTRO_MARKERS,
+                                           [skip_helper.format_time(0), skip_helper.format_time(95)])
+    assert remove == [0, 1]
+    assert [type_ for _, type_, _ in add] == ['intro_start', 'intro_end']
+
+
+class FakeClient:
+    """
+    只返回固定章节、记录写入请求的 Emby 客户端
+    """
+
+    def __init__(self, chapters: list):
+        self.chapters = chapters
+        self.updates = []
+
+    def get_json(self, path, params=None, timeout=None):
+        return {'chapters': self.chapters}
+
+    def get(self, path, params=None, timeout=None):
+        self.updates.append(path)
+        raise AssertionError(f'unexpected update {path}')
+
+    def close(self):
+        pass
+
+
+def test_apply_markers_skips_correct_chapters():
+    client = FakeClient([
+        {'Index': 0, 'MarkerType': 'IntroStart', 'StartPositionTicks': 0},
+        {'Index': 1, 'MarkerType': 'IntroEnd', 'StartPositionTicks': 95 * 10000000},
+        {'Index': 2, 'MarkerType': 'CreditsStart', 'StartPositionTicks': 1300 * 10000000},
+    ])
+    skip_helper.emby_registry.register('test', client)
+    try:
+        assert skip_helper.apply_markers('1', intro_end=95, credits_start=1300, server='test')
+        assert client.updates == []
+    finally:
+        skip_helper.emby_registry.unregister('test')
+
+
+def test_rule_matcher_ignores_blank_keywords():
+    matcher = skip_helper.RuleMatcher(include='动画,,日剧, ', exclude='SP,,OVA,', spec='#1:00#2:00\n 国产 #1:30#2:00*')
+    assert matcher.include == ['动画', '日剧']
+    assert matcher.exclude == ['SP', 'OVA']
+    assert [spec[0] for spec in matcher.spec] == ['国产']
+    assert matcher.match('/media/电影/Movie (2020)/movie.mkv') == {'include': None, 'exclude': None, 'spec': None}
+    assert matcher.match('/media/动画/国产/x.mkv') == {'include': '动画', 'exclude': None,
+                                                     'spec': ('国产', 90, 120, True)}
+
+
+def test_keyword_automaton_skips_empty_keyword():
+    automaton = skip_helper.KeywordAutomaton(['', 'ab'])
+    assert automaton.search('xyz') == set()
+    assert automaton.search('xaby') == {1}
+
+
+def test_registry_caches_configs(monkeypatch):
+    calls = []
+
+    class Conf:
+        type = 'emby'
+        config = {'host': 'emby:8096', 'apikey': 'key'}
+
+    class Helper:
+        def __init__(self, *args):
+            pass
+
+        def get_configs(self):
+            calls.append(1)
+            return {'emby': Conf()}
+
+    monkeypatch.setattr(skip_helper, 'ServiceBaseHelper', Helper)
+    registry = skip_helper.EmbyRegistry()
+    try:
+        first = registry.get('emby')
+        assert registry.get('emby') is first
+        assert registry.names() == ['emby']
+        assert calls == [1]
+        registry.refresh()
+        assert registry.get() is first
+        assert calls == [1, 1]
+    finally:
+        registry.close()
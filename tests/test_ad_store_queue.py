@@ -0,0 +1,112 @@
+import threading
+import time
+
+from helpers import load_plugin_module
+
+store = load_plugin_module("ad", "store")
+episode_queue = load_plugin_module("ad", "episode_queue")
+debounce = load_plugin_module("ad", "debounce")
+
+
+def make_store(data: dict = None):
+    saved = {}
+    return store.WriteBehindStore(load_all=lambda: dict(data or {}), load=lambda key: None,
+                                  save=saved.__setitem__), saved
+
+
+def test_store_flushes_only_dirty_keys():
+    write_behind, saved = make_store({"a": {"x": 1}, "b": 2})
+    value = write_behind.get("a")
+    value["x"] = 2
+    assert write_behind.get("a") == {"x": 1}
+    write_behind.set("a", value)
+    write_behind.flush()
+    assert saved == {"a": {"x": 2}}
+    saved.clear()
+    write_behind.flush()
+    assert saved == {}
+
+
+def test_store_lazy_value_is_produced_once_at_flush():
+    write_behind, saved = make_store()
+    calls = []
+
+    def produce():
+        calls.append(1)
+        return {"runtime": len(calls)}
+
+    for _ in range(5):
+        write_behind.set_lazy("runtimes", produce)
+    assert calls == []
+    write_behind.flush()
+    assert calls == [1]
+    assert saved == {"runtimes": {"runtime": 1}}
+
+
+def test_store_lazy_none_keeps_previous_value():
+    write_behind, saved = make_store({"runtimes": {"a": 1}})
+    write_behind.set_lazy("runtimes", lambda: None)
+    write_behind.flush()
+    assert saved == {}
+    assert write_behind.get("runtimes") == {"a": 1}
+
+
+def test_store_retries_failed_save():
+    attempts = []
+
+    def save(key, value):
+        attempts.append(key)
+        if len(attempts) == 1:
+            raise OSError("busy")
+
+    write_behind = store.WriteBehindStore(load_all=dict, load=lambda key: None, save=save)
+    write_behind.set("a", 1)
+    write_behind.flush()
+    write_behind.flush()
+    assert attempts == ["a", "a"]
+
+
+def test_episode_queue_merges_and_waits_for_running_jobs():
+    handled = []
+    started = threading.Event()
+
+    def handler(job):
+        started.set()
+        time.sleep(0.2)
+        handled.append(str(job))
+        return True
+
+    queue = episode_queue.NewEpisodeQueue(handler, base_delay=0.05)
+    queue.start()
+    try:
+        assert queue.submit("Show", "1", {}, 1, [2])
+        assert not queue.submit("Show", "1", {}, 1, [1])
+        assert started.wait(2)
+        # 正在处理的任务不在等待列表中，join 仍需等待
+        assert queue.pending() == []
+        assert queue.join(timeout=2)
+        assert handled == ["S01E01,S01E02"]
+    finally:
+        queue.stop()
+
+
+def test_episode_queue_retries_until_max_attempts():
+    attempts = []
+    queue = episode_queue.NewEpisodeQueue(lambda job: attempts.append(job.attempts) or False,
+                                          base_delay=0.01, max_delay=0.02, max_attempts=3)
+    queue.start()
+    try:
+        queue.submit("Show", "1", {}, 1, [1])
+        assert queue.join(timeout=2)
+        assert attempts == [1, 2, 3]
+    finally:
+        queue.stop()
+
+
+def test_debouncer_keeps_last_decision():
+    fired = []
+    debouncer = debounce.Debouncer(handler=fired.append, window=0.1)
+    for idx in range(5):
+        debouncer.submit(key="show", decision={"idx": idx})
+    time.sleep(0.3)
+    assert fired == [{"idx": 4}]
@@ -0,0 +1,30 @@
+import os
+
+from helpers import load_plugin_module
+
+archive = load_plugin_module("cleanlogs", "archive")
+
+
+def test_append_keeps_leading_whitespace(tmp_path):
+    path = tmp_path / "plugin.log"
+    content = b"   \n  indented traceback line\n2026-10-18 12:00:00 INFO done\n"
+    path.write_bytes(content)
+    log_archive = archive.LogArchive(tmp_path / "archive", chunk_size=40)
+    with open(path, "rb") as f:
+        chunks = log_archive.append("plugin", f.fileno(), 0, len(content))
+    assert chunks == len(log_archive.index("plugin"))
+    assert sum(entry["lines"] for entry in log_archive.index("plugin")) == 3
+    assert log_archive.read("plugin") == ["   ", "  indented traceback line", "2026-10-18 12:00:00 INFO done"]
+
+
+def test_read_filters_by_time(tmp_path):
+    path = tmp_path / "plugin.log"
+    lines = [f"2026-10-{day:02d} 08:00:00 INFO day {day}\n" for day in range(1, 11)]
+    content = "".join(lines).encode()
+    path.write_bytes(content)
+    log_archive = archive.LogArchive(tmp_path / "archive", chunk_size=100)
+    with open(path, "rb") as f:
+        log_archive.append("plugin", f.fileno(), 0, len(content))
+    assert log_archive.read("plugin", start="2026-10-03", end="2026-10-04") == [
+        "2026-10-03 08:00:00 INFO day 3", "2026-10-04 08:00:00 INFO day 4"]
+    assert os.path.exists(tmp_path / "archive" / "plugin.idx")
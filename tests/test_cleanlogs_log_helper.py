@@ -0,0 +1,131 @@
+import logging
+import os
+import random
+import time
+
+import pytest
+
+from helpers import load_plugin_module
+
+log_helper = load_plugin_module("cleanlogs", "log_helper")
+
+
+def make_lines(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [f"{idx:06d} {'x' * rng.randint(0, 300)}\n".encode() for idx in range(count)]
+
+
+@pytest.mark.parametrize("block_size", [7, 64, log_helper.BLOCK_SIZE])
+@pytest.mark.parametrize("rows", [0, 1, 5, 999, 1000, 5000])
+def test_tail_offset(tmp_path, block_size, rows):
+    lines = make_lines(1000)
+    path = tmp_path / "plugin.log"
+    path.write_bytes(b"".join(lines))
+    with open(path, "rb") as f:
+        offset = log_helper.tail_offset(f.fileno(), rows, path.stat().st_size, block_size=block_size)
+    assert path.read_bytes()[offset:] == b"".join(lines[len(lines) - rows:] if rows else [])
+
+
+def test_tail_offset_without_trailing_newline(tmp_path):
+    path = tmp_path / "plugin.log"
+    path.write_bytes(b"a\nb\nc")
+    with open(path, "rb") as f:
+        assert log_helper.tail_offset(f.fileno(), 2, 5) == 2
+
+
+def test_count_lines(tmp_path):
+    lines = make_lines(500)
+    path = tmp_path / "plugin.log"
+    path.write_bytes(b"".join(lines))
+    size = path.stat().st_size
+    assert log_helper.count_lines(path, 0, size, block_size=100) == 500
+    start = len(b"".join(lines[:200]))
+    assert log_helper.count_lines(path, start, size) == 300
+
+
+@pytest.mark.parametrize("rows", [1, 10, 777])
+def test_truncate_head_copy(tmp_path, rows):
+    lines = make_lines(2000, seed=rows)
+    path = tmp_path / "plugin.log"
+    path.write_bytes(b"".join(lines))
+    archived = []
+
+    def archive(fd, start, end):
+        archived.append(os.pread(fd, end - start, start))
+
+    removed, kept = log_helper.truncate_head(path, rows, log_helper.MODE_COPY, archive=archive)
+    expected = b"".join(lines[-rows:])
+    assert path.read_bytes() == expected
+    assert kept == len(expected)
+    assert removed == len(b"".join(lines)) - kept
+    assert b"".join(archived) == b"".join(lines[:-rows])
+
+
+@pytest.mark.parametrize("count", [6700, 6701, 6763])
+def test_truncate_head_collapse_unaligned_cut(tmp_path, count):
+    # 64 字节一行，不同行数使切点落在块内不同位置
+    lines = [f"{idx:063d}\n".encode() for idx in range(count)]
+    content = b"".join(lines)
+    path = tmp_path / "plugin.log"
+    path.write_bytes(content)
+    inode = path.stat().st_ino
+    block = path.stat().st_blksize
+    archived = []
+
+    def archive(fd, start, end):
+        archived.append(os.pread(fd, end - start, start))
+
+    removed, kept = log_helper.truncate_head(path, 100, log_helper.MODE_COLLAPSE, archive=archive)
+    data = path.read_bytes()
+    if path.stat().st_ino != inode:
+        pytest.skip("文件系统不支持原地删除")
+    # 整块删除，保留行数不少于 rows，最多多保留一块
+    assert removed % block == 0
+    assert removed + kept == len(content)
+    assert data == content[removed:]
+    assert data.endswith(b"".join(lines[-100:]))
+    assert 100 <= data.count(b"\n") <= 100 + block // 64 + 1
+    assert b"".join(archived) == content[:removed]
+    assert removed > 0
+
+
+def test_collapse_head_keeps_file_smaller_than_block(tmp_path):
+    path = tmp_path / "plugin.log"
+    content = b"".join(f"{idx:063d}\n".encode() for idx in range(50))
+    path.write_bytes(content)
+    assert log_helper.collapse_head(path, 10) == (0, len(content))
+    assert path.read_bytes() == content
+
+
+def test_truncate_head_keeps_short_file(tmp_path):
+    path = tmp_path / "plugin.log"
+    path.write_bytes(b"a\nb\n")
+    assert log_helper.truncate_head(path, 10) == (0, 4)
+    assert path.read_bytes() == b"a\nb\n"
+
+
+def test_copy_tail_reopens_log_handler(tmp_path):
+    path = tmp_path / "plugin.log"
+    handler = logging.FileHandler(str(path), encoding="utf-8")
+    test_logger = logging.getLogger("test_copy_tail")
+    test_logger.addHandler(handler)
+    test_logger.propagate = False
+    try:
+        for idx in range(100):
+            test_logger.warning(f"line {idx}")
+        log_helper.truncate_head(path, 10)
+        test_logger.warning("after")
+        handler.flush()
+        lines = path.read_text(encoding="utf-8").splitlines()
+        assert lines == [f"line {idx}" for idx in range(90, 100)] + ["after"]
+    finally:
+        test_logger.removeHandler(handler)
+        handler.close()
+
+
+def test_token_bucket_limits_rate():
+    bucket = log_helper.TokenBucket(1000)
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.consume(1000)
+    assert time.monotonic() - start >= 1.9
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from helpers import load_plugin_module
+
+pipeline = load_plugin_module("pathmonitor", "pipeline")
+
+
+def wait_for(condition, timeout: float = 3) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_pipeline_runs_stages_in_order_and_releases_keys():
+    done = []
+    lock = threading.Lock()
+    transfer = None
+
+    def dedupe(job):
+        return job if transfer.claim(job, job.event_path) else None
+
+    def finish(job):
+        with lock:
+            done.append(job.event_path)
+        return job
+
+    transfer = pipeline.TransferPipeline([("dedupe", dedupe, 2), ("finish", finish, 3)])
+    transfer.start()
+    try:
+        for idx in range(20):
+            assert transfer.submit(pipeline.TransferJob(f"/media/{idx}.mkv"))
+        assert wait_for(lambda: len(done) == 20)
+        assert wait_for(lambda: transfer.stats()["inflight"] == 0)
+        stats = transfer.stats()["stages"]
+        assert stats["dedupe"]["processed"] == 20
+        assert stats["finish"]["processed"] == 20
+    finally:
+        transfer.stop()
+
+
+def test_pipeline_drops_duplicate_and_records_failures():
+    gate = threading.Event()
+    transfer = None
+
+    def dedupe(job):
+        return job if transfer.claim(job, "same") else None
+
+    def slow(job):
+        gate.wait(2)
+        raise RuntimeError("boom")
+
+    transfer = pipeline.TransferPipeline([("dedupe", dedupe, 1), ("slow", slow, 1)])
+    transfer.start()
+    try:
+        transfer.submit(pipeline.TransferJob("/media/a.mkv"))
+        transfer.submit(pipeline.TransferJob("/media/a.mkv"))
+        assert wait_for(lambda: transfer.stats()["stages"]["dedupe"]["processed"] == 2)
+        assert transfer.stats()["stages"]["dedupe"]["dropped"] == 1
+        gate.set()
+        assert wait_for(lambda: transfer.stats()["stages"]["slow"]["failed"] == 1)
+        # 出错后释放去重键，同一文件可以再次进入
+        assert wait_for(lambda: transfer.stats()["inflight"] == 0)
+    finally:
+        transfer.stop()
@@ -0,0 +1,133 @@
+import os
+import time
+
+import pytest
+
+from helpers import load_plugin_module
+
+scan_state = load_plugin_module("pathmonitor", "scan_state")
+walker = load_plugin_module("pathmonitor", "walker")
+
+EXTS = [".mkv", ".mp4"]
+
+
+def touch(path, data: bytes = b"x"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+def bump_mtime(path, seconds: int = 1):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+@pytest.fixture
+def state(tmp_path):
+    state = scan_state.ScanState(tmp_path / "state" / "scanstate.db")
+    yield state
+    state.close()
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "media"
+    for season in range(1, 4):
+        for episode in range(1, 6):
+            touch(root / "Show" / f"Season {season}" / f"S{season:02d}E{episode:02d}.mkv")
+    touch(root / "Movie" / "movie.mp4")
+    touch(root / "Movie" / "movie.nfo")
+    return root
+
+
+@pytest.mark.parametrize("workers", [1, 4, 16])
+def test_parallel_walker_visits_every_directory(tree, workers):
+    def visit(directory):
+        subdirs, files = [], []
+        with os.scandir(directory) as it:
+            for entry in it:
+                (subdirs if entry.is_dir() else files).append(entry.path)
+        return subdirs, files
+
+    expected = sorted(os.path.join(dirpath, name) for dirpath, _, names in os.walk(tree) for name in names)
+    assert sorted(walker.ParallelWalker(visit, workers).walk(str(tree))) == expected
+
+
+def test_parallel_walker_stops_when_abandoned(tree):
+    visits = []
+
+    def visit(directory):
+        visits.append(directory)
+        time.sleep(0.01)
+        return [entry.path for entry in os.scandir(directory) if entry.is_dir()], [directory]
+
+    walk = walker.ParallelWalker(visit, 4).walk(str(tree))
+    next(walk)
+    walk.close()
+    count = len(visits)
+    time.sleep(0.1)
+    assert len(visits) == count
+
+
+def test_walk_filters_extensions(state, tree):
+    entries = list(state.walk(tree, EXTS))
+    assert len(entries) == 16
+    assert all(entry.changed for entry in entries)
+    assert not any(entry.path.endswith(".nfo") for entry in entries)
+
+
+def test_second_walk_uses_cache(state, tree):
+    list(state.walk(tree, EXTS, workers=4))
+    before = state.stats()
+    entries = list(state.walk(tree, EXTS, workers=4))
+    after = state.stats()
+    assert len(entries) == 16
+    assert not any(entry.changed for entry in entries)
+    assert after["listed"] == before["listed"]
+    assert after["cached"] - before["cached"] == 6
+
+
+def test_walk_detects_new_changed_and_removed_files(state, tree):
+    list(state.walk(tree, EXTS))
+    new_file = tree / "Show" / "Season 1" / "S01E06.mkv"
+    touch(new_file)
+    changed_file = tree / "Movie" / "movie.mp4"
+    changed_file.write_bytes(b"longer content")
+    bump_mtime(changed_file)
+    removed_file = tree / "Show" / "Season 2" / "S02E01.mkv"
+    removed_file.unlink()
+
+    entries = {entry.path: entry for entry in state.walk(tree, EXTS)}
+    assert str(new_file) in entries and entries[str(new_file)].changed
+    assert entries[str(changed_file)].changed
+    assert entries[str(changed_file)].size == len(b"longer content")
+    assert str(removed_file) not in entries
+    assert sum(entry.changed for entry in entries.values()) == 2
+
+
+def test_removed_directory_is_forgotten(state, tree):
+    list(state.walk(tree, EXTS))
+    season = tree / "Show" / "Season 3"
+    for path in season.iterdir():
+        path.unlink()
+    season.rmdir()
+    entries = list(state.walk(tree, EXTS))
+    assert len(entries) == 11
+    assert not any("Season 3" in entry.path for entry in entries)
+
+
+def test_walk_keeps_symlinked_root(state, tree, tmp_path):
+    link = tmp_path / "link"
+    link.symlink_to(tree)
+    entries = list(state.walk(link, EXTS))
+    assert entries and all(entry.path.startswith(str(link) + os.sep) for entry in entries)
+
+
+def test_close_during_walk_does_not_block(state, tree):
+    walk = state.walk(tree, EXTS, workers=2)
+    next(walk)
+    start = time.monotonic()
+    state.close()
+    assert time.monotonic() - start < 0.5
+    # 遍历中止后关闭数据库
+    assert list(walk) == []
+    assert list(state.walk(tree, EXTS)) == []
@@ -0,0 +1,160 @@
+"""
+IntroSkip 压测：启动模拟 Emby，回放 Webhook / 入库事件，统计每个事件的请求数、耗时
+
+在 MoviePilot 目录中运行（插件已安装到 app/plugins/ad）：
+PYTHONPATH=. python /path/to/tools/ad/benchmark.py --events events.jsonl --latency 20
+PYTHONPATH=. python /path/to/tools/ad/benchmark.py --generate 200 --episodes 300
+
+事件文件每行一个 JSON：
+{"type": "webhook", "data": {WebhookEventInfo 字段}}
+{"type": "transfer", "data": {"title": 剧集名称, "series_id": 剧集id, "season": 1, "episodes": [13, 14]}}
+"""
+import argparse
+import json
+import random
+import time
+from types import SimpleNamespace
+from typing import List
+
+from app.core.event import Event
+from app.schemas import WebhookEventInfo
+from app.schemas.types import EventType
+
+from app.plugins.ad import Ad
+from app.plugins.ad.skip_helper import EmbyClient, emby_registry
+from fake_emby import FakeLibrary, FakeEmbyServer
+
+SERVER_NAME = 'FakeEmby'
+# 等待后台入库任务的最长时间（秒）
+DRAIN_TIMEOUT = 300
+
+
+class BenchmarkAd(Ad):
+    """
+    插件数据只保存在内存中，压测数据不写入插件数据库
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._memory = {}
+
+    def get_data(self, key: str = None, plugin_id: str = None):
+        if key is None:
+            return [SimpleNamespace(key=name, value=value) for name, value in self._memory.items()]
+        return self._memory.get(key)
+
+    def save_data(self, key: str, value, plugin_id: str = None):
+        self._memory[key] = value
+
+    def del_data(self, key: str, plugin_id: str = None):
+        self._memory.pop(key, None)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
+
+
+def generate_events(library: FakeLibrary, count: int, seed: int = 0) -> List[dict]:
+    """
+    随机生成播放事件：片头暂停恢复、片尾退出，夹杂拖动进度产生的重复事件
+    """
+    rng = random.Random(seed)
+    events = []
+    for _ in range(count):
+        series_id = rng.choice(list(library.series.keys()))
+        episode = rng.choice(library.episodes(series_id))
+        intro = rng.random() < 0.5
+        percentage = rng.uniform(1, 10) if intro else rng.uniform(92, 99)
+        events.append({'type': 'webhook', 'data': {
+            'event': 'playback.unpause' if intro else 'playback.stop',
+            'channel': 'emby',
+            'server_name': SERVER_NAME,
+            'media_type': 'Episode',
+            'item_name': f"Series{series_id} S{episode['ParentIndexNumber']:02d}E{episode['IndexNumber']:02d}",
+            'item_path': episode['Path'],
+            'item_id': series_id,
+            'season_id': episode['ParentIndexNumber'],
+            'episode_id': episode['IndexNumber'],
+            'user_name': rng.choice(['user1', 'user2']),
+            'percentage': percentage,
+        }})
+    return events
+
+
+def run(plugin: BenchmarkAd, fake: FakeEmbyServer, events: List[dict]) -> dict:
+    latencies, requests = [], []
+    start = time.perf_counter()
+    for item in events:
+        before = fake.total()
+        event_start = time.perf_counter()
+        if item['type'] == 'webhook':
+            plugin.hook(Event(EventType.WebhookMessage, WebhookEventInfo(**item['data'])))
+        elif item['type'] == 'transfer':
+            data = item['data']
+            for episode in data['episodes']:
+                fake.library.add_episode(data['series_id'], data['season'], episode)
+            meta = SimpleNamespace(total_episode=len(data['episodes']), begin_season=data['season'],
+                                   begin_episode=data['episodes'][0], episode_list=data['episodes'],
+                                   season_episode=f"S{data['season']:02d}")
+            plugin.episodes_hook(Event(EventType.TransferComplete, {
+                'meta': meta, 'mediainfo': SimpleNamespace(title=data['title'])}))
+        latencies.append((time.perf_counter() - event_start) * 1000)
+        requests.append(fake.total() - before)
+    # 等待后台入库任务（包括正在处理的）完成
+    if plugin._queue and not plugin._queue.join(timeout=DRAIN_TIMEOUT):
+        print(f'后台入库任务 {DRAIN_TIMEOUT}s 内未完成：{plugin._queue.pending()}')
+    wall = time.perf_counter() - start
+    writes = sum(count for endpoint, count in fake.counters().items()
+                 if endpoint in ('chapter_api/add', 'chapter_api/remove'))
+    return {
+        'events': len(events),
+        'requests': fake.total(),
+        'requests_per_event': round(fake.total() / len(events), 2) if events else 0,
+        'max_requests_per_event': max(requests, default=0),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'wall_s': round(wall, 2),
+        'writes_per_s': round(writes / wall, 2) if wall else 0,
+        'endpoints': fake.counters(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IntroSkip 压测')
+    parser.add_argument('--events', help='事件文件（JSON Lines）')
+    parser.add_argument('--generate', type=int, default=100, help='未指定事件文件时随机生成的事件数')
+    parser.add_argument('--series', type=int, default=3)
+    parser.add_argument('--seasons', type=int, default=1)
+    parser.add_argument('--episodes', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=10, help='模拟 Emby 每个请求的延迟（毫秒）')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    library = FakeLibrary(args.series, args.seasons, args.episodes)
+    fake = FakeEmbyServer(library, latency_ms=args.latency).start()
+    emby_registry.register(SERVER_NAME, EmbyClient(fake.url, 'benchmark'))
+
+    plugin = BenchmarkAd()
+    plugin.init_plugin({'enable': True, 'begin_min': '4', 'end_min': '6', 'debounce': 0,
+                        'workers': args.workers, 'mediaservers': [SERVER_NAME]})
+    # 缩短入库轮询间隔
+    plugin._queue.base_delay = 0.2
+    plugin._queue.max_delay = 1
+    try:
+        if args.events:
+            with open(args.events, encoding='utf-8') as f:
+                events = [json.loads(line) for line in f if line.strip()]
+        else:
+            events = generate_events(library, args.generate)
+        print(json.dumps(run(plugin, fake, events), ensure_ascii=False, indent=2))
+    finally:
+        plugin.stop_service()
+        emby_registry.unregister(SERVER_NAME)
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
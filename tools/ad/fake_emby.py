@@ -0,0 +1,217 @@
+"""
+离线 Emby 模拟服务器，实现插件用到的剧集、PlaybackInfo、ChapterAPI 接口，用于压测与统计请求数
+
+python tools/ad/fake_emby.py --port 8096 --series 3 --episodes 300 --latency 20
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List
+from urllib.parse import urlparse, parse_qs
+
+# 每集时长（秒）
+RUNTIME = 24 * 60
+
+
+class FakeLibrary:
+    """
+    模拟媒体库：剧集 -> 季 -> 集，以及每集的章节
+    """
+
+    def __init__(self, series: int = 1, seasons: int = 1, episodes: int = 12, runtime: int = RUNTIME):
+        self.runtime = runtime
+        # 剧集id -> [集]
+        self.series: Dict[str, List[dict]] = {}
+        # 集id -> 章节
+        self.chapters: Dict[str, List[dict]] = {}
+        self._lock = threading.Lock()
+        item_id = 100000
+        for series_idx in range(series):
+            series_id = str(1000 + series_idx)
+            self.series[series_id] = []
+            for season in range(1, seasons + 1):
+                for episode in range(1, episodes + 1):
+                    item_id += 1
+                    self.series[series_id].append({
+                        'Id': str(item_id),
+                        'Name': f'第{episode}集',
+                        'SeriesId': series_id,
+                        'ParentIndexNumber': season,
+                        'IndexNumber': episode,
+                        'RunTimeTicks': runtime * 10000000,
+                        'Path': f'/media/series{series_idx}/Season {season}/S{season:02d}E{episode:02d}.mkv',
+                    })
+                    self.chapters[str(item_id)] = []
+
+    def add_episode(self, series_id: str, season: int, episode: int) -> str:
+        """
+        模拟新集入库
+        """
+        with self._lock:
+            item_id = str(100000 + len(self.chapters) + 1)
+            self.series.setdefault(series_id, []).append({
+                'Id': item_id,
+                'Name': f'第{episode}集',
+                'SeriesId': series_id,
+                'ParentIndexNumber': season,
+                'IndexNumber': episode,
+                'RunTimeTicks': self.runtime * 10000000,
+                'Path': f'/media/{series_id}/Season {season}/S{season:02d}E{episode:02d}.mkv',
+            })
+            self.chapters[item_id] = []
+            return item_id
+
+    def episodes(self, series_id: str) -> List[dict]:
+        with self._lock:
+            return list(self.series.get(series_id, []))
+
+    def get_chapters(self, item_id: str) -> List[dict]:
+        with self._lock:
+            return [dict(chapter, Index=idx) for idx, chapter in enumerate(self.chapters.get(item_id, []))]
+
+    def remove_chapters(self, item_id: str, indexes: List[int]):
+        with self._lock:
+            chapters = self.chapters.get(item_id, [])
+            self.chapters[item_id] = [chapter for idx, chapter in enumerate(chapters) if idx not in indexes]
+
+    def add_chapter(self, item_id: str, name: str, marker_type: str, time_str: str):
+        with self._lock:
+            self.chapters.setdefault(item_id, []).append({'Name': name, 'MarkerType': marker_type, 'Time': time_str})
+
+
+# update_chapters type -> MarkerType
+MARKER_TYPES = {'intro_start': 'IntroStart', 'intro_end': 'IntroEnd', 'credits_start': 'CreditsStart'}
+
+
+class FakeEmbyServer:
+    """
+    模拟服务器，统计各接口请求次数
+    """
+
+    def __init__(self, library: FakeLibrary, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0):
+        self.library = library
+        self.latency_ms = latency_ms
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self.__handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-emby', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count(self, endpoint: str):
+        with self._lock:
+            self._counters[endpoint] = self._counters.get(endpoint, 0) + 1
+
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def total(self) -> int:
+        with self._lock:
+            return sum(self._counters.values())
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # 保持连接，与真实 Emby 一致，客户端可复用连接池
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                path = url.path.strip('/')
+                if path.startswith('emby/') and not path.startswith('emby/chapter_api'):
+                    path = path[len('emby/'):]
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000)
+                try:
+                    endpoint, body = server.route(path, query)
+                except KeyError:
+                    endpoint, body = 'not_found', None
+                server.count(endpoint)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def route(self, path: str, query: dict):
+        """
+        :return: 接口名称, 响应内容
+        """
+        library = self.library
+        match = re.fullmatch(r'Shows/(\w+)/Episodes', path)
+        if match:
+            items = library.episodes(match.group(1))
+            if query.get('Season'):
+                items = [item for item in items if item['ParentIndexNumber'] == int(query['Season'])]
+            return 'Shows/{id}/Episodes', {'Items': items, 'TotalRecordCount': len(items)}
+        if path == 'Items':
+            items = library.episodes(query.get('ParentId', ''))
+            start = int(query.get('StartIndex') or 0)
+            limit = int(query.get('Limit') or len(items))
+            return 'Items', {'Items': items[start:start + limit], 'TotalRecordCount': len(items)}
+        match = re.fullmatch(r'Items/(\w+)/PlaybackInfo', path)
+        if match:
+            return 'Items/{id}/PlaybackInfo', {'MediaSources': [{'RunTimeTicks': library.runtime * 10000000}]}
+        if path == 'emby/chapter_api/get_chapters':
+            return 'chapter_api/get_chapters', {'chapters': library.get_chapters(query['id'])}
+        if path == 'emby/chapter_api/update_chapters':
+            if query.get('action') == 'remove':
+                indexes = [int(idx) for idx in (query.get('index_list') or '').split(',') if idx]
+                library.remove_chapters(query['id'], indexes)
+                return 'chapter_api/remove', {}
+            library.add_chapter(query['id'], query.get('name'), MARKER_TYPES.get(query.get('type'), ''),
+                                query.get('time'))
+            return 'chapter_api/add', {}
+        return 'not_found', None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='离线 Emby 模拟服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8096)
+    parser.add_argument('--series', type=int, default=1, help='剧集数')
+    parser.add_argument('--seasons', type=int, default=1, help='每部剧季数')
+    parser.add_argument('--episodes', type=int, default=12, help='每季集数')
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的延迟（毫秒）')
+    args = parser.parse_args()
+    fake = FakeEmbyServer(FakeLibrary(args.series, args.seasons, args.episodes),
+                          host=args.host, port=args.port, latency_ms=args.latency)
+    print(f'Fake Emby 已启动 {fake.url}，剧集id：{",".join(fake.library.series.keys())}')
+    try:
+        fake._httpd.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()